@@ -6,22 +6,71 @@ Integra Ollama, Stable Diffusion e WebUI
 Otimizado para Docker e Windows
 """
 
+import asyncio
+import hmac
+import importlib.util
 import json
 import os
 import logging
+import re
+import sys
 import time
+import uuid
 from pathlib import Path
-from typing import AsyncGenerator
+from typing import (
+    Annotated, AsyncGenerator, Callable, Dict, List, Optional, Tuple, Union
+)
 
 import requests
-import torch
+from requests.adapters import HTTPAdapter
 import uvicorn
 from fastapi import FastAPI, HTTPException, Request, File, UploadFile, Form
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse
+from fastapi.responses import (
+    FileResponse, HTMLResponse, PlainTextResponse,
+    StreamingResponse, JSONResponse, Response
+)
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
+
+from cancellation import (
+    CancellationToken, GenerationCancelled, disconnect_guard
+)
+import metrics
+import profiling
+import quality_controller
+from audio_upload import (
+    FORM_OVERHEAD, BodySizeLimitMiddleware, receive_audio
+)
+from batch_runner import BatchRunner, parse_jsonl
+from generation_options import (
+    DEFAULT_SAMPLING, MAX_STOP_LENGTH, MAX_STOP_SEQUENCES,
+    GenerationCaps, ModelCaps, parse_duration
+)
+from image_store import ImageStore
+from job_queue import ImageJobQueue, LeaseLost
+import logging_setup
+from model_keeper import ModelKeeper, parse_keep_alive
+from model_store import HF_CACHE_DIR
+from sd_engine import (
+    SDEngine, load_init_image, load_mask_image, load_pipeline
+)
+from sd_cpu_backend import CPUBackend
+from sd_placement import PlacementPolicy
+from multiworker import (
+    PreforkServer, SharedCancellations, SharedPullStates,
+    can_fork_with_models
+)
+from pull_manager import PullJob, PullManager
+from quality_controller import (
+    QualityController, lighter_model, scaled_steps, smaller_whisper
+)
+from sd_preview import PreviewDecoder, preview_data_url
+from session_store import DEFAULT_SESSION, SessionStore
+from whisper_config import DEFAULT_CONFIG as WHISPER_DEFAULTS
+from whisper_pool import WhisperProcessPool
+from streaming import HEARTBEAT_FRAME, SSE_HEADERS, TokenStreamer, sse_event
 
 # Configurar variáveis de ambiente
 os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
@@ -29,21 +78,15 @@ os.environ["HF_HUB_DISABLE_SYMLINKS"] = "1"
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:128"
 
-# Import Diffusers e PIL após configurar ambiente
-try:
-    from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion import (  # noqa: E501
-        StableDiffusionPipeline
-    )
-    from PIL import Image
-    diffusers_available = True
-except ImportError:
-    StableDiffusionPipeline = None
-    Image = None
-    diffusers_available = False
+# Diffusers e torch só são importados quando o pipeline é carregado,
+# para o servidor responder a /api/health/live logo no arranque
+diffusers_available = importlib.util.find_spec("diffusers") is not None
 
 # Import Whisper e outros serviços
 try:
-    from whisper_service import whisper_service
+    from whisper_service import (
+        DECODING_OPTIONS, WhisperService, whisper_service
+    )
     from health_check import health_checker
     from resource_manager import resource_manager
     whisper_available = True
@@ -53,11 +96,8 @@ except ImportError:
     resource_manager = None
     whisper_available = False
 
-# Configurar logging
-logging.basicConfig(
-    level=getattr(logging, os.getenv("LOG_LEVEL", "INFO")),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+# Configurar logging (fila + listener em background)
+logging_setup.setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -67,10 +107,24 @@ class Config:
     # Configurações do servidor
     HOST = os.getenv("HOST", "0.0.0.0")
     PORT = int(os.getenv("PORT", "8001"))
+    # Com mais de um worker, os modelos são carregados antes do fork
+    WORKERS = max(1, int(os.getenv("WORKERS", "1")))
     
     # Configurações Ollama
     OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
     OLLAMA_TIMEOUT = int(os.getenv("OLLAMA_TIMEOUT", "300"))
+    OLLAMA_PRELOAD_MODELS = [
+        m.strip()
+        for m in os.getenv(
+            "OLLAMA_PRELOAD_MODELS", "llama3.2:latest"
+        ).split(",")
+        if m.strip()
+    ]
+    OLLAMA_KEEP_ALIVE = parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE", "30m"))
+    OLLAMA_KEEPER_INTERVAL = float(os.getenv("OLLAMA_KEEPER_INTERVAL", "240"))
+    OLLAMA_MAX_PARALLEL_PULLS = int(
+        os.getenv("OLLAMA_MAX_PARALLEL_PULLS", "1")
+    )
     
     # Configurações Stable Diffusion
     STABLE_DIFFUSION_MODEL = os.getenv(
@@ -78,54 +132,233 @@ class Config:
         "runwayml/stable-diffusion-v1-5"
     )
     
-    # Configurações de dispositivo
-    DEVICE = os.getenv("DEVICE", "auto")
-    if DEVICE == "auto":
-        DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    # Execução do Whisper: thread (no processo da API) ou process (pool)
+    WHISPER_EXECUTION = os.getenv("WHISPER_EXECUTION", "thread").lower()
+    WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", "2"))
+    WHISPER_THREADS_PER_WORKER = int(
+        os.getenv("WHISPER_THREADS_PER_WORKER", "0")
+    )
+
+    # Limites dos uploads de áudio (Whisper)
+    WHISPER_MAX_UPLOAD_MB = int(os.getenv("WHISPER_MAX_UPLOAD_MB", "25"))
+    WHISPER_MAX_DURATION = float(os.getenv(
+        "WHISPER_MAX_DURATION", WHISPER_DEFAULTS["max_duration"]
+    ))
+
+    # Gravação das imagens geradas
+    IMAGE_DIR = Path(os.getenv("IMAGE_DIR", "generated_images"))
+    IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "png").lower()
+    IMAGE_PNG_COMPRESS_LEVEL = int(os.getenv("IMAGE_PNG_COMPRESS_LEVEL", "3"))
+    IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "90"))
+    IMAGE_WEBP_LOSSLESS = (
+        os.getenv("IMAGE_WEBP_LOSSLESS", "false").lower() == "true"
+    )
+    IMAGE_THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "256"))
+    IMAGE_ENCODER_WORKERS = int(os.getenv("IMAGE_ENCODER_WORKERS", "2"))
+
+    # Backend da UNet/VAE em CPU: eager, channels_last, bf16, compile, onnx
+    SD_CPU_BACKEND = os.getenv("SD_CPU_BACKEND", "eager").lower()
+    # Comparar com o eager ao arrancar e voltar ao eager se divergir
+    SD_CPU_PARITY_CHECK = (
+        os.getenv("SD_CPU_PARITY_CHECK", "true").lower() == "true"
+    )
+
+    # Workers remotos de geração de imagem (sd_worker.py):
+    # local (só este nó), remote (sempre nos workers) ou auto (workers
+    # quando existem e o pipeline local está ocupado ou indisponível)
+    SD_DISPATCH = os.getenv("SD_DISPATCH", "local").lower()
+    SD_WORKER_TOKEN = os.getenv("SD_WORKER_TOKEN", "")
+    SD_WORKER_LEASE_SECONDS = float(
+        os.getenv("SD_WORKER_LEASE_SECONDS", "60")
+    )
+    SD_WORKER_MAX_ATTEMPTS = int(os.getenv("SD_WORKER_MAX_ATTEMPTS", "3"))
+    SD_WORKER_MAX_RESULT_MB = int(os.getenv("SD_WORKER_MAX_RESULT_MB", "32"))
+
+    # Lado máximo das imagens enviadas para img2img/inpaint
+    MAX_IMAGE_SIZE = int(os.getenv("MAX_IMAGE_SIZE", "1024"))
+
+    # Pré-visualizações da geração de imagem: linear, taesd ou none
+    SD_PREVIEW_METHOD = os.getenv("SD_PREVIEW_METHOD", "linear").lower()
+    SD_PREVIEW_EVERY = int(os.getenv("SD_PREVIEW_EVERY", "5"))
+    SD_PREVIEW_TAESD_MODEL = os.getenv(
+        "SD_PREVIEW_TAESD_MODEL", "madebyollin/taesd"
+    )
+    
+    # Configurações de dispositivo ("auto" resolvido no primeiro acesso)
+    DEVICE_SETTING = os.getenv("DEVICE", "auto")
+    _device = None
+
+    @property
+    def DEVICE(self) -> str:
+        """Dispositivo efetivo (importa torch apenas quando necessário)"""
+        if self._device is None:
+            device = self.DEVICE_SETTING
+            if device == "auto":
+                import torch
+                device = "cuda" if torch.cuda.is_available() else "cpu"
+            self._device = device
+        return self._device
     
     # Outras configurações
     MAX_TOKENS = int(os.getenv("MAX_TOKENS", "2048"))
+    # Tetos das opções pedidas no chat (OLLAMA_MODEL_CAPS: JSON por modelo)
+    MAX_NUM_CTX = int(os.getenv("MAX_NUM_CTX", "8192"))
+    MAX_KEEP_ALIVE = int(
+        parse_duration(os.getenv("MAX_KEEP_ALIVE", "1h")) or 3600
+    )
+    OLLAMA_MODEL_CAPS = os.getenv("OLLAMA_MODEL_CAPS", "")
+
+    # Histórico de chat persistente (SQLite WAL com escrita diferida)
+    SESSION_DB_PATH = Path(
+        os.getenv("SESSION_DB_PATH", "cache/sessions/sessions.db")
+    )
+    SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "128"))
+    SESSION_CACHE_MESSAGES = int(os.getenv("SESSION_CACHE_MESSAGES", "100"))
+    SESSION_FLUSH_INTERVAL = float(
+        os.getenv("SESSION_FLUSH_INTERVAL", "0.5")
+    )
+
+    # Degradação de qualidade com a carga: nível máximo (0 desativa; 1
+    # reduz passos SD, Whisper greedy e max_tokens; 2 também troca para
+    # Whisper e modelo Ollama mais leves)
+    QUALITY_MAX_TIER = int(os.getenv("QUALITY_MAX_TIER", "2"))
+    QUALITY_RECOVER_SECONDS = float(
+        os.getenv("QUALITY_RECOVER_SECONDS", "30")
+    )
+    # Pedidos em curso/espera e p90 de latência (s) tolerados por serviço
+    QUALITY_MAX_QUEUE = logging_setup.parse_rules(
+        os.getenv("QUALITY_MAX_QUEUE", "chat=4,image=2,whisper=3")
+    )
+    QUALITY_SLO_SECONDS = logging_setup.parse_rules(
+        os.getenv("QUALITY_SLO_SECONDS", "chat=10,image=90,whisper=20")
+    )
+    QUALITY_SD_MIN_STEPS = int(os.getenv("QUALITY_SD_MIN_STEPS", "8"))
+    QUALITY_WHISPER_MIN_MODEL = os.getenv("QUALITY_WHISPER_MIN_MODEL", "base")
+    QUALITY_CHAT_MAX_TOKENS = int(
+        os.getenv("QUALITY_CHAT_MAX_TOKENS", "512")
+    )
+
+    # Processamento em lote
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+    BATCH_CHECKPOINT_DIR = Path(
+        os.getenv("BATCH_CHECKPOINT_DIR", "cache/batch")
+    )
+
+    # Configurações de streaming SSE
+    STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))
+    STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "512"))
+    SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
     DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+    # Token dos endpoints de administração (vazio desativa-os)
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
     WSL_OPTIMIZATION = os.getenv("WSL_OPTIMIZATION", "true").lower() == "true"
 
 
 config = Config()
 
-# Modelos conhecidos com prioridade atualizada
+# Modelos conhecidos com prioridade atualizada (params_b: parâmetros em
+# mil milhões, para escolher um modelo mais leve sob carga)
 KNOWN_MODELS = [
     {
         "name": "llama3.2:latest",
         "display": "LLaMA 3.2 (Recomendado)",
-        "recommended": True
+        "recommended": True,
+        "params_b": 3.2
     },
     {
         "name": "phi3:mini",
         "display": "Phi-3 Mini (Rápido)",
-        "recommended": True
+        "recommended": True,
+        "params_b": 3.8
     },
     {
         "name": "llama3.1:latest",
         "display": "LLaMA 3.1",
-        "recommended": True
+        "recommended": True,
+        "params_b": 8.0
     },
     {
         "name": "mistral:latest",
         "display": "Mistral 7B",
-        "recommended": False
+        "recommended": False,
+        "params_b": 7.2
     },
     {
         "name": "codellama:latest",
         "display": "Code Llama",
-        "recommended": False
+        "recommended": False,
+        "params_b": 7.0
     }
 ]
 
 
+def check_token(request: Request, expected: str, header: str):
+    """
+    Validar um token partilhado num cabeçalho.
+
+    Sem token configurado o endpoint não existe (404).
+    """
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get(header, "")
+    if not hmac.compare_digest(supplied, expected):
+        raise HTTPException(status_code=403, detail="Token inválido")
+
+
+def build_prompt(message: str) -> str:
+    """Construir o prompt enviado ao Ollama"""
+    return f"Utilizador: {message}\nAssistente: "
+
+
+class TicketStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que liberta a admissão do QualityController.
+
+    O gerador liberta o ticket com a latência real quando termina; se
+    nunca chegar a correr (cliente desligado antes do corpo), é aqui
+    que o pedido sai da fila, sem contar latência.
+    """
+
+    def __init__(self, ticket, content, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.ticket.release(record=False)
+
+
 class ChatRequest(BaseModel):
     """Modelo para requisição de chat"""
     message: str
     model: str = "llama3.2:latest"
     stream: bool = True
+    session_id: str = Field(
+        DEFAULT_SESSION, min_length=1, max_length=128,
+        pattern=r"^[\w.:-]+$"
+    )
+    # Opções de geração (limitadas pelos tetos do servidor por modelo)
+    max_tokens: Optional[int] = Field(None, ge=1)
+    stop: Optional[List[Annotated[
+        str, Field(min_length=1, max_length=MAX_STOP_LENGTH)
+    ]]] = Field(None, max_length=MAX_STOP_SEQUENCES)
+    num_ctx: Optional[int] = Field(None, ge=256)
+    keep_alive: Optional[Union[int, str]] = None
+    temperature: Optional[float] = Field(None, ge=0.0, le=2.0)
+    top_p: Optional[float] = Field(None, gt=0.0, le=1.0)
+    top_k: Optional[int] = Field(None, ge=1, le=1000)
+
+    @field_validator("keep_alive")
+    @classmethod
+    def check_keep_alive(cls, value):
+        if value is None:
+            return value
+        seconds = parse_duration(value)
+        if seconds is None or seconds < 0:
+            raise ValueError("keep_alive deve ser uma duração (ex. 300, 5m)")
+        return value
 
 
 class ImageRequest(BaseModel):
@@ -138,12 +371,28 @@ class ImageRequest(BaseModel):
     guidance_scale: float = 7.5
 
 
+class WarmRequest(BaseModel):
+    """Modelo para pedido de aquecimento de modelos"""
+    models: List[str] = []
+    keep_alive: Optional[str] = None
+    pin: bool = True
+
+
+class PullRequest(BaseModel):
+    """Modelo para pedido de download de modelo"""
+    model: str
+
+
 class OllamaClient:
     """Cliente HTTP otimizado para Ollama em Docker"""
 
     def __init__(self, host: str):
         self.host = host.rstrip('/')
         self.session = requests.Session()
+        # Pool maior para pedidos concorrentes (lotes, keeper, streaming)
+        adapter = HTTPAdapter(pool_maxsize=32)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def test_connection(self) -> bool:
         """Testar conexão com Ollama (com retry para Docker)"""
@@ -153,10 +402,12 @@ class OllamaClient:
                 url = f"{self.host}/api/version"
                 response = self.session.get(url, timeout=10)
                 if response.status_code == 200:
-                    logger.info(f"✅ Ollama conectado: {response.json()}")
+                    logger.info("✅ Ollama conectado: %s", response.json())
                     return True
             except Exception as e:
-                logger.warning(f"Tentativa {attempt + 1}/{max_retries}: {e}")
+                logger.warning(
+                    "Tentativa %s/%s: %s", attempt + 1, max_retries, e
+                )
                 if attempt < max_retries - 1:
                     time.sleep(2)
         return False
@@ -169,45 +420,126 @@ class OllamaClient:
             if response.status_code == 200:
                 data = response.json()
                 models = [model["name"] for model in data.get("models", [])]
-                logger.info(f"Modelos disponíveis: {models}")
+                logger.debug("Modelos disponíveis: %s", models)
                 return models
             return []
         except Exception as e:
-            logger.error(f"Erro ao listar modelos: {e}")
+            logger.error("Erro ao listar modelos: %s", e)
             return []
 
+    def pull_stream(self, model: str):
+        """Instalar modelo, gerando as linhas de progresso do Ollama"""
+        url = f"{self.host}/api/pull"
+        payload = {"name": model, "stream": True}
+        response = None
+        try:
+            # O timeout de leitura aplica-se entre linhas de progresso
+            response = self.session.post(
+                url, json=payload, stream=True,
+                timeout=(10, config.OLLAMA_TIMEOUT)
+            )
+            response.raise_for_status()
+
+            for line in response.iter_lines(decode_unicode=True):
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except Exception as e:
+            yield {"error": str(e)}
+        finally:
+            if response is not None:
+                response.close()
+
     def pull_model(self, model: str):
         """Instalar modelo"""
         try:
-            logger.info(f"🤖 Instalando modelo: {model}")
-            url = f"{self.host}/api/pull"
-            payload = {"name": model}
-            response = self.session.post(url, json=payload, timeout=900)
-            success = response.status_code == 200
+            logger.info("🤖 Instalando modelo: %s", model)
+            status = None
+            for progress in self.pull_stream(model):
+                if "error" in progress:
+                    logger.error(
+                        "❌ Falha ao instalar %s: %s", model, progress["error"]
+                    )
+                    return False
+                status = progress.get("status", status)
+            success = status == "success"
             if success:
-                logger.info(f"✅ Modelo {model} instalado")
+                logger.info("✅ Modelo %s instalado", model)
             else:
-                logger.error(f"❌ Falha ao instalar {model}")
+                logger.error("❌ Falha ao instalar %s", model)
             return success
         except Exception as e:
-            logger.error(f"Erro ao instalar modelo {model}: {e}")
+            logger.error("Erro ao instalar modelo %s: %s", model, e)
             return False
 
-    def generate_stream(self, model: str, prompt: str):
+    def load_model(self, model: str, keep_alive=None) -> dict:
+        """Carregar modelo em memória sem gerar texto"""
+        try:
+            url = f"{self.host}/api/generate"
+            payload = {"model": model, "stream": False}
+            if keep_alive is not None:
+                payload["keep_alive"] = keep_alive
+            response = self.session.post(
+                url, json=payload, timeout=config.OLLAMA_TIMEOUT
+            )
+            if response.status_code != 200:
+                return {"error": f"HTTP {response.status_code}"}
+            return response.json()
+        except Exception as e:
+            return {"error": str(e)}
+
+    def list_running_models(self) -> list:
+        """Listar modelos carregados em memória (/api/ps)"""
+        url = f"{self.host}/api/ps"
+        response = self.session.get(url, timeout=10)
+        response.raise_for_status()
+        return response.json().get("models", [])
+
+    @staticmethod
+    def default_options() -> dict:
+        return dict(DEFAULT_SAMPLING, num_predict=config.MAX_TOKENS)
+
+    def generate(
+        self, model: str, prompt: str, keep_alive=None, options=None
+    ) -> dict:
+        """Gerar resposta completa num único pedido (sem streaming)"""
+        url = f"{self.host}/api/generate"
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": False,
+            "options": options or self.default_options()
+        }
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+
+        try:
+            response = self.session.post(
+                url, json=payload, timeout=config.OLLAMA_TIMEOUT
+            )
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.error("Erro na geração: %s", e)
+            return {"error": str(e)}
+
+    def generate_stream(
+        self, model: str, prompt: str, keep_alive=None, options=None
+    ):
         """Gerar resposta em streaming"""
         url = f"{self.host}/api/generate"
         payload = {
             "model": model,
             "prompt": prompt,
             "stream": True,
-            "options": {
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "top_k": 40,
-                "num_predict": config.MAX_TOKENS
-            }
+            "options": options or self.default_options()
         }
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
 
+        response = None
         try:
             response = self.session.post(
                 url, json=payload, stream=True, timeout=config.OLLAMA_TIMEOUT
@@ -222,8 +554,12 @@ class OllamaClient:
                     except json.JSONDecodeError:
                         continue
         except Exception as e:
-            logger.error(f"Erro no streaming: {e}")
+            logger.error("Erro no streaming: %s", e)
             yield {"error": str(e)}
+        finally:
+            # Fechar a ligação interrompe a geração no Ollama
+            if response is not None:
+                response.close()
 
 
 def load_stable_diffusion():
@@ -235,41 +571,14 @@ def load_stable_diffusion():
     try:
         logger.info("🎨 Carregando Stable Diffusion...")
         device = config.DEVICE
-        dtype = torch.float16 if device == "cuda" else torch.float32
-
-        # Carregar pipeline com configurações otimizadas
-        pipeline = StableDiffusionPipeline.from_pretrained(  # type: ignore
-            config.STABLE_DIFFUSION_MODEL,
-            torch_dtype=dtype,
-            safety_checker=None,
-            requires_safety_checker=False,
-            cache_dir="/app/cache/huggingface",
-            local_files_only=False
+        pipeline = load_pipeline(
+            config.STABLE_DIFFUSION_MODEL, device, HF_CACHE_DIR
         )
-
-        pipeline = pipeline.to(device)
-
-        # Aplicar otimizações específicas do dispositivo
-        if device == "cuda":
-            try:
-                pipeline.enable_memory_efficient_attention()
-                pipeline.enable_vae_slicing()
-                pipeline.enable_sequential_cpu_offload()
-                logger.info("✅ Otimizações CUDA aplicadas")
-            except Exception as e:
-                logger.warning(f"Algumas otimizações CUDA falharam: {e}")
-        else:
-            try:
-                pipeline.enable_vae_slicing()
-                logger.info("✅ Otimizações CPU aplicadas")
-            except Exception as e:
-                logger.warning(f"Otimizações CPU falharam: {e}")
-
-        logger.info(f"✅ Stable Diffusion pronto no {device}")
+        logger.info("✅ Stable Diffusion pronto no %s", device)
         return pipeline
 
     except Exception as e:
-        logger.error(f"❌ Erro no Stable Diffusion: {e}")
+        logger.error("❌ Erro no Stable Diffusion: %s", e)
         return None
 
 
@@ -283,14 +592,77 @@ class LLMPersonal:
             version="1.0.0"
         )
         self.ollama_client = None
+        self.model_keeper = None
+        self.pull_manager = None
         self.sd_pipeline = None
-        self.chat_history = []
+        self.sd_engine = None
+        self.whisper_pool = None
+        self.sd_placement = None
+        self.worker_queue = ImageJobQueue(
+            lease_seconds=config.SD_WORKER_LEASE_SECONDS,
+            max_attempts=config.SD_WORKER_MAX_ATTEMPTS
+        )
+        self.preview_decoder = PreviewDecoder(
+            config.SD_PREVIEW_METHOD,
+            taesd_model=config.SD_PREVIEW_TAESD_MODEL,
+            cache_dir=HF_CACHE_DIR
+        )
+        self.image_store = ImageStore(
+            config.IMAGE_DIR,
+            image_format=config.IMAGE_FORMAT,
+            png_compress_level=config.IMAGE_PNG_COMPRESS_LEVEL,
+            webp_quality=config.IMAGE_WEBP_QUALITY,
+            webp_lossless=config.IMAGE_WEBP_LOSSLESS,
+            thumbnail_size=config.IMAGE_THUMBNAIL_SIZE,
+            max_workers=config.IMAGE_ENCODER_WORKERS
+        )
+        # Gerações de imagem em curso, canceláveis por id
+        self.image_jobs: Dict[str, CancellationToken] = {}
+        # Com WORKERS>1: processos a servir, cancelamentos e estado dos
+        # downloads entre eles
+        self.workers = 1
+        self.shared_cancels: Optional[SharedCancellations] = None
+        self.shared_pulls: Optional[SharedPullStates] = None
+        self.preloaded = False
+        self.sessions = SessionStore(
+            config.SESSION_DB_PATH,
+            cache_size=config.SESSION_CACHE_SIZE,
+            cache_messages=config.SESSION_CACHE_MESSAGES,
+            flush_interval=config.SESSION_FLUSH_INTERVAL
+        )
+        self.generation_caps = GenerationCaps(
+            ModelCaps(
+                max_tokens=config.MAX_TOKENS,
+                num_ctx=config.MAX_NUM_CTX,
+                keep_alive_seconds=config.MAX_KEEP_ALIVE
+            ),
+            config.OLLAMA_MODEL_CAPS
+        )
+        self.quality = QualityController(
+            config.QUALITY_MAX_QUEUE,
+            config.QUALITY_SLO_SECONDS,
+            max_tier=config.QUALITY_MAX_TIER,
+            recover_after=config.QUALITY_RECOVER_SECONDS
+        )
+        # Whisper menor para o nível "minimal" (carregado quando preciso)
+        self.whisper_lite = None
+        self.whisper_lite_task = None
         self.available_models = []
+        self.started_at = time.perf_counter()
+        self.startup_task = None
+        self.ready = False
+        self.components = {
+            "ollama": "pending",
+            "stable_diffusion": "pending"
+        }
 
         self.setup_cors()
+        self.setup_upload_limits()
+        self.setup_metrics()
         self.setup_directories()
         self.setup_routes()
         self.app.add_event_handler("startup", self.initialize_models)
+        self.app.add_event_handler("shutdown", self.shutdown)
 
     def setup_cors(self):
         """Configurar CORS para Docker"""
@@ -302,24 +674,108 @@ class LLMPersonal:
             allow_headers=["*"],
         )
 
+    def setup_upload_limits(self):
+        """Recusar uploads de áudio grandes antes de os ler por inteiro"""
+        self.app.add_middleware(
+            BodySizeLimitMiddleware,
+            paths=("/api/whisper/transcribe", "/api/chat/voice"),
+            max_bytes=config.WHISPER_MAX_UPLOAD_MB * 1024 * 1024
+            + FORM_OVERHEAD
+        )
+
+    async def receive_audio_upload(self, audio: UploadFile) -> Path:
+        """Gravar o upload em disco por blocos e validar tamanho/duração"""
+        return await asyncio.to_thread(
+            receive_audio,
+            audio.file,
+            audio.filename,
+            config.WHISPER_MAX_UPLOAD_MB * 1024 * 1024,
+            config.WHISPER_MAX_DURATION
+        )
+
+    def setup_metrics(self):
+        """Medir a latência de todos os pedidos HTTP"""
+
+        @self.app.middleware("http")
+        async def observe_request(request: Request, call_next):
+            start = time.perf_counter()
+            # As etapas medidas durante o pedido (mesmo em threads via
+            # asyncio.to_thread) acumulam-se aqui pelo contextvar
+            timing = profiling.start_request()
+            quality_tags = quality_controller.start_request()
+            response = await call_next(request)
+            elapsed = time.perf_counter() - start
+            # Usar o template da rota para manter a cardinalidade limitada
+            route = request.scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            metrics.HTTP_REQUEST_DURATION.observe(
+                elapsed, request.method, path, str(response.status_code)
+            )
+            if request.url.path.startswith("/api/"):
+                # Em respostas em streaming cobre só até aos cabeçalhos
+                response.headers["Server-Timing"] = timing.header(elapsed)
+            tier = quality_controller.header(quality_tags)
+            if tier is not None:
+                response.headers["X-Quality-Tier"] = tier
+            if profiling.sampler.active:
+                profiling.sampler.request_finished()
+            return response
+
     def setup_directories(self):
         """Criar diretórios necessários"""
         dirs = [
-            "static", "templates", "generated_images", "logs",
-            "cache/huggingface", "cache/transformers"
+            "static", "templates", config.IMAGE_DIR, "logs",
+            HF_CACHE_DIR, "cache/transformers"
         ]
         for directory in dirs:
             Path(directory).mkdir(parents=True, exist_ok=True)
         logger.info("📁 Diretórios criados")
 
     async def initialize_models(self):
+        """Criar clientes e carregar modelos em background"""
+        # Os clientes existem de imediato; ligações e pesos vêm depois,
+        # para o servidor aceitar pedidos (liveness) durante o carregamento
+        await self.sessions.start()
+        self.worker_queue.start()
+        self.ollama_client = OllamaClient(config.OLLAMA_HOST)
+        self.model_keeper = ModelKeeper(
+            self.ollama_client,
+            models=config.OLLAMA_PRELOAD_MODELS,
+            keep_alive=config.OLLAMA_KEEP_ALIVE,
+            interval=config.OLLAMA_KEEPER_INTERVAL,
+            on_load=self.on_memory_change
+        )
+        if whisper_available and config.WHISPER_EXECUTION == "process":
+            self.whisper_pool = WhisperProcessPool(
+                whisper_service.model_name,
+                device=whisper_service.device_setting,
+                workers=config.WHISPER_WORKERS,
+                threads_per_worker=config.WHISPER_THREADS_PER_WORKER or None,
+                max_duration=config.WHISPER_MAX_DURATION,
+                fallback_decoder=whisper_service.preprocess_audio,
+                cache=whisper_service.transcription_cache,
+                decoding_options=DECODING_OPTIONS
+            )
+        self.pull_manager = PullManager(
+            self.ollama_client,
+            max_parallel=config.OLLAMA_MAX_PARALLEL_PULLS,
+            on_complete=self.on_model_pulled,
+            shared_states=self.shared_pulls
+        )
+        self.startup_task = asyncio.create_task(self.load_models())
+
+    async def load_models(self):
         """Inicializar modelos com retry para Docker"""
         try:
-            # Inicializar Ollama com retry
-            self.ollama_client = OllamaClient(config.OLLAMA_HOST)
+            connected = await asyncio.to_thread(
+                self.ollama_client.test_connection
+            )
+            self.components["ollama"] = "ready" if connected else "offline"
 
-            if self.ollama_client.test_connection():
-                local_models = self.ollama_client.list_local_models()
+            if connected:
+                local_models = await asyncio.to_thread(
+                    self.ollama_client.list_local_models
+                )
 
                 # Verificar modelos disponíveis
                 for model in KNOWN_MODELS:
@@ -330,19 +786,115 @@ class LLMPersonal:
                 if not self.available_models:
                     logger.info("Usando modelos padrão")
                     self.available_models = KNOWN_MODELS[:3]
+
+                # Pré-carregar e manter modelos fixados em memória
+                self.model_keeper.start()
             else:
                 logger.warning("❌ Ollama offline - usando modelos padrão")
                 self.available_models = KNOWN_MODELS[:3]
 
-            # Inicializar Stable Diffusion em background
-            try:
-                self.sd_pipeline = load_stable_diffusion()
-            except Exception as e:
-                logger.error(f"Stable Diffusion falhou: {e}")
-                self.sd_pipeline = None
+            # Inicializar Stable Diffusion em background (exceto se já
+            # foi carregado no processo principal antes do fork)
+            if not self.preloaded:
+                self.components["stable_diffusion"] = "loading"
+                try:
+                    self.sd_pipeline = await asyncio.to_thread(
+                        load_stable_diffusion
+                    )
+                except Exception as e:
+                    logger.error("Stable Diffusion falhou: %s", e)
+                    self.sd_pipeline = None
+                await asyncio.to_thread(self.setup_sd_engine)
+            self.components["stable_diffusion"] = (
+                "ready" if self.sd_pipeline is not None else "unavailable"
+            )
+
+            if self.whisper_pool:
+                try:
+                    await self.whisper_pool.start()
+                except Exception as e:
+                    logger.error("Pool de processos Whisper falhou: %s", e)
 
         except Exception as e:
-            logger.error(f"Erro na inicialização: {e}")
+            logger.error("Erro na inicialização: %s", e)
+        finally:
+            self.ready = True
+            logger.info(
+                "✅ Inicialização concluída em %.1fs",
+                time.perf_counter() - self.started_at
+            )
+
+    def share_between_workers(self, workers: int):
+        """Preparar, antes do fork, o estado que os workers partilham"""
+        self.workers = workers
+        self.shared_cancels = SharedCancellations()
+        self.shared_pulls = SharedPullStates()
+        self.quality.share(workers)
+
+    def preload_models(self):
+        """
+        Carregar Stable Diffusion e Whisper no processo principal.
+
+        Usado no modo multi-worker: os workers criados por fork herdam os
+        pesos por copy-on-write em vez de cada um carregar a sua cópia.
+        """
+        logger.info("📦 A pré-carregar modelos antes de criar os workers...")
+        self.sd_pipeline = load_stable_diffusion()
+        self.setup_sd_engine()
+        self.preloaded = True
+        # Em modo process os pesos vivem nos processos do pool, não aqui
+        if (whisper_available and config.WHISPER_EXECUTION != "process"
+                and not whisper_service.is_loaded):
+            whisper_service.load_model()
+
+    def setup_sd_engine(self):
+        """Criar o motor SD e a política de colocação em memória"""
+        if self.sd_pipeline is None:
+            return
+        self.sd_placement = PlacementPolicy(
+            self.sd_pipeline, config.DEVICE, resource_manager
+        )
+        backend = None
+        if config.DEVICE == "cpu":
+            try:
+                backend = CPUBackend(
+                    config.SD_CPU_BACKEND, HF_CACHE_DIR
+                ).apply(self.sd_pipeline, parity=config.SD_CPU_PARITY_CHECK)
+            except ValueError as e:
+                logger.warning("%s: a usar eager", e)
+        self.sd_engine = SDEngine(
+            self.sd_pipeline, self.sd_placement, backend
+        )
+        if resource_manager is not None:
+            resource_manager.add_listener(self.on_memory_change)
+        # Colocação inicial para o tamanho por omissão
+        self.sd_placement.apply()
+
+    def on_memory_change(self, service: str):
+        """Whisper ou Ollama reservaram/libertaram memória"""
+        if self.sd_placement is not None:
+            self.sd_placement.invalidate(service)
+
+    def on_model_pulled(self, job: PullJob):
+        """Atualizar modelos disponíveis após um download concluído"""
+        if job.status != "success":
+            return
+        known = {m["name"] for m in self.available_models}
+        for model in KNOWN_MODELS:
+            if model["name"] == job.model and model["name"] not in known:
+                self.available_models.append(model)
+
+    async def shutdown(self):
+        """Parar tarefas em background"""
+        if self.startup_task and not self.startup_task.done():
+            self.startup_task.cancel()
+        if self.model_keeper:
+            await self.model_keeper.stop()
+        if self.whisper_pool:
+            self.whisper_pool.shutdown()
+        await self.sessions.stop()
+        await self.worker_queue.stop()
+        await asyncio.to_thread(self.image_store.shutdown)
 
     def setup_routes(self):
         """Configurar todas as rotas da API"""
@@ -350,11 +902,20 @@ class LLMPersonal:
         self.app.mount(
             "/static", StaticFiles(directory="static"), name="static"
         )
-        self.app.mount(
-            "/images",
-            StaticFiles(directory="generated_images"),
-            name="images"
-        )
+
+        @self.app.get("/images/{name}")
+        async def get_image(name: str, request: Request):
+            """Imagens geradas; nomes por conteúdo são imutáveis em cache"""
+            resolved = self.image_store.resolve(name)
+            if resolved is None:
+                raise HTTPException(
+                    status_code=404, detail="Imagem não encontrada"
+                )
+            path, media_type, headers = resolved
+            etag = headers.get("ETag")
+            if etag and request.headers.get("if-none-match") == etag:
+                return Response(status_code=304, headers=headers)
+            return FileResponse(path, media_type=media_type, headers=headers)
 
         templates = Jinja2Templates(directory="templates")
 
@@ -364,6 +925,51 @@ class LLMPersonal:
                 "index.html", {"request": request}
             )
 
+        @self.app.get("/metrics")
+        async def get_metrics():
+            """Métricas no formato Prometheus"""
+            return Response(
+                content=metrics.render(), media_type=metrics.CONTENT_TYPE
+            )
+
+        @self.app.post("/api/admin/profile")
+        async def profile(
+            http_request: Request,
+            seconds: float = 10.0,
+            max_requests: int = 0,
+            interval_ms: float = 5.0
+        ):
+            """
+            Recolher um perfil por amostragem de stacks.
+
+            Termina ao fim de `seconds` ou de `max_requests` pedidos (> 0).
+            Devolve o perfil no formato folded (flamegraph.pl, speedscope).
+            Requer o cabeçalho X-Admin-Token igual a ADMIN_TOKEN.
+            """
+            check_token(http_request, config.ADMIN_TOKEN, "x-admin-token")
+            if profiling.sampler.active:
+                raise HTTPException(
+                    status_code=409, detail="Já existe um perfil em curso"
+                )
+
+            try:
+                result = await asyncio.to_thread(
+                    profiling.sampler.run,
+                    seconds, max_requests, interval_ms / 1000
+                )
+            except RuntimeError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            return PlainTextResponse(
+                result["folded"] + "\n",
+                headers={
+                    "X-Profile-Samples": str(result["samples"]),
+                    "X-Profile-Seconds": str(result["seconds"]),
+                    "Content-Disposition": (
+                        'attachment; filename="profile.folded"'
+                    )
+                }
+            )
+
         @self.app.get("/api/models")
         async def get_models():
             """Retornar lista de modelos disponíveis"""
@@ -379,8 +985,80 @@ class LLMPersonal:
             models = self.available_models or KNOWN_MODELS[:3]
             return {"models": models}
 
+        @self.app.get("/api/models/warm")
+        async def get_warm_models():
+            """Estado dos modelos fixados em memória"""
+            if not self.model_keeper:
+                raise HTTPException(
+                    status_code=503, detail="Ollama indisponível"
+                )
+            return self.model_keeper.get_status()
+
+        @self.app.post("/api/models/warm")
+        async def warm_models(request: WarmRequest):
+            """Pré-carregar modelos no Ollama e, opcionalmente, fixá-los"""
+            if not self.model_keeper:
+                raise HTTPException(
+                    status_code=503, detail="Ollama indisponível"
+                )
+
+            keep_alive = parse_keep_alive(request.keep_alive)
+            models = request.models or list(self.model_keeper.pinned)
+            results = []
+            for model in models:
+                if request.pin:
+                    self.model_keeper.pin(model, keep_alive)
+                results.append(await asyncio.to_thread(
+                    self.model_keeper.warm, model, keep_alive
+                ))
+            await asyncio.to_thread(self.model_keeper.refresh_residency)
+            return {"models": results}
+
+        @self.app.get("/api/models/pull")
+        async def list_model_pulls():
+            """Estado dos downloads de modelos"""
+            if not self.pull_manager:
+                return {"pulls": []}
+            return {"pulls": self.pull_manager.list_jobs()}
+
+        @self.app.post("/api/models/pull", status_code=202)
+        async def pull_model(request: PullRequest):
+            """Iniciar o download de um modelo em background"""
+            if not self.pull_manager:
+                raise HTTPException(
+                    status_code=503, detail="Ollama indisponível"
+                )
+            job = self.pull_manager.submit(request.model)
+            return job.to_dict()
+
+        @self.app.get("/api/models/pull/{model:path}/events")
+        async def pull_model_events(model: str):
+            """Stream SSE com o progresso de um download"""
+            if not self.pull_manager:
+                raise HTTPException(
+                    status_code=404, detail="Download não encontrado"
+                )
+            job = self.pull_manager.jobs.get(model)
+            if job is not None:
+                states = self.pull_manager.watch(job)
+            elif self.pull_manager.shared_state(model) is not None:
+                # Download pedido noutro worker: segue o estado partilhado
+                states = self.pull_manager.watch_shared(model)
+            else:
+                raise HTTPException(
+                    status_code=404, detail="Download não encontrado"
+                )
+
+            async def events():
+                async for state in states:
+                    yield sse_event(state)
+
+            return StreamingResponse(
+                events(), media_type="text/event-stream", headers=SSE_HEADERS
+            )
+
         @self.app.post("/api/chat")
-        async def chat(request: ChatRequest):
+        async def chat(request: ChatRequest, http_request: Request):
             """Endpoint principal de chat"""
             try:
                 if (not self.ollama_client or  
@@ -390,84 +1068,441 @@ class LLMPersonal:
                         detail="Ollama indisponível - verifique container"
                     )
 
-                # Adicionar ao histórico
-                self.chat_history.append({
-                    "role": "user",
-                    "content": request.message
-                })
-
-                if request.stream:
-                    return StreamingResponse(
-                        self.stream_response(request.message, request.model),
-                        media_type="text/plain"
+                # Adicionar ao histórico (gravado em background)
+                self.sessions.append(
+                    request.session_id, "user", request.message
+                )
+
+                options, keep_alive = self.chat_options(request)
+                ticket = self.quality.admit("chat")
+                try:
+                    model, options, quality = self.degrade_chat(
+                        request.model, options, ticket
                     )
-                else:
+                    if request.stream:
+                        return TicketStreamingResponse(
+                            ticket,
+                            self.stream_response(
+                                request.message, model, http_request,
+                                session_id=request.session_id,
+                                options=options, keep_alive=keep_alive,
+                                ticket=ticket, quality=quality
+                            ),
+                            media_type="text/event-stream",
+                            headers=SSE_HEADERS
+                        )
+
                     # Modo não-streaming
-                    prompt = f"Utilizador: {request.message}\nAssistente: "
-                    full_response = ""
-
-                    for chunk in self.ollama_client.generate_stream(
-                        request.model, prompt
-                    ):
-                        if "response" in chunk:
-                            full_response += chunk["response"]
-                        if chunk.get("done", False):
-                            break
-
-                    self.chat_history.append({
-                        "role": "assistant",
-                        "content": full_response
-                    })
-                    return {"response": full_response}
+                    prompt = build_prompt(request.message)
+                    async with disconnect_guard(http_request) as token:
+                        streamer = self.create_streamer(
+                            model, prompt, token,
+                            options=options, keep_alive=keep_alive
+                        )
+                        full_response = await streamer.collect()
+                except BaseException:
+                    ticket.release(record=False)
+                    raise
+                self.release_chat(ticket, streamer)
+                self.observe_chat(model, streamer)
+
+                self.sessions.append(
+                    request.session_id, "assistant", full_response
+                )
+                return {
+                    "response": full_response,
+                    "session_id": request.session_id,
+                    "done_reason": streamer.done_reason,
+                    "options": options,
+                    "quality": quality
+                }
 
             except Exception as e:
-                logger.error(f"Erro no chat: {e}")
+                logger.error("Erro no chat: %s", e)
+                metrics.ERRORS.inc("chat")
                 raise HTTPException(status_code=500, detail=str(e))
 
+        @self.app.post("/api/chat/batch")
+        async def chat_batch(
+            http_request: Request,
+            model: str = "llama3.2:latest",
+            concurrency: int = 4,
+            batch_id: Optional[str] = None
+        ):
+            """
+            Processar um lote de prompts em JSONL.
+
+            O corpo tem uma linha JSON por prompt ({"message": ...}). Os
+            resultados são devolvidos em JSONL por ordem de conclusão, com
+            o índice original. Repetir o pedido com o mesmo batch_id
+            retoma o lote a partir do checkpoint.
+            """
+            if not self.ollama_client:
+                raise HTTPException(
+                    status_code=503, detail="Ollama indisponível"
+                )
+
+            body = await http_request.body()
+            try:
+                text = body.decode("utf-8")
+            except UnicodeDecodeError:
+                raise HTTPException(
+                    status_code=400, detail="O lote deve estar em UTF-8"
+                )
+            items = parse_jsonl(text.splitlines())
+
+            checkpoint_path = None
+            if batch_id:
+                if not batch_id.replace("-", "").replace("_", "").isalnum():
+                    raise HTTPException(
+                        status_code=400, detail="batch_id inválido"
+                    )
+                checkpoint_path = (
+                    config.BATCH_CHECKPOINT_DIR / f"{batch_id}.jsonl"
+                )
+
+            keep_alive = None
+            if self.model_keeper:
+                keep_alive = self.model_keeper.keep_alive_for(model)
+
+            runner = BatchRunner(
+                self.ollama_client,
+                model=model,
+                build_prompt=build_prompt,
+                concurrency=min(
+                    max(concurrency, 1), config.BATCH_MAX_CONCURRENCY
+                ),
+                checkpoint_path=checkpoint_path,
+                keep_alive=keep_alive
+            )
+
+            async def results():
+                async for result in runner.run(items):
+                    yield json.dumps(result, ensure_ascii=False) + "\n"
+
+            headers = {"X-Batch-Items": str(len(items))}
+            if batch_id:
+                headers["X-Batch-Id"] = batch_id
+            return StreamingResponse(
+                results(), media_type="application/x-ndjson", headers=headers
+            )
+
         @self.app.post("/api/generate-image")
-        async def generate_image(request: ImageRequest):
+        async def generate_image(
+            request: ImageRequest, http_request: Request
+        ):
             """Endpoint de geração de imagens"""
             try:
-                if not self.sd_pipeline:
+                remote = self.use_remote_workers()
+                if not remote and not self.sd_pipeline:
                     raise HTTPException(
                         status_code=503,
                         detail="Stable Diffusion indisponível"
                     )
 
-                logger.info(f"🎨 Gerando: {request.prompt[:50]}...")
-                
-                # Gerar imagem com método correto
-                output = self.sd_pipeline(  # type: ignore
-                    prompt=request.prompt,
-                    negative_prompt=request.negative_prompt,
-                    num_inference_steps=request.num_inference_steps,
-                    guidance_scale=request.guidance_scale
+                logger.info(
+                    "🎨 Gerando%s: %s...",
+                    " (worker remoto)" if remote else "", request.prompt[:50]
                 )
-                result = output.images[0]  # type: ignore
 
-                # Salvar
-                timestamp = int(time.time())
-                filename = f"generated_{timestamp}.png"
-                filepath = Path("generated_images") / filename
-                result.save(filepath)
+                with self.quality.track("image") as ticket:
+                    request, quality = self.degrade_image(request, ticket)
+                    async with disconnect_guard(http_request) as token:
+                        if remote:
+                            # O worker envia a imagem, já no ImageStore
+                            result = await self.worker_queue.run(
+                                request.model_dump(), token
+                            )
+                        else:
+                            # Gerar numa thread para o cliente poder cancelar
+                            image = await asyncio.to_thread(
+                                self.run_stable_diffusion, request, token
+                            )
+                            result = await self.image_store.save(image)
+
+                result["quality"] = quality
+                return result
+
+            except HTTPException:
+                raise
+            except GenerationCancelled as e:
+                logger.info("🛑 Geração de imagem cancelada: %s", e)
+                raise HTTPException(status_code=499, detail=str(e))
+            except Exception as e:
+                logger.error("Erro na geração de imagem: %s", e)
+                metrics.ERRORS.inc("image")
+                raise HTTPException(status_code=500, detail=str(e))
 
-                logger.info(f"✅ Imagem salva: {filename}")
-                return {
-                    "success": True,
-                    "image_url": f"/images/{filename}",
-                    "filename": filename
-                }
+        @self.app.post("/api/workers/lease")
+        async def worker_lease(
+            http_request: Request, worker_id: str, wait: float = 25.0
+        ):
+            """Long-poll de um worker: próximo job com lease, ou 204"""
+            check_token(
+                http_request, config.SD_WORKER_TOKEN, "x-worker-token"
+            )
+            job = await self.worker_queue.lease(
+                worker_id, min(max(wait, 0.0), 60.0)
+            )
+            if job is None:
+                return Response(status_code=204)
+            return {
+                "job_id": job.id,
+                "lease_id": job.lease_id,
+                "lease_seconds": self.worker_queue.lease_seconds,
+                "request": job.request
+            }
+
+        @self.app.post("/api/workers/jobs/{job_id}/heartbeat")
+        async def worker_heartbeat(
+            job_id: str, lease_id: str, http_request: Request
+        ):
+            """Renovar o lease; 409 se o job foi cancelado ou reatribuído"""
+            check_token(
+                http_request, config.SD_WORKER_TOKEN, "x-worker-token"
+            )
+            try:
+                self.worker_queue.heartbeat(job_id, lease_id)
+            except LeaseLost:
+                raise HTTPException(status_code=409, detail="Lease perdido")
+            return {"success": True}
+
+        @self.app.post("/api/workers/jobs/{job_id}/result")
+        async def worker_result(
+            job_id: str,
+            http_request: Request,
+            lease_id: str = Form(...),
+            image: UploadFile = File(...)
+        ):
+            """Imagem gerada por um worker"""
+            check_token(
+                http_request, config.SD_WORKER_TOKEN, "x-worker-token"
+            )
+            try:
+                job = self.worker_queue.lease_holder(job_id, lease_id)
+            except LeaseLost:
+                raise HTTPException(status_code=409, detail="Lease perdido")
+            data = await image.read(
+                config.SD_WORKER_MAX_RESULT_MB * 1024 * 1024 + 1
+            )
+            if len(data) > config.SD_WORKER_MAX_RESULT_MB * 1024 * 1024:
+                raise HTTPException(status_code=413, detail="Imagem grande")
 
+            try:
+                result = await self.image_store.save_encoded(data)
+            except Exception as e:
+                raise HTTPException(
+                    status_code=400, detail=f"Imagem inválida: {e}"
+                )
+            result["worker"] = job.worker_id
+            try:
+                self.worker_queue.complete(job_id, lease_id, result)
+            except LeaseLost:
+                raise HTTPException(status_code=409, detail="Lease perdido")
+            return {"success": True}
+
+        @self.app.post("/api/workers/jobs/{job_id}/fail")
+        async def worker_fail(
+            job_id: str, lease_id: str, http_request: Request,
+            error: str = "erro desconhecido"
+        ):
+            """Falha reportada pelo worker"""
+            check_token(
+                http_request, config.SD_WORKER_TOKEN, "x-worker-token"
+            )
+            try:
+                self.worker_queue.fail(job_id, lease_id, error[:500])
+            except LeaseLost:
+                raise HTTPException(status_code=409, detail="Lease perdido")
+            return {"success": True}
+
+        async def generate_from_upload(
+            http_request: Request, mode: str, request: ImageRequest,
+            inputs: dict
+        ):
+            """img2img/inpaint com cancelamento e resposta como txt2img"""
+            if not 0.0 < inputs["strength"] <= 1.0:
+                raise HTTPException(
+                    status_code=400,
+                    detail="strength deve estar entre 0 e 1"
+                )
+            try:
+                logger.info("🎨 %s: %s...", mode, request.prompt[:50])
+                with self.quality.track("image") as ticket:
+                    request, quality = self.degrade_image(request, ticket)
+                    async with disconnect_guard(http_request) as token:
+                        image = await asyncio.to_thread(
+                            self.run_stable_diffusion, request, token,
+                            None, mode, inputs
+                        )
+                    result = await self.image_store.save(image)
+                result["quality"] = quality
+                return result
+
+            except GenerationCancelled as e:
+                logger.info("🛑 Geração de imagem cancelada: %s", e)
+                raise HTTPException(status_code=499, detail=str(e))
             except Exception as e:
-                logger.error(f"Erro na geração de imagem: {e}")
+                logger.error("Erro na geração de imagem (%s): %s", mode, e)
+                metrics.ERRORS.inc("image")
                 raise HTTPException(status_code=500, detail=str(e))
 
+        def read_upload_image(data: bytes):
+            """Validar a imagem enviada (400 se não for uma imagem)"""
+            try:
+                return load_init_image(data, config.MAX_IMAGE_SIZE)
+            except Exception as e:
+                raise HTTPException(
+                    status_code=400, detail=f"Imagem inválida: {e}"
+                )
+
+        @self.app.post("/api/img2img")
+        async def image_to_image(
+            http_request: Request,
+            image: UploadFile = File(...),
+            prompt: str = Form(...),
+            negative_prompt: str = Form(""),
+            strength: float = Form(0.75),
+            num_inference_steps: int = Form(20),
+            guidance_scale: float = Form(7.5)
+        ):
+            """Transformar uma imagem enviada a partir de um prompt"""
+            if not self.sd_pipeline:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Stable Diffusion indisponível"
+                )
+            init_image = read_upload_image(await image.read())
+            request = ImageRequest(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                width=init_image.width,
+                height=init_image.height,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale
+            )
+            return await generate_from_upload(
+                http_request, "img2img", request,
+                {"image": init_image, "strength": strength}
+            )
+
+        @self.app.post("/api/inpaint")
+        async def inpaint(
+            http_request: Request,
+            image: UploadFile = File(...),
+            mask: UploadFile = File(...),
+            prompt: str = Form(...),
+            negative_prompt: str = Form(""),
+            strength: float = Form(1.0),
+            num_inference_steps: int = Form(20),
+            guidance_scale: float = Form(7.5)
+        ):
+            """Repintar a área branca da máscara numa imagem enviada"""
+            if not self.sd_pipeline:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Stable Diffusion indisponível"
+                )
+            init_image = read_upload_image(await image.read())
+            try:
+                mask_data = await mask.read()
+                mask_image = load_mask_image(mask_data, init_image.size)
+            except Exception as e:
+                raise HTTPException(
+                    status_code=400, detail=f"Máscara inválida: {e}"
+                )
+            request = ImageRequest(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                width=init_image.width,
+                height=init_image.height,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale
+            )
+            return await generate_from_upload(
+                http_request, "inpaint", request,
+                {
+                    "image": init_image,
+                    "mask_image": mask_image,
+                    "strength": strength
+                }
+            )
+
+        @self.app.post("/api/generate-image/stream")
+        async def generate_image_stream(
+            request: ImageRequest, preview_every: Optional[int] = None
+        ):
+            """Geração de imagem com progresso e pré-visualizações (SSE)"""
+            if not self.sd_pipeline:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Stable Diffusion indisponível"
+                )
+            if preview_every is None:
+                preview_every = config.SD_PREVIEW_EVERY
+            if config.SD_PREVIEW_METHOD == "none":
+                preview_every = 0
+
+            ticket = self.quality.admit("image")
+            try:
+                request, quality = self.degrade_image(request, ticket)
+                return TicketStreamingResponse(
+                    ticket,
+                    self.stream_image(request, preview_every, ticket, quality),
+                    media_type="text/event-stream",
+                    headers=SSE_HEADERS
+                )
+            except BaseException:
+                ticket.release(record=False)
+                raise
+
+        @self.app.post("/api/generate-image/{job_id}/cancel")
+        async def cancel_image(job_id: str):
+            """Cancelar uma geração de imagem em curso"""
+            token = self.image_jobs.get(job_id)
+            if token is None:
+                # A geração pode estar noutro worker: deixar o pedido
+                # onde o worker que a corre o vê no passo seguinte
+                if (self.shared_cancels is not None
+                        and re.fullmatch(r"[0-9a-f]{12}", job_id)):
+                    self.shared_cancels.request(job_id)
+                    return {"success": True, "job_id": job_id,
+                            "forwarded": True}
+                raise HTTPException(
+                    status_code=404, detail="Geração não encontrada"
+                )
+            token.cancel("cancelado pelo utilizador")
+            return {"success": True, "job_id": job_id}
+
         @self.app.post("/api/clear-history")
-        async def clear_history():
+        async def clear_history(session_id: str = DEFAULT_SESSION):
             """Limpar histórico de chat"""
-            self.chat_history.clear()
+            self.sessions.clear(session_id)
             return {"success": True, "message": "Histórico limpo"}
 
+        @self.app.get("/api/sessions")
+        async def list_sessions(limit: int = 50, offset: int = 0):
+            """Sessões de chat, da mais recente para a mais antiga"""
+            return {
+                "sessions": await self.sessions.list_sessions(
+                    min(limit, 500), offset
+                )
+            }
+
+        @self.app.get("/api/sessions/{session_id}/history")
+        async def get_session_history(
+            session_id: str, limit: int = 50, offset: int = 0
+        ):
+            """
+            Histórico paginado de uma sessão.
+
+            offset conta a partir da mensagem mais recente; cada página vem
+            por ordem cronológica.
+            """
+            return await self.sessions.history(
+                session_id, min(limit, 500), offset
+            )
+
         @self.app.get("/api/status")
         async def get_status():
             """Status completo da aplicação"""
@@ -476,9 +1511,10 @@ class LLMPersonal:
                 self.ollama_client.test_connection()
             )
             
-            # Informações do sistema
+            # Informações do sistema (sem forçar o import do torch)
             gpu_info = "N/A"
-            if torch.cuda.is_available():
+            torch = sys.modules.get("torch")
+            if torch is not None and torch.cuda.is_available():
                 gpu_info = torch.cuda.get_device_name(0)
                 
             return {
@@ -486,12 +1522,43 @@ class LLMPersonal:
                 "stable_diffusion": self.sd_pipeline is not None,
                 "device": config.DEVICE,
                 "gpu_info": gpu_info,
-                "chat_history_length": len(self.chat_history),
+                "sessions": self.sessions.get_status(),
                 "available_models": len(self.available_models),
                 "diffusers_available": diffusers_available,
+                "model_keeper": (
+                    self.model_keeper.get_status()
+                    if self.model_keeper else None
+                ),
+                "sd_engine": (
+                    self.sd_engine.get_status() if self.sd_engine else None
+                ),
+                "logging": logging_setup.get_status(),
+                "quality": self.quality.get_status(),
+                "sd_workers": self.worker_queue.get_status(),
+                "sd_placement": (
+                    self.sd_placement.get_status()
+                    if self.sd_placement else None
+                ),
                 "version": "1.0.0-docker"
             }
 
+        @self.app.get("/api/health/live")
+        async def liveness():
+            """Liveness: o processo está a servir pedidos"""
+            return {"status": "alive", "timestamp": time.time()}
+
+        @self.app.get("/api/health/ready")
+        async def readiness():
+            """Readiness: inicialização concluída (modelos carregados)"""
+            payload = {
+                "status": "ready" if self.ready else "starting",
+                "components": self.components,
+                "uptime_s": round(time.perf_counter() - self.started_at, 3)
+            }
+            return JSONResponse(
+                content=payload, status_code=200 if self.ready else 503
+            )
+
         @self.app.get("/api/health")
         async def health_check():
             """Health check para Docker"""
@@ -505,6 +1572,7 @@ class LLMPersonal:
         
         @self.app.post("/api/whisper/transcribe")
         async def transcribe_audio(
+            http_request: Request,
             audio: UploadFile = File(...),
             language: str = Form("pt")
         ):
@@ -513,7 +1581,7 @@ class LLMPersonal:
             
             Args:
                 audio: Ficheiro de áudio
-                language: Código do idioma (pt, en, es, etc.)
+                language: Código do idioma (pt, en, es, etc.) ou "auto"
             """
             if not whisper_service:
                 raise HTTPException(status_code=503, detail="Whisper não disponível")
@@ -523,28 +1591,40 @@ class LLMPersonal:
                 if not audio.content_type.startswith('audio/'):
                     raise HTTPException(status_code=400, detail="Ficheiro deve ser de áudio")
                 
-                # Ler dados do áudio
-                audio_data = await audio.read()
-                
-                # Reservar recursos
-                if not resource_manager.reserve_whisper():
-                    raise HTTPException(status_code=503, detail="Recursos não disponíveis")
+                # Gravar o áudio em disco (limites de tamanho e duração)
+                audio_path = await self.receive_audio_upload(audio)
                 
                 try:
-                    # Transcrever
-                    result = whisper_service.transcribe(audio_data, language)
-                    
-                    if "error" in result:
-                        raise HTTPException(status_code=500, detail=result["error"])
-                    
-                    return JSONResponse(content=result)
+                    # Reservar recursos
+                    if not resource_manager.reserve_whisper():
+                        raise HTTPException(status_code=503, detail="Recursos não disponíveis")
                     
+                    try:
+                        # Transcrever numa thread, cancelando se o cliente sair
+                        async with disconnect_guard(http_request) as token:
+                            result = await self.transcribe(
+                                audio_path, language, token
+                            )
+                        
+                        if "error" in result:
+                            raise HTTPException(status_code=500, detail=result["error"])
+                        
+                        return JSONResponse(content=result)
+                        
+                    finally:
+                        # Libertar recursos
+                        resource_manager.release_whisper()
                 finally:
-                    # Libertar recursos
-                    resource_manager.release_whisper()
+                    audio_path.unlink(missing_ok=True)
                     
+            except HTTPException:
+                raise
+            except GenerationCancelled as e:
+                logger.info("🛑 Transcrição cancelada: %s", e)
+                raise HTTPException(status_code=499, detail=str(e))
             except Exception as e:
-                logger.error(f"Erro na transcrição: {e}")
+                logger.error("Erro na transcrição: %s", e)
+                metrics.ERRORS.inc("whisper")
                 raise HTTPException(status_code=500, detail=str(e))
 
         @self.app.get("/api/whisper/status")
@@ -552,6 +1632,8 @@ class LLMPersonal:
             """Retorna o status do serviço Whisper."""
             if not whisper_service:
                 return {"loaded": False, "error": "Whisper não disponível"}
+            if self.whisper_pool:
+                return self.whisper_pool.get_status()
             return whisper_service.get_status()
 
         @self.app.post("/api/whisper/load")
@@ -561,6 +1643,10 @@ class LLMPersonal:
                 raise HTTPException(status_code=503, detail="Whisper não disponível")
             
             try:
+                if self.whisper_pool:
+                    await self.whisper_pool.set_model(model_name)
+                    return {"message": f"Modelo {model_name} carregado com sucesso"}
+                
                 whisper_service.model_name = model_name
                 whisper_service.is_loaded = False
                 
@@ -576,6 +1662,7 @@ class LLMPersonal:
 
         @self.app.post("/api/chat/voice")
         async def chat_with_voice(
+            http_request: Request,
             audio: UploadFile = File(...),
             model: str = Form("llama3.2:latest"),
             language: str = Form("pt")
@@ -597,96 +1684,461 @@ class LLMPersonal:
                     raise HTTPException(status_code=503, detail="Ollama indisponível")
                 
                 # Transcrever áudio
-                audio_data = await audio.read()
-                transcription_result = whisper_service.transcribe(audio_data, language)
-                
-                if "error" in transcription_result:
-                    raise HTTPException(status_code=500, detail=transcription_result["error"])
-                
-                transcribed_text = transcription_result["text"]
-                
-                # Enviar para chat (reutilizar lógica existente)
-                prompt = f"Utilizador: {transcribed_text}\nAssistente: "
-                chat_response = ""
-                
-                for chunk in self.ollama_client.generate_stream(model, prompt):
-                    if "response" in chunk:
-                        chat_response += chunk["response"]
-                    if chunk.get("done", False):
-                        break
+                audio_path = await self.receive_audio_upload(audio)
+                async with disconnect_guard(http_request) as token:
+                    try:
+                        transcription_result = await self.transcribe(
+                            audio_path, language, token
+                        )
+                    finally:
+                        audio_path.unlink(missing_ok=True)
+                    
+                    if "error" in transcription_result:
+                        raise HTTPException(status_code=500, detail=transcription_result["error"])
+                    
+                    transcribed_text = transcription_result["text"]
+                    
+                    # Enviar para chat (reutilizar lógica existente)
+                    prompt = build_prompt(transcribed_text)
+                    options, keep_alive = self.generation_caps.resolve(model)
+                    ticket = self.quality.admit("chat")
+                    try:
+                        model, options, quality = self.degrade_chat(
+                            model, options, ticket
+                        )
+                        streamer = self.create_streamer(
+                            model, prompt, token,
+                            options=options, keep_alive=keep_alive
+                        )
+                        chat_response = await streamer.collect()
+                        token.raise_if_cancelled()
+                    except BaseException:
+                        ticket.release(record=False)
+                        raise
+                    self.release_chat(ticket, streamer)
+                    self.observe_chat(model, streamer)
                 
                 return {
                     "transcription": transcription_result,
                     "chat_response": chat_response,
-                    "original_text": transcribed_text
+                    "original_text": transcribed_text,
+                    "quality": quality
                 }
                 
+            except HTTPException:
+                raise
+            except GenerationCancelled as e:
+                logger.info("🛑 Chat por voz cancelado: %s", e)
+                raise HTTPException(status_code=499, detail=str(e))
             except Exception as e:
-                logger.error(f"Erro no chat por voz: {e}")
+                logger.error("Erro no chat por voz: %s", e)
+                metrics.ERRORS.inc("voice")
                 raise HTTPException(status_code=500, detail=str(e))
 
+    async def transcribe(
+        self, audio_path: Path, language: str,
+        cancel_token: CancellationToken
+    ) -> dict:
+        """Transcrever no pool de processos ou numa thread"""
+        ticket = self.quality.admit("whisper")
+        decoding = None
+        if ticket.tier >= 1:
+            decoding = {"num_beams": 1}
+        service = whisper_service
+        try:
+            if self.whisper_pool:
+                # Os processos do pool têm o modelo fixo: só greedy
+                result = await self.whisper_pool.transcribe(
+                    audio_path, language, cancel_token, decoding=decoding
+                )
+            else:
+                if ticket.tier >= 2:
+                    service = self.lite_whisper() or whisper_service
+                result = await asyncio.to_thread(
+                    service.transcribe, audio_path, language, cancel_token,
+                    decoding=decoding
+                )
+        except BaseException:
+            ticket.release(record=False)
+            raise
+        ticket.release(record="error" not in result)
+        return dict(result, quality={
+            "tier": ticket.name,
+            "num_beams": (decoding or DECODING_OPTIONS).get("num_beams"),
+            "model": service.model_name
+        })
+
+    def lite_whisper(self) -> Optional["WhisperService"]:
+        """
+        Whisper menor para o nível "minimal", se já estiver carregado.
+        O primeiro pedido começa a carregá-lo em background e continua
+        com o modelo principal.
+        """
+        lite = self.whisper_lite
+        if lite is None:
+            name = smaller_whisper(
+                whisper_service.model_name,
+                resource_manager.get_optimal_model() if resource_manager
+                else "",
+                config.QUALITY_WHISPER_MIN_MODEL
+            )
+            if name is None:
+                return None
+            lite = self.whisper_lite = WhisperService(
+                name, whisper_service.device_setting
+            )
+        if lite.is_loaded:
+            return lite
+        if self.whisper_lite_task is None or self.whisper_lite_task.done():
+            logger.info("🎤 A carregar Whisper reduzido: %s", lite.model_name)
+            self.whisper_lite_task = asyncio.create_task(
+                asyncio.to_thread(lite.load_model)
+            )
+        return None
+
+    def degrade_image(
+        self, request: ImageRequest, ticket
+    ) -> Tuple[ImageRequest, dict]:
+        """Menos passos SD conforme o nível de qualidade"""
+        quality = {
+            "tier": ticket.name,
+            "num_inference_steps": request.num_inference_steps
+        }
+        steps = scaled_steps(
+            request.num_inference_steps, ticket.tier,
+            config.QUALITY_SD_MIN_STEPS
+        )
+        if steps != request.num_inference_steps:
+            quality.update(
+                num_inference_steps=steps,
+                requested_steps=request.num_inference_steps
+            )
+            request = request.model_copy(
+                update={"num_inference_steps": steps}
+            )
+        return request, quality
+
+    def degrade_chat(
+        self, model: str, options: dict, ticket
+    ) -> Tuple[str, dict, dict]:
+        """Menos tokens e, no nível mínimo, um modelo mais leve"""
+        quality = {"tier": ticket.name, "model": model}
+        if ticket.tier >= 1 and config.QUALITY_CHAT_MAX_TOKENS:
+            num_predict = min(
+                options["num_predict"], config.QUALITY_CHAT_MAX_TOKENS
+            )
+            if num_predict != options["num_predict"]:
+                options = dict(options, num_predict=num_predict)
+                quality["num_predict"] = num_predict
+        if ticket.tier >= 2:
+            lighter = lighter_model(
+                model, KNOWN_MODELS,
+                (entry["name"] for entry in self.available_models)
+            )
+            if lighter is not None:
+                quality.update(model=lighter, requested_model=model)
+                model = lighter
+        return model, options, quality
+
+    def chat_options(
+        self, request: ChatRequest
+    ) -> Tuple[dict, Optional[int]]:
+        """Opções do Ollama e keep_alive pedidos, limitados pelos tetos"""
+        return self.generation_caps.resolve(
+            request.model,
+            max_tokens=request.max_tokens,
+            num_ctx=request.num_ctx,
+            stop=request.stop,
+            keep_alive=request.keep_alive,
+            sampling={
+                "temperature": request.temperature,
+                "top_p": request.top_p,
+                "top_k": request.top_k
+            }
+        )
+
+    def create_streamer(
+        self, model: str, prompt: str,
+        cancel_token: CancellationToken = None,
+        options: Optional[dict] = None,
+        keep_alive: Optional[int] = None
+    ) -> TokenStreamer:
+        """Criar streamer agregado para uma geração do Ollama"""
+        # Modelos fixados mantêm o keep_alive do keeper
+        if self.model_keeper and self.model_keeper.keep_alive_for(model):
+            keep_alive = self.model_keeper.keep_alive_for(model)
+        return TokenStreamer(
+            self.ollama_client.generate_stream(
+                model, prompt, keep_alive, options
+            ),
+            flush_interval=config.STREAM_FLUSH_INTERVAL,
+            flush_bytes=config.STREAM_FLUSH_BYTES,
+            heartbeat_interval=config.SSE_HEARTBEAT_INTERVAL,
+            cancel_token=cancel_token,
+            stop=(options or {}).get("stop")
+        )
+
+    def release_chat(self, ticket, streamer: Optional[TokenStreamer]):
+        """Fim de um pedido de chat: a latência é o time to first token"""
+        if (streamer is None or streamer.error is not None
+                or streamer.first_token_at is None):
+            ticket.release(record=False)
+            return
+        ticket.release(streamer.first_token_at - streamer.created_at)
+
+    def use_remote_workers(self) -> bool:
+        """Enviar a próxima geração txt2img para os workers remotos?"""
+        if not config.SD_WORKER_TOKEN or config.SD_DISPATCH == "local":
+            return False
+        if config.SD_DISPATCH == "remote":
+            return True
+        # auto: só com workers ativos e sem pipeline local livre
+        return self.worker_queue.active_workers() > 0 and (
+            self.sd_engine is None or self.sd_engine.busy
+        )
+
+    def run_stable_diffusion(
+        self,
+        request: ImageRequest,
+        cancel_token: CancellationToken,
+        on_step: Optional[Callable] = None,
+        mode: str = "txt2img",
+        inputs: Optional[dict] = None
+    ):
+        """
+        Executar o pipeline SD abortando no passo seguinte ao cancelamento
+
+        on_step(step, latents) é chamado no fim de cada passo (na thread
+        da geração) para reportar progresso. Para img2img/inpaint, inputs
+        leva image, mask_image e strength.
+        """
+        return self.sd_engine.generate(
+            request, cancel_token, on_step=on_step, mode=mode, inputs=inputs
+        )
+
+    async def stream_image(
+        self, request: ImageRequest, preview_every: int,
+        ticket=None, quality: Optional[dict] = None
+    ) -> AsyncGenerator[str, None]:
+        """Eventos SSE de uma geração: started, progress, done/cancelled"""
+        job_id = uuid.uuid4().hex[:12]
+        token = CancellationToken()
+        self.image_jobs[job_id] = token
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        total = request.num_inference_steps
+        started = time.perf_counter()
+
+        shared_cancels = self.shared_cancels
+
+        def on_step(step: int, latents):
+            if shared_cancels is not None and shared_cancels.requested(job_id):
+                token.cancel("cancelado pelo utilizador")
+            done_steps = step + 1
+            event = {
+                "type": "progress",
+                "step": done_steps,
+                "total": total,
+                "elapsed": round(time.perf_counter() - started, 2)
+            }
+            # A última pré-visualização seria substituída pela imagem final
+            if (preview_every and done_steps % preview_every == 0
+                    and done_steps < total):
+                preview = preview_data_url(self.preview_decoder, latents)
+                if preview is not None:
+                    event["preview"] = preview
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+        logger.info(
+            "🎨 Gerando (stream %s): %s...", job_id, request.prompt[:50]
+        )
+        task = asyncio.ensure_future(asyncio.to_thread(
+            self.run_stable_diffusion, request, token, on_step
+        ))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+
+        completed = False
+        try:
+            started_event = {"type": "started", "job_id": job_id,
+                             "total": total}
+            if quality is not None:
+                started_event["quality"] = quality
+            yield sse_event(started_event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), timeout=config.SSE_HEARTBEAT_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT_FRAME
+                    continue
+                if event is None:
+                    break
+                yield sse_event(event)
+
+            try:
+                image = task.result()
+            except GenerationCancelled as e:
+                logger.info("🛑 Geração de imagem cancelada: %s", e)
+                yield sse_event({"type": "cancelled", "job_id": job_id,
+                                 "reason": str(e)})
+                return
+
+            result = await self.image_store.save(image)
+            result.update({
+                "type": "done",
+                "job_id": job_id,
+                "elapsed": round(time.perf_counter() - started, 2),
+                "quality": quality
+            })
+            completed = True
+            yield sse_event(result)
+
+        except Exception as e:
+            logger.error("Erro na geração de imagem: %s", e)
+            metrics.ERRORS.inc("image")
+            yield sse_event({"type": "error", "job_id": job_id,
+                             "error": str(e)})
+        finally:
+            if ticket is not None:
+                ticket.release(record=completed)
+            # Cliente desligado a meio: abortar no passo seguinte
+            if not task.done():
+                token.cancel("cliente desligado")
+                # Consumir a exceção de cancelamento quando a thread terminar
+                task.add_done_callback(
+                    lambda t: t.cancelled() or t.exception()
+                )
+            self.image_jobs.pop(job_id, None)
+            if shared_cancels is not None:
+                shared_cancels.clear(job_id)
+
+    def observe_chat(self, model: str, streamer: TokenStreamer):
+        """Registar métricas de uma geração de chat"""
+        metrics.observe_chat(
+            model,
+            streamer.created_at,
+            streamer.started_at,
+            streamer.first_token_at,
+            streamer.finished_at or time.perf_counter(),
+            streamer.final_chunk,
+            arrived_at=profiling.request_started()
+        )
+
     async def stream_response(
-        self, message: str, model: str
+        self, message: str, model: str, http_request: Request = None,
+        session_id: str = DEFAULT_SESSION,
+        options: Optional[dict] = None,
+        keep_alive: Optional[int] = None,
+        ticket=None,
+        quality: Optional[dict] = None
     ) -> AsyncGenerator[str, None]:
         """Stream de chat otimizado"""
+        streamer = None
         try:
             if not self.ollama_client:
-                error_data = json.dumps({"error": "Ollama indisponível"})
-                yield f"data: {error_data}\n\n"
+                yield sse_event({"error": "Ollama indisponível"})
                 return
 
-            prompt = f"Utilizador: {message}\nAssistente: "
-            full_response = ""
+            if quality is not None:
+                yield sse_event({"quality": quality})
 
-            for chunk in self.ollama_client.generate_stream(model, prompt):
-                if "error" in chunk:
-                    error_data = json.dumps({"error": chunk["error"]})
-                    yield f"data: {error_data}\n\n"
-                    return
+            prompt = build_prompt(message)
+            token = CancellationToken()
+            streamer = self.create_streamer(
+                model, prompt, token, options=options, keep_alive=keep_alive
+            )
 
-                if "response" in chunk:
-                    content = chunk["response"]
-                    full_response += content
-                    content_data = json.dumps({"content": content})
-                    yield f"data: {content_data}\n\n"
+            if http_request is not None:
+                async with disconnect_guard(http_request, token):
+                    async for frame in streamer.events():
+                        yield frame
+            else:
+                async for frame in streamer.events():
+                    yield frame
 
-                if chunk.get("done", False):
-                    break
+            if streamer.error is not None:
+                metrics.ERRORS.inc("ollama")
+            else:
+                self.observe_chat(model, streamer)
 
-            # Adicionar ao histórico
-            self.chat_history.append({
-                "role": "assistant",
-                "content": full_response
-            })
-            done_data = json.dumps({"done": True})
-            yield f"data: {done_data}\n\n"
+            if streamer.error is None and streamer.done:
+                # Adicionar ao histórico
+                self.sessions.append(session_id, "assistant", streamer.text)
 
         except Exception as e:
             error_msg = f"Erro no chat: {str(e)}"
             logger.error(error_msg)
-            error_data = json.dumps({"error": error_msg})
-            yield f"data: {error_data}\n\n"
+            metrics.ERRORS.inc("chat")
+            yield sse_event({"error": error_msg})
+        finally:
+            if ticket is not None:
+                self.release_chat(ticket, streamer)
 
 
 def main():
     """Função principal otimizada para Docker"""
     logger.info("🐳 Iniciando LLM Pessoal no Docker...")
     logger.info("📊 Configurações:")
-    logger.info(f"   Host: {config.HOST}:{config.PORT}")
-    logger.info(f"   Ollama: {config.OLLAMA_HOST}")
-    logger.info(f"   Dispositivo: {config.DEVICE}")
-    logger.info(f"   Debug: {config.DEBUG}")
-    logger.info(f"   Diffusers: {diffusers_available}")
+    logger.info("   Host: %s:%s", config.HOST, config.PORT)
+    logger.info("   Ollama: %s", config.OLLAMA_HOST)
+    logger.info("   Dispositivo: %s", config.DEVICE_SETTING)
+    logger.info("   Debug: %s", config.DEBUG)
+    logger.info("   Diffusers: %s", diffusers_available)
+
+    workers = config.WORKERS
+    if workers > 1 and config.DEBUG:
+        logger.warning("⚠️ DEBUG ativo (reload): a usar um único worker")
+        workers = 1
+    if workers > 1 and not can_fork_with_models(config.DEVICE):
+        logger.warning(
+            "⚠️ Modelos não partilháveis por fork em %s: "
+            "a usar um único worker", config.DEVICE
+        )
+        workers = 1
+    if workers > 1 and config.WHISPER_EXECUTION == "process":
+        # Cada worker criaria o seu pool (WORKERS × WHISPER_WORKERS cópias
+        # do modelo); com threads o Whisper do pai é partilhado por fork
+        logger.warning(
+            "⚠️ WHISPER_EXECUTION=process não partilha o modelo entre "
+            "workers: a usar threads"
+        )
+        config.WHISPER_EXECUTION = "thread"
+    if (workers > 1 and config.SD_WORKER_TOKEN
+            and config.SD_DISPATCH != "local"):
+        # Leases, heartbeats e resultados têm de chegar ao processo que
+        # tem o job na fila em memória
+        logger.warning(
+            "⚠️ Workers SD remotos precisam de um só processo: "
+            "a usar um único worker"
+        )
+        workers = 1
+    logger.info("   Workers: %s", workers)
 
     app_instance = LLMPersonal()
 
+    if workers > 1:
+        app_instance.share_between_workers(workers)
+        app_instance.preload_models()
+        try:
+            PreforkServer(
+                app_instance.app, config.HOST, config.PORT, workers
+            ).run()
+        finally:
+            app_instance.shared_cancels.close()
+            app_instance.shared_pulls.close()
+        return
+
     uvicorn.run(
         app_instance.app,
         host=config.HOST,
         port=config.PORT,
         reload=config.DEBUG,
         access_log=True,
-        log_level="info"
+        log_level="info",
+        # Sem configuração própria: os logs do uvicorn (incluindo o access
+        # log) seguem para a fila do logger raiz
+        log_config=None
     )
 
 
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Receção de uploads de áudio com memória limitada.
+Limita bytes e duração antes de transcrever, grava o upload em disco por
+blocos e descodifica com ffmpeg diretamente para um único buffer float32.
+"""
+
+import logging
+import shutil
+import subprocess
+import tempfile
+import wave
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+SAMPLE_RATE = 16000
+# Margem para os restantes campos e cabeçalhos do multipart
+FORM_OVERHEAD = 64 * 1024
+# Tamanho inicial (s) do buffer de decode_audio, que duplica quando enche
+INITIAL_DECODE_SECONDS = 30.0
+
+
+class UploadRejected(HTTPException):
+    """Upload recusado (tamanho ou duração acima do limite, ou inválido)."""
+
+    def __init__(self, detail: str, status_code: int = 413):
+        super().__init__(status_code=status_code, detail=detail)
+
+
+class BodySizeLimitMiddleware:
+    """
+    Middleware ASGI que limita o corpo dos pedidos em certas rotas.
+
+    Rejeita logo pelo Content-Length e, sem ele (chunked), conta os bytes
+    à medida que chegam, abortando antes de o formulário ser todo lido.
+    """
+
+    def __init__(self, app, paths: Iterable[str], max_bytes: int):
+        self.app = app
+        self.paths = tuple(paths)
+        self.max_bytes = max_bytes
+
+    def _too_large(self) -> JSONResponse:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": (
+                f"Upload acima do limite de "
+                f"{self.max_bytes // (1024 * 1024)} MB"
+            )}
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(
+            self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        length = headers.get(b"content-length")
+        if length is not None and length.isdigit() and (
+            int(length) > self.max_bytes
+        ):
+            await self._too_large()(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise UploadRejected(
+                        f"Upload acima do limite de "
+                        f"{self.max_bytes // (1024 * 1024)} MB"
+                    )
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except UploadRejected:
+            if response_started:
+                raise
+            await self._too_large()(scope, receive, send)
+
+
+def spool_upload(source: BinaryIO, max_bytes: int, suffix: str = "") -> Path:
+    """
+    Copiar o upload para um ficheiro temporário por blocos.
+
+    Raises:
+        UploadRejected: Se exceder max_bytes
+    """
+    written = 0
+    target = tempfile.NamedTemporaryFile(
+        prefix="upload_", suffix=suffix, delete=False
+    )
+    path = Path(target.name)
+    try:
+        with target:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadRejected(
+                        f"Upload acima do limite de "
+                        f"{max_bytes // (1024 * 1024)} MB"
+                    )
+                target.write(chunk)
+        if written == 0:
+            raise UploadRejected("Ficheiro de áudio vazio", status_code=400)
+        return path
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+
+
+def probe_duration(path: Path) -> Optional[float]:
+    """
+    Duração (s) pelo cabeçalho do contentor, sem descodificar o áudio.
+
+    WAV é lido diretamente; os restantes formatos usam o ffprobe, se
+    existir. Devolve None quando não é possível determinar.
+    """
+    try:
+        with wave.open(str(path), "rb") as wav:
+            return wav.getnframes() / float(wav.getframerate())
+    except (wave.Error, EOFError, OSError):
+        pass
+
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        return None
+    try:
+        result = subprocess.run(
+            [ffprobe, "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", str(path)],
+            capture_output=True, text=True, timeout=15
+        )
+        return float(result.stdout.strip())
+    except (subprocess.SubprocessError, ValueError, OSError):
+        return None
+
+
+def receive_audio(
+    source: BinaryIO,
+    filename: Optional[str],
+    max_bytes: int,
+    max_duration: float
+) -> Path:
+    """
+    Gravar um upload de áudio e validar os limites.
+
+    Returns:
+        Caminho do ficheiro temporário (o chamador deve apagá-lo)
+    """
+    suffix = Path(filename or "").suffix[:10]
+    path = spool_upload(source, max_bytes, suffix)
+    duration = probe_duration(path)
+    if duration is not None and duration > max_duration:
+        path.unlink(missing_ok=True)
+        raise UploadRejected(
+            f"Áudio com {duration:.0f}s acima do limite de "
+            f"{max_duration:.0f}s"
+        )
+    return path
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def decode_audio_into(path: Path, target, max_duration: float,
+                      sample_rate: int = SAMPLE_RATE) -> int:
+    """
+    Descodificar para PCM mono float32 com o ffmpeg, escrevendo em target.
+
+    target é um buffer gravável (bytearray, memória partilhada, ...);
+    são lidos no máximo len(target) bytes e max_duration segundos.
+
+    Returns:
+        Número de amostras escritas
+    """
+    view = memoryview(target).cast("B")
+    capacity = len(view)
+    process = _spawn_ffmpeg(path, max_duration, sample_rate)
+    filled = 0
+    try:
+        while filled < capacity:
+            read = process.stdout.readinto(view[filled:])
+            if not read:
+                break
+            filled += read
+    finally:
+        view.release()
+        stderr = _wait_ffmpeg(process)
+    _check_ffmpeg(process, filled, stderr)
+    return filled // 4
+
+
+def _spawn_ffmpeg(path: Path, max_duration: float,
+                  sample_rate: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        ["ffmpeg", "-nostdin", "-v", "error", "-i", str(path),
+         "-t", str(max_duration), "-f", "f32le", "-ac", "1",
+         "-ar", str(sample_rate), "pipe:1"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+
+
+def _wait_ffmpeg(process: subprocess.Popen) -> bytes:
+    process.stdout.close()
+    stderr = process.stderr.read()
+    process.wait()
+    return stderr
+
+
+def _check_ffmpeg(process: subprocess.Popen, filled: int, stderr: bytes):
+    # Um erro a meio (ex. ficheiro truncado) mantém o áudio já lido
+    if process.returncode != 0 and filled == 0:
+        raise ValueError(
+            f"ffmpeg não conseguiu descodificar o áudio: "
+            f"{stderr.decode(errors='replace').strip()[:200]}"
+        )
+
+
+def pcm_capacity(max_duration: float, sample_rate: int = SAMPLE_RATE) -> int:
+    """Bytes de PCM float32 para max_duration segundos"""
+    return int(max_duration * sample_rate) * 4
+
+
+def decode_audio(path: Path, max_duration: float,
+                 sample_rate: int = SAMPLE_RATE):
+    """
+    Descodificar para PCM mono float32 a sample_rate com o ffmpeg.
+
+    O ffmpeg escreve diretamente num buffer que cresce (duplicando) à
+    medida que chega áudio, até max_duration segundos. Um bytearray com o
+    tamanho máximo seria preenchido com zeros logo na criação (~19 MB
+    para 300 s), mesmo para um clip curto.
+    """
+    import numpy as np
+
+    capacity = pcm_capacity(max_duration, sample_rate)
+    buffer = bytearray(
+        min(capacity, pcm_capacity(INITIAL_DECODE_SECONDS, sample_rate))
+    )
+    process = _spawn_ffmpeg(path, max_duration, sample_rate)
+    filled = 0
+    try:
+        while filled < capacity:
+            if filled == len(buffer):
+                buffer.extend(bytes(min(len(buffer), capacity - filled)))
+            # A vista tem de ser libertada antes de o buffer crescer
+            with memoryview(buffer)[filled:] as view:
+                read = process.stdout.readinto(view)
+            if not read:
+                break
+            filled += read
+    finally:
+        stderr = _wait_ffmpeg(process)
+    _check_ffmpeg(process, filled, stderr)
+    # Truncar em vez de copiar: o array usa o mesmo buffer
+    del buffer[filled - filled % 4:]
+    return np.frombuffer(buffer, dtype=np.float32)
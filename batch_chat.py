@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Processamento em lote de prompts pela linha de comandos
+Lê um ficheiro JSONL e escreve as respostas em JSONL
+
+Exemplo:
+    python batch_chat.py prompts.jsonl -o respostas.jsonl --concurrency 8
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+
+def parse_args(argv=None):
+    """Ler argumentos da linha de comandos"""
+    parser = argparse.ArgumentParser(
+        description="Executar um lote de prompts JSONL no Ollama"
+    )
+    parser.add_argument("input", help="Ficheiro JSONL com um prompt por linha")
+    parser.add_argument(
+        "-o", "--output",
+        help="Ficheiro JSONL de saída (por omissão, stdout)"
+    )
+    parser.add_argument("--model", default="llama3.2:latest")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--checkpoint",
+        help="Ficheiro de checkpoint (por omissão, <input>.checkpoint.jsonl)"
+    )
+    parser.add_argument("--ollama-host", help="URL do Ollama")
+    return parser.parse_args(argv)
+
+
+async def run_batch(args) -> int:
+    """Executar o lote e escrever os resultados"""
+    from app import OllamaClient, build_prompt, config
+    from batch_runner import BatchRunner, parse_jsonl
+
+    input_path = Path(args.input)
+    checkpoint_path = Path(
+        args.checkpoint or f"{input_path}.checkpoint.jsonl"
+    )
+
+    with open(input_path, encoding="utf-8") as f:
+        items = parse_jsonl(f)
+
+    client = OllamaClient(args.ollama_host or config.OLLAMA_HOST)
+    runner = BatchRunner(
+        client,
+        model=args.model,
+        build_prompt=build_prompt,
+        concurrency=args.concurrency,
+        checkpoint_path=checkpoint_path
+    )
+
+    output = sys.stdout
+    if args.output:
+        output = open(args.output, "w", encoding="utf-8")
+    errors = 0
+    completed = 0
+    try:
+        async for result in runner.run(items):
+            completed += 1
+            errors += "error" in result
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            print(
+                f"\r📦 {completed}/{len(items)} concluídos ({errors} erros)",
+                end="", file=sys.stderr
+            )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(file=sys.stderr)
+    return 1 if errors else 0
+
+
+def main(argv=None) -> int:
+    """Função principal"""
+    args = parse_args(argv)
+    try:
+        return asyncio.run(run_batch(args))
+    except KeyboardInterrupt:
+        print("\n⏸️  Lote interrompido - volte a executar para retomar",
+              file=sys.stderr)
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
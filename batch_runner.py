@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Processamento em lote de prompts contra o Ollama.
+Concorrência limitada, resultados por ordem de conclusão e checkpoints.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, AsyncGenerator, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def parse_jsonl(lines: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Ler itens de um lote em JSONL.
+
+    Cada linha não vazia é um objeto com "message" (ou "prompt") e,
+    opcionalmente, "model" e "id". O índice é a posição da linha entre
+    as linhas não vazias.
+    """
+    items = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        index = len(items)
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("cada linha deve ser um objeto JSON")
+            message = data.get("message", data.get("prompt"))
+            if not isinstance(message, str):
+                raise ValueError("campo 'message' em falta")
+            items.append({
+                "index": index,
+                "id": data.get("id"),
+                "message": message,
+                "model": data.get("model")
+            })
+        except ValueError as e:
+            items.append({"index": index, "error": f"Linha inválida: {e}"})
+    return items
+
+
+class BatchRunner:
+    """
+    Executa um lote de prompts com concorrência limitada.
+
+    Cada resultado concluído é acrescentado ao ficheiro de checkpoint,
+    pelo que um lote interrompido retoma apenas os itens em falta. Os
+    resultados guardam o hash da entrada: um checkpoint de um lote
+    diferente com o mesmo nome não é reaproveitado.
+    """
+
+    def __init__(
+        self,
+        client,
+        model: str,
+        build_prompt: Callable[[str], str],
+        concurrency: int = 4,
+        checkpoint_path: Optional[Path] = None,
+        keep_alive=None
+    ):
+        """
+        Args:
+            client: OllamaClient usado para as gerações
+            model: Modelo por omissão dos itens
+            build_prompt: Função que converte a mensagem no prompt
+            concurrency: Número máximo de pedidos em simultâneo
+            checkpoint_path: Ficheiro JSONL com resultados concluídos
+            keep_alive: keep_alive enviado ao Ollama
+        """
+        self.client = client
+        self.model = model
+        self.build_prompt = build_prompt
+        self.concurrency = max(1, concurrency)
+        self.checkpoint_path = checkpoint_path
+        self.keep_alive = keep_alive
+
+    def input_hash(self, item: Dict[str, Any]) -> str:
+        """Hash da mensagem e do modelo efetivo de um item."""
+        key = json.dumps(
+            [item.get("id"), item["message"], item.get("model") or self.model],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    def load_checkpoint(self) -> Dict[int, Dict[str, Any]]:
+        """Ler resultados já concluídos do checkpoint."""
+        done = {}
+        if not self.checkpoint_path or not self.checkpoint_path.exists():
+            return done
+        with open(self.checkpoint_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # linha parcial de uma escrita interrompida
+                if "error" not in result:
+                    done[result["index"]] = result
+        return done
+
+    def _process(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Gerar a resposta de um item (executado numa thread)."""
+        model = item.get("model") or self.model
+        result = {"index": item["index"], "id": item.get("id"), "model": model}
+        start = time.perf_counter()
+        data = self.client.generate(
+            model, self.build_prompt(item["message"]), self.keep_alive
+        )
+        result["duration_s"] = round(time.perf_counter() - start, 3)
+        if "error" in data:
+            result["error"] = data["error"]
+        else:
+            result["response"] = data.get("response", "")
+            result["eval_count"] = data.get("eval_count")
+        return result
+
+    async def run(
+        self, items: List[Dict[str, Any]]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Processar os itens, gerando resultados por ordem de conclusão."""
+        done = self.load_checkpoint()
+        pending: asyncio.Queue = asyncio.Queue()
+        results: asyncio.Queue = asyncio.Queue()
+
+        hashes: Dict[int, str] = {}
+        resumed = stale = 0
+        for item in items:
+            if "error" in item:
+                yield item
+                continue
+            hashes[item["index"]] = self.input_hash(item)
+            previous = done.get(item["index"])
+            if previous is not None:
+                if previous.pop("input_hash", None) == hashes[item["index"]]:
+                    resumed += 1
+                    yield dict(previous, resumed=True)
+                    continue
+                stale += 1
+            pending.put_nowait(item)
+
+        if stale:
+            logger.warning(
+                "Checkpoint com %d itens de outra entrada: a repetir", stale
+            )
+        total = pending.qsize()
+        if total == 0:
+            return
+        logger.info(
+            "📦 Lote: %d itens pendentes, %d retomados do checkpoint",
+            total, resumed
+        )
+
+        async def worker():
+            while True:
+                try:
+                    item = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    result = await asyncio.to_thread(self._process, item)
+                except Exception as e:
+                    result = {"index": item["index"], "error": str(e)}
+                await results.put(result)
+
+        workers = [
+            asyncio.create_task(worker())
+            for _ in range(min(self.concurrency, total))
+        ]
+        checkpoint = None
+        if self.checkpoint_path:
+            self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+            checkpoint = open(self.checkpoint_path, "a", encoding="utf-8")
+
+        try:
+            for _ in range(total):
+                result = await results.get()
+                if checkpoint:
+                    record = dict(
+                        result, input_hash=hashes[result["index"]]
+                    )
+                    checkpoint.write(json.dumps(record, ensure_ascii=False))
+                    checkpoint.write("\n")
+                    checkpoint.flush()
+                yield result
+        finally:
+            for task in workers:
+                task.cancel()
+            if checkpoint:
+                checkpoint.close()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor HTTP local que imita a API do Ollama para benchmarks.
+Emite streams NDJSON em /api/generate a um ritmo de tokens configurável.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class MockOllamaConfig:
+    """Parâmetros de latência e ritmo do Ollama simulado."""
+
+    def __init__(
+        self,
+        tokens: int = 64,
+        token_rate: float = 50.0,
+        first_token_latency: float = 0.2,
+        load_latency: float = 0.0,
+        models=("llama3.2:latest", "phi3:mini")
+    ):
+        """
+        Args:
+            tokens: Tokens gerados por resposta
+            token_rate: Tokens por segundo depois do primeiro
+            first_token_latency: Atraso (s) até ao primeiro token
+            load_latency: Atraso (s) do primeiro uso de cada modelo
+            models: Modelos reportados em /api/tags
+        """
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.first_token_latency = first_token_latency
+        self.load_latency = load_latency
+        self.models = list(models)
+        self.loaded = set()
+        self.lock = threading.Lock()
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    """Handler com os endpoints do Ollama usados pela aplicação."""
+
+    protocol_version = "HTTP/1.1"
+    config: MockOllamaConfig = None  # definido em MockOllamaServer
+
+    def log_message(self, format, *args):
+        pass  # silencioso para não distorcer os resultados
+
+    def _send_json(self, data, status: int = 200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data: dict):
+        line = (json.dumps(data) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii"))
+        self.wfile.write(line + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _load(self, model: str) -> float:
+        config = self.config
+        with config.lock:
+            cold = model not in config.loaded
+            config.loaded.add(model)
+        if cold and config.load_latency:
+            time.sleep(config.load_latency)
+            return config.load_latency
+        return 0.0
+
+    def do_GET(self):
+        config = self.config
+        if self.path == "/api/version":
+            self._send_json({"version": "0.0.0-mock"})
+        elif self.path == "/api/tags":
+            self._send_json({
+                "models": [{"name": name} for name in config.models]
+            })
+        elif self.path == "/api/ps":
+            with config.lock:
+                loaded = sorted(config.loaded)
+            self._send_json({
+                "models": [
+                    {"name": name, "size": 0, "size_vram": 0}
+                    for name in loaded
+                ]
+            })
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        if self.path == "/api/generate":
+            self._generate(self._read_json())
+        elif self.path == "/api/pull":
+            self._pull(self._read_json())
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _generate(self, payload: dict):
+        config = self.config
+        model = payload.get("model", "")
+        load_seconds = self._load(model)
+        tokens = config.tokens
+        options = payload.get("options") or {}
+        if options.get("num_predict"):
+            tokens = min(tokens, int(options["num_predict"]))
+
+        # Pedido de carregamento (sem prompt) responde de imediato
+        if not payload.get("prompt"):
+            self._send_json({
+                "model": model, "response": "", "done": True,
+                "load_duration": int(load_seconds * 1e9)
+            })
+            return
+
+        interval = 1.0 / config.token_rate if config.token_rate else 0.0
+        started = time.perf_counter()
+        time.sleep(config.first_token_latency)
+
+        if not payload.get("stream", True):
+            time.sleep(interval * max(tokens - 1, 0))
+            self._send_json({
+                "model": model,
+                "response": " ".join(f"tok{i}" for i in range(tokens)),
+                "done": True,
+                "eval_count": tokens,
+                "eval_duration": int(
+                    (time.perf_counter() - started) * 1e9
+                )
+            })
+            return
+
+        try:
+            self._start_stream()
+            for i in range(tokens):
+                if i:
+                    time.sleep(interval)
+                self._write_chunk({
+                    "model": model, "response": f"tok{i} ", "done": False
+                })
+            self._write_chunk({
+                "model": model, "response": "", "done": True,
+                "eval_count": tokens,
+                "eval_duration": int((time.perf_counter() - started) * 1e9)
+            })
+            self._end_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # cliente cancelou o stream
+
+    def _pull(self, payload: dict):
+        try:
+            self._start_stream()
+            total = 100
+            for completed in range(0, total + 1, 20):
+                self._write_chunk({
+                    "status": "downloading", "digest": "sha256:mock",
+                    "total": total, "completed": completed
+                })
+                time.sleep(0.05)
+            self._write_chunk({"status": "success"})
+            self._end_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    """Ignora ligações fechadas pelo cliente (keep-alive, cancelamentos)."""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (ConnectionError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class MockOllamaServer:
+    """Servidor Ollama simulado a correr numa thread."""
+
+    def __init__(
+        self,
+        config: Optional[MockOllamaConfig] = None,
+        host: str = "127.0.0.1",
+        port: int = 0
+    ):
+        self.config = config or MockOllamaConfig()
+        handler = type(
+            "BoundMockOllamaHandler",
+            (MockOllamaHandler,),
+            {"config": self.config}
+        )
+        self.httpd = _QuietHTTPServer((host, port), handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockOllamaServer":
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name="mock-ollama", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    """Executar o Ollama simulado como processo independente"""
+    parser = argparse.ArgumentParser(description="Ollama simulado")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--token-rate", type=float, default=50.0)
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--load-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = MockOllamaConfig(
+        tokens=args.tokens,
+        token_rate=args.token_rate,
+        first_token_latency=args.first_token_latency,
+        load_latency=args.load_latency
+    )
+    server = MockOllamaServer(config, args.host, args.port)
+    print(f"🧪 Ollama simulado em {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
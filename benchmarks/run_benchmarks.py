@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks reprodutíveis da LLM Pessoal contra um Ollama simulado
+Mede throughput, latência p50/p95/p99 e time-to-first-token
+
+Exemplo (a partir da raiz do repositório):
+    python -m benchmarks.run_benchmarks --scenarios chat,chat-stream,voice
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import socket
+import sys
+import threading
+import time
+import wave
+from array import array
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from benchmarks.mock_ollama import MockOllamaConfig, MockOllamaServer  # noqa: E402
+
+SCENARIOS = ("chat", "chat-stream", "voice", "image")
+
+# Modelos pequenos para correr em CPU sem GPU
+TINY_WHISPER_MODEL = "openai/whisper-tiny"
+TINY_SD_MODEL = "hf-internal-testing/tiny-stable-diffusion-torch"
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Percentil por interpolação linear"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low, high = math.floor(rank), math.ceil(rank)
+    if low == high:
+        return ordered[low]
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(
+    name: str, samples: List[Dict[str, Any]], elapsed: float
+) -> Dict[str, Any]:
+    """Agregar amostras de um cenário"""
+    ok = [s for s in samples if s.get("ok")]
+    latencies = [s["latency"] for s in ok]
+    ttfts = [s["ttft"] for s in ok if s.get("ttft") is not None]
+    summary = {
+        "scenario": name,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else None,
+    }
+    for pct in (50, 95, 99):
+        value = percentile(latencies, pct)
+        summary[f"latency_p{pct}_s"] = round(value, 4) if value else value
+    if ttfts:
+        for pct in (50, 95, 99):
+            summary[f"ttft_p{pct}_s"] = round(percentile(ttfts, pct), 4)
+    tokens = sum(s.get("frames", 0) for s in ok)
+    if tokens:
+        summary["frames"] = tokens
+    return summary
+
+
+def synth_wav(seconds: float = 2.0, rate: int = 16000) -> bytes:
+    """Gerar um WAV mono de 16 bits com um tom de 440 Hz"""
+    samples = array("h", (
+        int(8000 * math.sin(2 * math.pi * 440 * i / rate))
+        for i in range(int(seconds * rate))
+    ))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def free_port() -> int:
+    """Obter uma porta TCP livre"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class AppServer:
+    """Servidor uvicorn da aplicação numa thread"""
+
+    def __init__(self, app, port: int):
+        import uvicorn
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(
+            app, host="127.0.0.1", port=port, log_level="warning",
+            lifespan="on"
+        ))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout: float = 600.0):
+        self.thread.start()
+        deadline = time.time() + timeout
+        while not self.server.started:
+            if time.time() > deadline or not self.thread.is_alive():
+                raise RuntimeError("Servidor da aplicação não arrancou")
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+async def run_load(
+    name: str,
+    requests: int,
+    concurrency: int,
+    send: Callable[[Any], Any],
+    client
+) -> Dict[str, Any]:
+    """Executar um cenário com concorrência limitada"""
+    semaphore = asyncio.Semaphore(concurrency)
+    samples: List[Dict[str, Any]] = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                sample = await send(client)
+            except Exception as e:
+                sample = {"ok": False, "error": str(e)}
+            sample["latency"] = time.perf_counter() - start
+            if sample.get("ttft") is not None:
+                sample["ttft"] -= start
+            samples.append(sample)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return summarize(name, samples, time.perf_counter() - start)
+
+
+def make_scenarios(args) -> Dict[str, Callable[[Any], Any]]:
+    """Funções que enviam um pedido de cada cenário"""
+    audio = synth_wav(args.audio_seconds)
+
+    async def chat(client):
+        response = await client.post("/api/chat", json={
+            "message": "Olá!", "model": args.model, "stream": False
+        })
+        return {"ok": response.status_code == 200}
+
+    async def chat_stream(client):
+        ttft = None
+        frames = 0
+        async with client.stream("POST", "/api/chat", json={
+            "message": "Olá!", "model": args.model, "stream": True
+        }) as response:
+            async for line in response.aiter_lines():
+                if line.startswith('data: {"content"'):
+                    frames += 1
+                    if ttft is None:
+                        ttft = time.perf_counter()
+            ok = response.status_code == 200
+        return {"ok": ok, "ttft": ttft, "frames": frames}
+
+    async def voice(client):
+        response = await client.post(
+            "/api/chat/voice",
+            files={"audio": ("bench.wav", audio, "audio/wav")},
+            data={"model": args.model, "language": "pt"}
+        )
+        return {"ok": response.status_code == 200}
+
+    async def image(client):
+        response = await client.post("/api/generate-image", json={
+            "prompt": "a red cube",
+            "num_inference_steps": args.sd_steps,
+            "guidance_scale": 7.5
+        })
+        return {"ok": response.status_code == 200}
+
+    return {
+        "chat": chat,
+        "chat-stream": chat_stream,
+        "voice": voice,
+        "image": image,
+    }
+
+
+async def run_scenarios(args, base_url: str) -> List[Dict[str, Any]]:
+    import httpx
+
+    senders = make_scenarios(args)
+    results = []
+    timeout = httpx.Timeout(args.request_timeout)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        for name in args.scenarios:
+            requests = args.requests
+            if name in ("voice", "image"):
+                requests = min(requests, args.heavy_requests)
+            # Aquecimento: primeiro pedido fora das estatísticas
+            await run_load(name, 1, 1, senders[name], client)
+            result = await run_load(
+                name, requests, args.concurrency, senders[name], client
+            )
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def print_result(result: Dict[str, Any]):
+    """Mostrar o resumo de um cenário"""
+    print(f"\n📊 {result['scenario']}")
+    for key, value in result.items():
+        if key != "scenario":
+            print(f"   {key}: {value}")
+
+
+def configure_environment(args, ollama_url: str):
+    """Configurar a aplicação antes de a importar"""
+    os.environ["OLLAMA_HOST"] = ollama_url
+    os.environ["OLLAMA_PRELOAD_MODELS"] = ""
+    os.environ.setdefault("DEVICE", "cpu")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["STABLE_DIFFUSION_MODEL"] = args.sd_model
+    if not args.allow_download:
+        os.environ["MODEL_STORE_MODE"] = "offline"
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        os.environ["TRANSFORMERS_OFFLINE"] = "1"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks da LLM Pessoal com Ollama simulado"
+    )
+    parser.add_argument(
+        "--scenarios", default="chat,chat-stream",
+        help=f"Cenários separados por vírgula: {', '.join(SCENARIOS)}"
+    )
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--heavy-requests", type=int, default=5,
+                        help="Máximo de pedidos para voice/image")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--model", default="llama3.2:latest")
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--token-rate", type=float, default=200.0)
+    parser.add_argument("--first-token-latency", type=float, default=0.05)
+    parser.add_argument("--audio-seconds", type=float, default=2.0)
+    parser.add_argument("--whisper-model", default=TINY_WHISPER_MODEL)
+    parser.add_argument("--sd-model", default=TINY_SD_MODEL)
+    parser.add_argument("--sd-steps", type=int, default=2)
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument(
+        "--allow-download", action="store_true",
+        help="Permitir downloads do Hugging Face (por omissão: offline)"
+    )
+    parser.add_argument("--json", help="Guardar resultados em JSON")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Cenários desconhecidos: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None) -> int:
+    """Função principal"""
+    args = parse_args(argv)
+    mock_config = MockOllamaConfig(
+        tokens=args.tokens,
+        token_rate=args.token_rate,
+        first_token_latency=args.first_token_latency,
+        models=(args.model,)
+    )
+
+    with MockOllamaServer(mock_config) as mock:
+        configure_environment(args, mock.url)
+
+        # Importar só depois de configurar o ambiente
+        from app import LLMPersonal, whisper_service
+
+        if whisper_service is not None:
+            whisper_service.model_name = args.whisper_model
+            whisper_service.is_loaded = False
+
+        app_instance = LLMPersonal()
+        server = AppServer(app_instance.app, free_port())
+        print(f"🚀 Aplicação em {server.url}, Ollama simulado em {mock.url}")
+        server.start()
+        try:
+            results = asyncio.run(run_scenarios(args, server.url))
+        finally:
+            server.stop()
+
+    if args.json:
+        report = {
+            "timestamp": time.time(),
+            "parameters": {
+                k: v for k, v in vars(args).items() if k != "json"
+            },
+            "results": results
+        }
+        Path(args.json).write_text(
+            json.dumps(report, indent=2, ensure_ascii=False),
+            encoding="utf-8"
+        )
+        print(f"\n💾 Resultados guardados em {args.json}")
+
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark do tempo de arranque da LLM Pessoal
+Mede o custo de `import app` com `python -X importtime`, compara com um
+orçamento e guarda o histórico para acompanhar regressões
+
+Exemplo (a partir da raiz do repositório):
+    python -m benchmarks.startup_time --budget-ms 800 --serve
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+HISTORY_FILE = Path(__file__).resolve().parent / "startup_history.jsonl"
+
+# Módulos pesados que não devem ser importados com `import app`
+HEAVY_MODULES = ("torch", "diffusers", "transformers", "librosa", "pydub")
+
+
+def measure_import(module: str = "app") -> Tuple[float, List[Tuple[str, int]]]:
+    """
+    Importar o módulo num processo novo com -X importtime.
+
+    Returns:
+        Tempo total (ms) e imports diretos (módulo, cumulativo em µs)
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} falhou:\n{result.stderr}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # A indentação do nome indica o nível de aninhamento
+        entries.append((name[1:].rstrip(), int(cumulative)))
+
+    top_level = [(n, us) for n, us in entries if not n.startswith(" ")]
+    top_level.sort(key=lambda item: item[1], reverse=True)
+    total_us = next(
+        (us for name, us in top_level if name == module),
+        sum(us for _, us in top_level)
+    )
+    # Dependências diretas do módulo, ordenadas por custo
+    direct = [
+        (n.strip(), us) for n, us in entries
+        if n.startswith("  ") and not n.startswith("    ")
+    ]
+    direct.sort(key=lambda item: item[1], reverse=True)
+    return total_us / 1000.0, direct
+
+
+def loaded_heavy_modules(module: str = "app") -> List[str]:
+    """Módulos pesados carregados como efeito secundário do import"""
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT_DIR,
+        capture_output=True, text=True
+    )
+    return [m for m in result.stdout.strip().split(",") if m]
+
+
+def measure_time_to_live(timeout: float = 60.0) -> Optional[float]:
+    """Tempo (s) desde o arranque do processo até /api/health/live responder"""
+    import requests
+
+    from benchmarks.mock_ollama import MockOllamaServer
+    from benchmarks.run_benchmarks import free_port
+
+    port = free_port()
+    with MockOllamaServer() as mock:
+        env = dict(
+            os.environ, PORT=str(port), HOST="127.0.0.1",
+            OLLAMA_HOST=mock.url, OLLAMA_PRELOAD_MODELS="",
+            LOG_LEVEL="WARNING"
+        )
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "app.py"], cwd=ROOT_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            url = f"http://127.0.0.1:{port}/api/health/live"
+            while time.perf_counter() - start < timeout:
+                try:
+                    if requests.get(url, timeout=1).status_code == 200:
+                        return time.perf_counter() - start
+                except requests.ConnectionError:
+                    pass
+                if process.poll() is not None:
+                    return None
+                time.sleep(0.05)
+            return None
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+
+def main(argv=None) -> int:
+    """Função principal"""
+    parser = argparse.ArgumentParser(
+        description="Tempo de arranque da LLM Pessoal"
+    )
+    parser.add_argument("--budget-ms", type=float, default=1000.0,
+                        help="Orçamento para `import app` (ms)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--serve", action="store_true",
+                        help="Medir também o tempo até /api/health/live")
+    parser.add_argument("--no-history", action="store_true")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, str(ROOT_DIR))
+
+    timings = []
+    top: List[Tuple[str, int]] = []
+    for _ in range(args.runs):
+        total_ms, top = measure_import()
+        timings.append(total_ms)
+    best_ms = min(timings)
+
+    print(f"⏱️  import app: {best_ms:.1f} ms (melhor de {args.runs})")
+    print(f"   Orçamento: {args.budget_ms:.0f} ms")
+    print("   Módulos mais caros:")
+    for name, us in top[:args.top]:
+        print(f"     {us / 1000:8.1f} ms  {name}")
+
+    heavy = loaded_heavy_modules()
+    if heavy:
+        print(f"⚠️  Módulos pesados importados no arranque: {', '.join(heavy)}")
+
+    record: Dict[str, Any] = {
+        "timestamp": time.time(),
+        "import_ms": round(best_ms, 1),
+        "budget_ms": args.budget_ms,
+        "heavy_modules": heavy,
+    }
+
+    if args.serve:
+        live_s = measure_time_to_live()
+        record["time_to_live_s"] = round(live_s, 3) if live_s else None
+        print(f"🩺 Tempo até /api/health/live: {live_s}")
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+            capture_output=True, text=True
+        ).stdout.strip()
+        record["commit"] = commit or None
+    except OSError:
+        record["commit"] = None
+
+    if not args.no_history:
+        with open(HISTORY_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"💾 Histórico atualizado em {HISTORY_FILE.name}")
+
+    over_budget = best_ms > args.budget_ms or bool(heavy)
+    if over_budget:
+        print("❌ Arranque acima do orçamento")
+    else:
+        print("✅ Arranque dentro do orçamento")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
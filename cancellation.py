@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Propagação de cancelamento para gerações em curso.
+Permite abortar Ollama, Stable Diffusion e Whisper quando o cliente desliga.
+"""
+
+import asyncio
+import contextlib
+import logging
+import threading
+from typing import AsyncIterator, Optional
+
+from fastapi import Request
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCancelled(Exception):
+    """Geração abortada porque o cliente deixou de esperar pelo resultado."""
+
+
+class CancellationToken:
+    """
+    Sinal de cancelamento partilhado entre o event loop e threads de trabalho.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        """Indica se o cancelamento foi pedido."""
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelado"):
+        """Pede o cancelamento do trabalho associado."""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def raise_if_cancelled(self):
+        """Lança GenerationCancelled se o cancelamento foi pedido."""
+        if self._event.is_set():
+            raise GenerationCancelled(self.reason or "cancelado")
+
+
+async def watch_disconnect(
+    request: Request, token: CancellationToken, interval: float = 0.25
+):
+    """Cancela o token quando o cliente HTTP desliga."""
+    while not token.cancelled:
+        if await request.is_disconnected():
+            logger.info("🔌 Cliente desligado - a cancelar geração")
+            token.cancel("cliente desligado")
+            return
+        await asyncio.sleep(interval)
+
+
+@contextlib.asynccontextmanager
+async def disconnect_guard(
+    request: Request, token: Optional[CancellationToken] = None
+) -> AsyncIterator[CancellationToken]:
+    """
+    Context manager que vigia o cliente enquanto o bloco executa.
+
+    Exemplo:
+        async with disconnect_guard(request) as token:
+            await asyncio.to_thread(trabalho_pesado, token)
+    """
+    token = token or CancellationToken()
+    watcher = asyncio.create_task(watch_disconnect(request, token))
+    try:
+        yield token
+    except asyncio.CancelledError:
+        token.cancel("pedido cancelado")
+        raise
+    finally:
+        watcher.cancel()
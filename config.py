@@ -171,10 +171,12 @@ def get_device_info() -> Dict[str, Any]:
             gpu_name = torch.cuda.get_device_name(0)
             gpu_props = torch.cuda.get_device_properties(0)
             gpu_memory = gpu_props.total_memory // (1024**3)
+            free_memory, _ = torch.cuda.mem_get_info(0)
             return {
                 "device": device,
                 "gpu_name": gpu_name,
                 "gpu_memory_gb": gpu_memory,
+                "gpu_memory_free_gb": free_memory / (1024**3),
                 "cuda_available": True
             }
     except ImportError:
@@ -184,6 +186,7 @@ def get_device_info() -> Dict[str, Any]:
         "device": "cpu",
         "gpu_name": None,
         "gpu_memory_gb": 0,
+        "gpu_memory_free_gb": 0.0,
         "cuda_available": False
     }
 
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Opções de geração do Ollama por pedido.
+Os valores pedidos pelo cliente são limitados por tetos do servidor,
+globais ou por modelo, antes de chegarem ao Ollama.
+"""
+
+import json
+import logging
+import re
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+from model_keeper import KeepAlive
+
+logger = logging.getLogger(__name__)
+
+# Amostragem por omissão (antes fixa em generate/generate_stream)
+DEFAULT_SAMPLING = {
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "top_k": 40,
+}
+
+# Limites de forma das stop sequences (validadas no ChatRequest)
+MAX_STOP_SEQUENCES = 8
+MAX_STOP_LENGTH = 64
+
+_DURATION = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ms|s|m|h)?\s*$")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}
+
+
+def parse_duration(value) -> Optional[float]:
+    """'90' / 90 / '30s' / '5m' / '2h' -> segundos (None se inválido)"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _DURATION.match(str(value))
+    if match is None:
+        return None
+    return float(match.group(1)) * _UNITS[match.group(2)]
+
+
+@dataclass(frozen=True)
+class ModelCaps:
+    """Tetos de um modelo."""
+
+    max_tokens: int
+    num_ctx: int
+    keep_alive_seconds: int
+
+
+class GenerationCaps:
+    """
+    Tetos por modelo com valores globais por omissão.
+
+    overrides vem de OLLAMA_MODEL_CAPS em JSON, por exemplo
+    {"phi3:mini": {"max_tokens": 512, "num_ctx": 4096}}.
+    """
+
+    def __init__(self, defaults: ModelCaps, overrides: str = ""):
+        self.defaults = defaults
+        self.models: Dict[str, ModelCaps] = {}
+        if overrides:
+            try:
+                entries = json.loads(overrides)
+                for model, caps in entries.items():
+                    self.models[model] = replace(defaults, **{
+                        key: int(value) for key, value in caps.items()
+                    })
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.error("OLLAMA_MODEL_CAPS inválido (ignorado): %s", e)
+                self.models = {}
+
+    def for_model(self, model: str) -> ModelCaps:
+        caps = self.models.get(model)
+        if caps is None and ":" not in model:
+            caps = self.models.get(f"{model}:latest")
+        return caps or self.defaults
+
+    def resolve(
+        self,
+        model: str,
+        max_tokens: Optional[int] = None,
+        num_ctx: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        keep_alive: Optional[KeepAlive] = None,
+        sampling: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Dict[str, Any], Optional[int]]:
+        """
+        Opções do Ollama e keep_alive (s) efetivos para um pedido.
+
+        Os valores acima do teto são reduzidos ao teto; o que não foi
+        pedido fica com o valor por omissão do servidor.
+        """
+        caps = self.for_model(model)
+        options = dict(DEFAULT_SAMPLING)
+        options.update({
+            key: value for key, value in (sampling or {}).items()
+            if value is not None
+        })
+        options["num_predict"] = min(
+            max_tokens or caps.max_tokens, caps.max_tokens
+        )
+        if num_ctx is not None:
+            options["num_ctx"] = min(num_ctx, caps.num_ctx)
+        if stop:
+            options["stop"] = list(stop)
+
+        seconds = None
+        if keep_alive is not None:
+            requested = parse_duration(keep_alive)
+            if requested is not None:
+                seconds = int(min(requested, caps.keep_alive_seconds))
+        return options, seconds
@@ -6,7 +6,7 @@ Sistema de health check para monitorização da aplicação.
 import asyncio
 import aiohttp
 import psutil
-import torch
+import sys
 import logging
 from datetime import datetime
 from typing import Dict, Any
@@ -43,7 +43,7 @@ class HealthChecker:
                     results['status'] = 'unhealthy'
                     
             except Exception as e:
-                logger.error(f"Erro na verificação {check_name}: {e}")
+                logger.error("Erro na verificação %s: %s", check_name, e)
                 results['checks'][check_name] = {
                     'healthy': False,
                     'error': str(e)
@@ -125,6 +125,15 @@ class HealthChecker:
     
     async def check_gpu_status(self) -> Dict[str, Any]:
         """Verifica status da GPU."""
+        # Só consultar a GPU se o torch já foi carregado por um modelo
+        torch = sys.modules.get("torch")
+        if torch is None:
+            return {
+                'healthy': True,
+                'available': None,
+                'message': 'PyTorch ainda não carregado'
+            }
+
         if not torch.cuda.is_available():
             return {
                 'healthy': True,
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Armazenamento das imagens geradas.
+Codifica fora do event loop (PNG/WebP), cria miniaturas e guarda com nomes
+derivados do conteúdo, para poderem ser servidas como imutáveis.
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import io
+import logging
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Nomes gerados pelo ImageStore: <hash>.<ext> e <hash>_thumb.<ext>
+HASHED_NAME = re.compile(r"^([0-9a-f]{16})(_thumb)?\.(png|webp|jpg)$")
+# Qualquer ficheiro servível (inclui nomes antigos generated_<ts>.png)
+SAFE_NAME = re.compile(r"^[\w.-]+\.(png|webp|jpg)$")
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+MUTABLE_CACHE = "no-cache"
+
+MEDIA_TYPES = {"png": "image/png", "webp": "image/webp", "jpg": "image/jpeg"}
+
+
+class ImageStore:
+    """
+    Codificação e gravação de imagens num pool de threads.
+
+    O nome de cada ficheiro é um prefixo do SHA-256 dos bytes codificados;
+    o mesmo conteúdo nunca muda de URL e pode ficar em cache para sempre.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        image_format: str = "png",
+        png_compress_level: int = 3,
+        webp_quality: int = 90,
+        webp_lossless: bool = False,
+        thumbnail_size: int = 256,
+        max_workers: int = 2
+    ):
+        """
+        Args:
+            directory: Diretório das imagens
+            image_format: "png" ou "webp"
+            png_compress_level: 0-9 (o Pillow usa 6; 1-3 é bem mais rápido)
+            webp_quality: Qualidade do WebP com perdas
+            webp_lossless: WebP sem perdas
+            thumbnail_size: Lado máximo das miniaturas (0 desativa)
+            max_workers: Threads de codificação
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if image_format not in ("png", "webp"):
+            logger.warning("Formato de imagem desconhecido: %s", image_format)
+            image_format = "png"
+        self.image_format = image_format
+        self.png_compress_level = png_compress_level
+        self.webp_quality = webp_quality
+        self.webp_lossless = webp_lossless
+        self.thumbnail_size = thumbnail_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image-store"
+        )
+
+    def _encode(self, image) -> Tuple[bytes, str]:
+        buffer = io.BytesIO()
+        if self.image_format == "webp":
+            image.save(
+                buffer, format="WEBP", quality=self.webp_quality,
+                lossless=self.webp_lossless, method=4
+            )
+            return buffer.getvalue(), "webp"
+        image.save(
+            buffer, format="PNG", compress_level=self.png_compress_level
+        )
+        return buffer.getvalue(), "png"
+
+    def _encode_thumbnail(self, image) -> bytes:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((self.thumbnail_size, self.thumbnail_size))
+        buffer = io.BytesIO()
+        thumbnail.convert("RGB").save(buffer, format="WEBP", quality=80)
+        return buffer.getvalue()
+
+    def _write(self, name: str, data: bytes):
+        path = self.directory / name
+        if path.exists():
+            return  # mesmo conteúdo, mesmo nome
+        # Nome temporário único: o mesmo conteúdo pode estar a ser gravado
+        # por outra thread ou worker ao mesmo tempo (mkstemp criaria o
+        # ficheiro com permissões 0600)
+        tmp = path.with_name(f".{name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+        try:
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def save_sync(self, image) -> Dict[str, Any]:
+        """Codificar e gravar (executado nas threads do pool)"""
+        with metrics.SD_STAGE_DURATION.time("save"):
+            data, ext = self._encode(image)
+            digest = hashlib.sha256(data).hexdigest()[:16]
+            filename = f"{digest}.{ext}"
+            self._write(filename, data)
+
+            result = {
+                "success": True,
+                "image_url": f"/images/{filename}",
+                "filename": filename,
+                "format": ext,
+                "bytes": len(data),
+                "width": image.width,
+                "height": image.height,
+                "thumbnail_url": None
+            }
+            if self.thumbnail_size:
+                thumb_name = f"{digest}_thumb.webp"
+                self._write(thumb_name, self._encode_thumbnail(image))
+                result["thumbnail_url"] = f"/images/{thumb_name}"
+
+        logger.info("✅ Imagem salva: %s (%d KB)", filename, len(data) // 1024)
+        return result
+
+    async def save(self, image) -> Dict[str, Any]:
+        """Gravar sem bloquear o event loop"""
+        loop = asyncio.get_running_loop()
+        # Propagar o contexto (tempos do pedido) para a thread do pool
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, context.run, self.save_sync, image
+        )
+
+    def _decode_and_save(self, data: bytes) -> Dict[str, Any]:
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return self.save_sync(image)
+
+    async def save_encoded(self, data: bytes) -> Dict[str, Any]:
+        """Gravar uma imagem já codificada (ex. enviada por um worker)"""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, context.run, self._decode_and_save, data
+        )
+
+    def resolve(
+        self, name: str
+    ) -> Optional[Tuple[Path, str, Dict[str, str]]]:
+        """
+        Caminho, media type e cabeçalhos para servir um ficheiro, ou None.
+
+        Ficheiros com nome de conteúdo são imutáveis (ETag = hash);
+        os restantes são revalidados a cada pedido.
+        """
+        if not SAFE_NAME.match(name):
+            return None
+        path = self.directory / name
+        if not path.is_file():
+            return None
+
+        ext = name.rsplit(".", 1)[1]
+        headers = {}
+        hashed = HASHED_NAME.match(name)
+        if hashed:
+            headers["Cache-Control"] = IMMUTABLE_CACHE
+            headers["ETag"] = f'"{hashed.group(1)}{hashed.group(2) or ""}"'
+        else:
+            headers["Cache-Control"] = MUTABLE_CACHE
+        return path, MEDIA_TYPES[ext], headers
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
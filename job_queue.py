@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Fila de gerações de imagem para workers remotos.
+Os workers (sd_worker.py) pedem trabalho por long-polling e recebem um
+lease com prazo; sem heartbeat o lease expira e o trabalho volta à fila.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional
+
+from cancellation import CancellationToken, GenerationCancelled
+
+logger = logging.getLogger(__name__)
+
+# Intervalo de verificação de leases expirados
+REAPER_INTERVAL = 1.0
+# Intervalo de verificação do cancelamento enquanto se espera o resultado
+CANCEL_POLL_INTERVAL = 0.25
+
+
+class LeaseLost(Exception):
+    """O lease não existe, expirou ou foi cancelado."""
+
+
+@dataclass
+class ImageJob:
+    """Geração à espera de um worker ou em curso num worker."""
+
+    id: str
+    request: Dict[str, Any]
+    future: asyncio.Future
+    created_at: float = field(default_factory=time.time)
+    status: str = "pending"  # pending, leased, done, failed, cancelled
+    attempts: int = 0
+    lease_id: Optional[str] = None
+    worker_id: Optional[str] = None
+    lease_expires: float = 0.0
+
+
+class ImageJobQueue:
+    """
+    Fila em memória com leases, no event loop do nó principal.
+
+    submit() devolve o job cujo future resolve com o resultado enviado
+    pelo worker; lease() espera (long-poll) até haver trabalho.
+    """
+
+    def __init__(
+        self,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 3,
+        worker_timeout: float = 60.0
+    ):
+        """
+        Args:
+            lease_seconds: Prazo de cada lease (renovado por heartbeat)
+            max_attempts: Entregas antes de desistir de um job
+            worker_timeout: Segundos sem contacto até um worker contar
+                como inativo
+        """
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker_timeout = worker_timeout
+        self.jobs: Dict[str, ImageJob] = {}
+        self.workers: Dict[str, float] = {}
+        self._pending: Deque[str] = deque()
+        self._available: Optional[asyncio.Condition] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self.completed = 0
+        self.requeued = 0
+
+    @property
+    def available(self) -> asyncio.Condition:
+        if self._available is None:
+            self._available = asyncio.Condition()
+        return self._available
+
+    def start(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        for job in list(self.jobs.values()):
+            self._finish(job, "cancelled", GenerationCancelled("a terminar"))
+
+    def active_workers(self) -> int:
+        """Workers que contactaram o nó há menos de worker_timeout"""
+        limit = time.monotonic() - self.worker_timeout
+        return sum(1 for seen in self.workers.values() if seen >= limit)
+
+    # ------------------------------------------------------------------
+    # Lado do nó principal
+    # ------------------------------------------------------------------
+
+    async def submit(self, request: Dict[str, Any]) -> ImageJob:
+        job = ImageJob(
+            id=uuid.uuid4().hex[:12],
+            request=request,
+            future=asyncio.get_running_loop().create_future()
+        )
+        self.jobs[job.id] = job
+        async with self.available:
+            self._pending.append(job.id)
+            self.available.notify()
+        return job
+
+    async def run(
+        self, request: Dict[str, Any], cancel_token: CancellationToken
+    ) -> Dict[str, Any]:
+        """
+        Pôr na fila e esperar pelo resultado de um worker.
+
+        Raises:
+            GenerationCancelled: Se o token for cancelado
+        """
+        job = await self.submit(request)
+        while not job.future.done():
+            done, _ = await asyncio.wait(
+                {job.future}, timeout=CANCEL_POLL_INTERVAL
+            )
+            if not done and cancel_token.cancelled:
+                self.cancel(job.id, cancel_token.reason or "cancelado")
+        return job.future.result()
+
+    def cancel(self, job_id: str, reason: str = "cancelado"):
+        """Retirar da fila ou marcar para o worker abortar no heartbeat"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        try:
+            self._pending.remove(job_id)
+        except ValueError:
+            pass
+        self._finish(job, "cancelled", GenerationCancelled(reason))
+
+    def _finish(self, job: ImageJob, status: str, outcome):
+        job.status = status
+        self.jobs.pop(job.id, None)
+        if job.future.done():
+            return
+        if isinstance(outcome, BaseException):
+            job.future.set_exception(outcome)
+        else:
+            job.future.set_result(outcome)
+
+    # ------------------------------------------------------------------
+    # Lado dos workers
+    # ------------------------------------------------------------------
+
+    def _touch(self, worker_id: str):
+        self.workers[worker_id] = time.monotonic()
+
+    async def lease(
+        self, worker_id: str, wait: float
+    ) -> Optional[ImageJob]:
+        """Próximo job pendente, esperando até `wait` segundos"""
+        self._touch(worker_id)
+        try:
+            async with self.available:
+                await asyncio.wait_for(
+                    self.available.wait_for(lambda: self._pending), wait
+                )
+                job = self.jobs[self._pending.popleft()]
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._touch(worker_id)
+
+        job.status = "leased"
+        job.attempts += 1
+        job.worker_id = worker_id
+        job.lease_id = uuid.uuid4().hex
+        job.lease_expires = time.monotonic() + self.lease_seconds
+        logger.info(
+            "📤 Job %s entregue a %s (tentativa %d)",
+            job.id, worker_id, job.attempts
+        )
+        return job
+
+    def _leased(self, job_id: str, lease_id: str) -> ImageJob:
+        job = self.jobs.get(job_id)
+        if job is None or job.status != "leased" or job.lease_id != lease_id:
+            raise LeaseLost(job_id)
+        return job
+
+    def heartbeat(self, job_id: str, lease_id: str):
+        """Renovar o lease; LeaseLost se o job já não é deste worker"""
+        job = self._leased(job_id, lease_id)
+        job.lease_expires = time.monotonic() + self.lease_seconds
+        self._touch(job.worker_id)
+
+    def lease_holder(self, job_id: str, lease_id: str) -> ImageJob:
+        """Job com lease válido (antes de aceitar um resultado)"""
+        return self._leased(job_id, lease_id)
+
+    def complete(self, job_id: str, lease_id: str, result: Dict[str, Any]):
+        job = self._leased(job_id, lease_id)
+        self._touch(job.worker_id)
+        self.completed += 1
+        self._finish(job, "done", result)
+
+    def fail(self, job_id: str, lease_id: str, error: str):
+        job = self._leased(job_id, lease_id)
+        self._touch(job.worker_id)
+        logger.warning("Job %s falhou em %s: %s", job_id, job.worker_id, error)
+        self._finish(job, "failed", RuntimeError(error))
+
+    # ------------------------------------------------------------------
+    # Leases expirados
+    # ------------------------------------------------------------------
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(REAPER_INTERVAL)
+            await self.reap()
+
+    async def reap(self):
+        """Devolver à fila os jobs de workers que deixaram de responder"""
+        now = time.monotonic()
+        expired = [
+            job for job in self.jobs.values()
+            if job.status == "leased" and job.lease_expires < now
+        ]
+        for job in expired:
+            if job.attempts >= self.max_attempts:
+                logger.error(
+                    "Job %s sem worker após %d tentativas",
+                    job.id, job.attempts
+                )
+                self._finish(job, "failed", RuntimeError(
+                    "Nenhum worker concluiu a geração"
+                ))
+                continue
+            logger.warning(
+                "⏱️ Lease do job %s expirou em %s: de volta à fila",
+                job.id, job.worker_id
+            )
+            job.status = "pending"
+            job.lease_id = job.worker_id = None
+            self.requeued += 1
+            async with self.available:
+                self._pending.appendleft(job.id)
+                self.available.notify()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "leased": sum(
+                1 for job in self.jobs.values() if job.status == "leased"
+            ),
+            "active_workers": self.active_workers(),
+            "completed": self.completed,
+            "requeued": self.requeued,
+            "lease_seconds": self.lease_seconds
+        }
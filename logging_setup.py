@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Logging sem bloqueios nos caminhos críticos.
+Os pedidos só põem o registo numa fila (com limite e amostragem por
+logger); a formatação (texto ou JSON) e a escrita acontecem numa thread
+de fundo com um QueueListener.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Registos em espera acima deste limite são descartados (e contados)
+QUEUE_SIZE = 10000
+
+# Limites (registos/s abaixo de WARNING) dos loggers que escrevem a cada
+# pedido; os logs do próprio app (chat, imagens) não são limitados
+DEFAULT_RATE_LIMITS = (
+    "resource_manager=1,model_keeper=1,whisper_service=2,image_store=2,"
+    "cancellation=2,sd_placement=1,job_queue=2"
+)
+
+# Atributos de LogRecord que não são campos "extra"
+_RECORD_FIELDS = frozenset(vars(logging.LogRecord(
+    "", 0, "", 0, "", None, None
+))) | {"message", "asctime", "suppressed"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha, com os campos extra do registo."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(
+                record.created, timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and key not in entry:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato de texto habitual, indicando os registos suprimidos."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line += f" (+{suppressed} suprimidas)"
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Amostragem e limite de taxa por logger para registos abaixo de WARNING.
+
+    rates: logger -> registos por segundo (token bucket com rajada igual
+    à taxa); samples: logger -> fração guardada (0-1). As regras valem
+    também para os loggers descendentes. O próximo registo que passa
+    leva em `suppressed` quantos foram descartados desde o anterior.
+    """
+
+    def __init__(
+        self,
+        rates: Optional[Dict[str, float]] = None,
+        samples: Optional[Dict[str, float]] = None
+    ):
+        super().__init__()
+        self.rates = rates or {}
+        self.samples = samples or {}
+        self._rules: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+        # logger -> [tokens, última atualização, crédito de amostragem,
+        #            suprimidos]
+        self._state: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def _rule(self, name: str) -> Tuple[Optional[float], Optional[float]]:
+        rule = self._rules.get(name)
+        if rule is None:
+            rate = sample = None
+            candidate = name
+            while candidate:
+                if rate is None:
+                    rate = self.rates.get(candidate)
+                if sample is None:
+                    sample = self.samples.get(candidate)
+                candidate = candidate.rpartition(".")[0]
+            rule = self._rules[name] = (rate, sample)
+        return rule
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate, sample = self._rule(record.name)
+        if rate is None and sample is None:
+            return True
+
+        with self._lock:
+            state = self._state.get(record.name)
+            if state is None:
+                state = self._state[record.name] = [
+                    rate or 0.0, record.created, 0.0, 0
+                ]
+            keep = True
+            if sample is not None:
+                state[2] += sample
+                if state[2] >= 1.0:
+                    state[2] -= 1.0
+                else:
+                    keep = False
+            if keep and rate is not None:
+                state[0] = min(
+                    rate, state[0] + (record.created - state[1]) * rate
+                )
+                state[1] = record.created
+                if state[0] >= 1.0:
+                    state[0] -= 1.0
+                else:
+                    keep = False
+            if not keep:
+                state[3] += 1
+                self.dropped += 1
+                return False
+            if state[3]:
+                record.suppressed = state[3]
+                state[3] = 0
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler que não formata no thread do pedido e nunca bloqueia.
+
+    Só a mensagem (%-style) e a exceção são resolvidas aqui, porque os
+    argumentos podem mudar depois; o resto fica para o listener. Com a
+    fila cheia o registo é descartado.
+    """
+
+    def __init__(self, log_queue: queue.Queue, on_close=None):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.on_close = on_close
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # logging.shutdown() fecha os handlers: escoar a fila antes de sair
+        super().close()
+        if self.on_close is not None:
+            self.on_close()
+
+
+class LoggingPipeline:
+    """Fila, handler e listener instalados no logger raiz."""
+
+    def __init__(self, handlers, queue_size: int, sampling: SamplingFilter):
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self.sampling = sampling
+        self.handler: Optional[DeferredQueueHandler] = None
+        self.listener: Optional[QueueListener] = None
+
+    def start(self):
+        log_queue = queue.Queue(self.queue_size)
+        if self.handler is None:
+            self.handler = DeferredQueueHandler(log_queue, self.stop)
+            self.handler.addFilter(self.sampling)
+        else:
+            self.handler.queue = log_queue
+        self.listener = QueueListener(
+            log_queue, *self.handlers, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def after_fork(self):
+        # A thread do listener não existe no processo filho e a fila pode
+        # ter ficado com locks do pai: recomeçar com uma fila nova
+        self.listener = None
+        self.sampling._lock = threading.Lock()
+        self.start()
+
+    def get_status(self) -> dict:
+        return {
+            "queued": self.handler.queue.qsize() if self.handler else 0,
+            "dropped_full": self.handler.dropped if self.handler else 0,
+            "dropped_sampled": self.sampling.dropped
+        }
+
+
+_pipeline: Optional[LoggingPipeline] = None
+
+
+def parse_rules(value: str) -> Dict[str, float]:
+    """'resource_manager=1,app=0.5' -> {'resource_manager': 1.0, ...}"""
+    rules = {}
+    for item in value.split(","):
+        name, _, number = item.strip().partition("=")
+        if name and number:
+            try:
+                rules[name.strip()] = float(number)
+            except ValueError:
+                pass
+    return rules
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    log_format: Optional[str] = None,
+    log_file: Optional[str] = None,
+    rates: Optional[Dict[str, float]] = None,
+    samples: Optional[Dict[str, float]] = None
+) -> LoggingPipeline:
+    """
+    Configurar o logger raiz com a fila e o listener em background.
+
+    Os valores omitidos vêm de LOG_LEVEL, LOG_FORMAT (text|json),
+    LOG_FILE, LOG_RATE_LIMITS e LOG_SAMPLE_RATES.
+    """
+    global _pipeline
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    log_format = (log_format or os.getenv("LOG_FORMAT", "text")).lower()
+    log_file = log_file or os.getenv("LOG_FILE") or None
+    if rates is None:
+        rates = parse_rules(
+            os.getenv("LOG_RATE_LIMITS", DEFAULT_RATE_LIMITS)
+        )
+    if samples is None:
+        samples = parse_rules(os.getenv("LOG_SAMPLE_RATES", ""))
+
+    if log_format == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = TextFormatter(TEXT_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    if _pipeline is not None:
+        _pipeline.stop()
+        root.removeHandler(_pipeline.handler)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    _pipeline = LoggingPipeline(
+        handlers, QUEUE_SIZE, SamplingFilter(rates, samples)
+    )
+    _pipeline.start()
+    root.addHandler(_pipeline.handler)
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+    return _pipeline
+
+
+def get_status() -> dict:
+    return _pipeline.get_status() if _pipeline else {}
+
+
+def _stop_pipeline():
+    if _pipeline is not None:
+        _pipeline.stop()
+
+
+def _after_fork_in_child():
+    if _pipeline is not None:
+        _pipeline.after_fork()
+
+
+atexit.register(_stop_pipeline)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas Prometheus de baixo custo para os caminhos críticos.
+Histogramas de latência por etapa e contadores de erros, cache e rejeições.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import profiling
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+NAMESPACE = "llm_pessoal"
+
+# Limite de séries por métrica; valores novos acima do limite vão para "other"
+MAX_SERIES = 64
+OVERFLOW_LABEL = "other"
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+
+# Observações de histogramas guardadas em vez de registadas (capture())
+Observation = Tuple[str, Tuple[str, ...], float]
+_captured: contextvars.ContextVar[Optional[List[Observation]]] = (
+    contextvars.ContextVar("metrics_captured", default=None)
+)
+
+
+def _escape(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    )
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    """Base comum: gestão de séries por combinação de labels."""
+
+    kind = ""
+
+    def __init__(
+        self, name: str, documentation: str,
+        labelnames: Sequence[str] = ()
+    ):
+        self.name = f"{NAMESPACE}_{name}"
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Série para a combinação de labels (limitada a MAX_SERIES)."""
+        key = tuple(str(v) for v in values)
+        series = self._series.get(key)
+        if series is not None:
+            return series
+        with self._lock:
+            if key not in self._series and len(self._series) >= MAX_SERIES:
+                key = (OVERFLOW_LABEL,) * len(self.labelnames)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = self._new_series()
+        return series
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}"
+        ]
+        # Cópia sob o lock: os pedidos podem criar séries durante o scrape
+        with self._lock:
+            series_items = sorted(self._series.items())
+        for key, series in series_items:
+            lines.extend(series.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _CounterSeries:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        # += de float é atómico o suficiente sob o GIL para contadores
+        self.value += amount
+
+    def render(self, name, labelnames, key):
+        return [f"{name}{_format_labels(labelnames, key)} {self.value}"]
+
+
+class Counter(_Metric):
+    """Contador monotónico."""
+
+    kind = "counter"
+
+    def __init__(
+        self, name: str, documentation: str,
+        labelnames: Sequence[str] = ()
+    ):
+        super().__init__(f"{name}_total", documentation, labelnames)
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        """Incrementar a série indicada pelos labels."""
+        self.labels(*labels).inc(amount)
+
+
+class _HistogramSeries:
+    __slots__ = ("buckets", "counts", "sum", "count", "lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self, name, labelnames, key):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(
+                labelnames + ("le",), key + (repr(float(bound)),)
+            )
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames + ("le",), key + ("+Inf",))
+        lines.append(f"{name}_bucket{labels} {count}")
+        base = _format_labels(labelnames, key)
+        lines.append(f"{name}_sum{base} {total}")
+        lines.append(f"{name}_count{base} {count}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Histograma de latências com buckets fixos."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        server_timing: Optional[str] = None
+    ):
+        """
+        server_timing: nome da etapa no cabeçalho Server-Timing do pedido
+        em curso (formatado com os labels, ex. "whisper_{0}"); None não
+        reporta.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.server_timing = server_timing
+        super().__init__(name, documentation, labelnames)
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value: float, *labels: str):
+        """Registar uma observação na série indicada pelos labels."""
+        captured = _captured.get()
+        if captured is not None:
+            captured.append((self.name, labels, value))
+            return
+        self.labels(*labels).observe(value)
+        if self.server_timing is not None:
+            profiling.record(self.server_timing.format(*labels), value)
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Context manager que regista a duração do bloco."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+
+class Registry:
+    """Registo das métricas expostas em /metrics."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        for metric in self._metrics:
+            if metric.name == name:
+                return metric
+        return None
+
+    def render(self) -> str:
+        """Exportar todas as métricas no formato de texto do Prometheus."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+# ===============================
+# MÉTRICAS DA APLICAÇÃO
+# ===============================
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Duração dos pedidos HTTP até à resposta (cabeçalhos)",
+    ("method", "route", "status")
+)
+
+CHAT_QUEUE_WAIT = Histogram(
+    "chat_queue_wait_seconds",
+    "Tempo entre a chegada do pedido HTTP e o envio ao Ollama",
+    ("model",),
+    server_timing="ollama_queue"
+)
+CHAT_TIME_TO_FIRST_TOKEN = Histogram(
+    "chat_time_to_first_token_seconds",
+    "Tempo até ao primeiro token do Ollama",
+    ("model",),
+    server_timing="ollama_ttft"
+)
+CHAT_TOKENS_PER_SECOND = Histogram(
+    "chat_tokens_per_second",
+    "Velocidade de geração reportada pelo Ollama",
+    ("model",),
+    buckets=RATE_BUCKETS
+)
+CHAT_DURATION = Histogram(
+    "chat_duration_seconds",
+    "Duração total de uma geração de chat",
+    ("model",),
+    server_timing="ollama"
+)
+
+WHISPER_STAGE_DURATION = Histogram(
+    "whisper_stage_seconds",
+    "Duração das etapas da transcrição "
+    "(decode, features, language, generate, total)",
+    ("stage",),
+    server_timing="whisper_{0}"
+)
+
+SD_STEP_DURATION = Histogram(
+    "sd_step_seconds",
+    "Duração de cada passo de difusão",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    server_timing="sd_steps"
+)
+SD_STAGE_DURATION = Histogram(
+    "sd_stage_seconds",
+    "Duração das etapas da geração de imagem (vae_decode, save, total)",
+    ("stage",)
+)
+
+ERRORS = Counter(
+    "errors",
+    "Erros por etapa",
+    ("stage",)
+)
+CACHE_HITS = Counter(
+    "cache_hits",
+    "Acertos em cache",
+    ("cache",)
+)
+CACHE_MISSES = Counter(
+    "cache_misses",
+    "Falhas em cache",
+    ("cache",)
+)
+RESOURCE_REJECTIONS = Counter(
+    "resource_rejections",
+    "Pedidos rejeitados pelo ResourceManager",
+    ("service",)
+)
+
+
+def observe_chat(
+    model: str,
+    created_at: float,
+    started_at: Optional[float],
+    first_token_at: Optional[float],
+    finished_at: float,
+    final_chunk: Optional[dict] = None,
+    arrived_at: Optional[float] = None
+):
+    """
+    Registar as métricas de uma geração de chat concluída.
+
+    A espera em fila conta desde a chegada do pedido (arrived_at) até ao
+    envio ao Ollama; sem a chegada conhecida não é registada.
+    """
+    if started_at is not None and arrived_at is not None:
+        CHAT_QUEUE_WAIT.observe(started_at - arrived_at, model)
+    if first_token_at is not None:
+        CHAT_TIME_TO_FIRST_TOKEN.observe(first_token_at - created_at, model)
+    CHAT_DURATION.observe(finished_at - created_at, model)
+
+    # eval_duration do Ollama vem em nanossegundos
+    if final_chunk and final_chunk.get("eval_duration"):
+        tokens = final_chunk.get("eval_count", 0)
+        CHAT_TOKENS_PER_SECOND.observe(
+            tokens / (final_chunk["eval_duration"] / 1e9), model
+        )
+
+
+@contextmanager
+def capture() -> Iterator[List[Observation]]:
+    """
+    Guardar as observações de histogramas do bloco em vez de as registar.
+
+    Usado nos processos do WhisperProcessPool, cujo registo não é exportado:
+    a lista volta com o resultado e o processo principal chama replay().
+    """
+    observations: List[Observation] = []
+    token = _captured.set(observations)
+    try:
+        yield observations
+    finally:
+        _captured.reset(token)
+
+
+def replay(observations: Sequence[Observation]):
+    """Registar observações recolhidas por capture() noutro processo."""
+    for name, labels, value in observations:
+        metric = registry.get(name)
+        if isinstance(metric, Histogram):
+            metric.observe(value, *labels)
+
+
+def render() -> str:
+    """Texto exposto no endpoint /metrics."""
+    return registry.render()
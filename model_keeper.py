@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Pré-carregamento e manutenção de modelos Ollama em memória.
+Evita o custo de cold start no primeiro chat e após o keep-alive expirar.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+KeepAlive = Union[str, int]
+
+
+def parse_keep_alive(value: Optional[str]) -> Optional[KeepAlive]:
+    """Converte o keep_alive da configuração para o formato do Ollama."""
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)  # segundos, ou -1 para manter indefinidamente
+    except ValueError:
+        return value  # duração no formato "30m", "2h", ...
+
+
+class ModelKeeper:
+    """
+    Mantém modelos Ollama fixados em memória.
+
+    Os modelos fixados são carregados no arranque com keep_alive e
+    recarregados periodicamente por uma tarefa em background, que também
+    regista a latência de carregamento e a residência de cada modelo.
+    """
+
+    def __init__(
+        self,
+        client,
+        models: Iterable[str] = (),
+        keep_alive: Optional[KeepAlive] = "30m",
+        interval: float = 240.0,
+        on_load: Optional[Callable[[str], None]] = None
+    ):
+        """
+        Args:
+            client: OllamaClient usado para falar com o Ollama
+            models: Modelos a fixar em memória
+            keep_alive: Tempo de residência pedido ao Ollama
+            interval: Intervalo (s) entre verificações do keeper
+            on_load: Chamada com o nome do modelo quando passa a residente
+        """
+        self.client = client
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.on_load = on_load
+        self.pinned: Dict[str, Optional[KeepAlive]] = {
+            model: keep_alive for model in models
+        }
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def keep_alive_for(self, model: str) -> Optional[KeepAlive]:
+        """keep_alive a enviar nos pedidos de geração para este modelo."""
+        return self.pinned.get(model)
+
+    def pin(self, model: str, keep_alive: Optional[KeepAlive] = None):
+        """Fixar um modelo para ser mantido em memória."""
+        if keep_alive is None:
+            keep_alive = self.keep_alive
+        self.pinned[model] = keep_alive
+
+    def unpin(self, model: str):
+        """Deixar de manter um modelo em memória."""
+        self.pinned.pop(model, None)
+
+    def warm(
+        self, model: str, keep_alive: Optional[KeepAlive] = None
+    ) -> Dict[str, Any]:
+        """
+        Carregar (ou renovar) um modelo no Ollama e medir a latência.
+
+        Returns:
+            Estatísticas atualizadas do modelo
+        """
+        if keep_alive is None:
+            keep_alive = self.pinned.get(model, self.keep_alive)
+
+        stats = self.stats.setdefault(model, {
+            "model": model,
+            "warm_count": 0,
+            "last_load_seconds": None,
+            "max_load_seconds": 0.0,
+            "resident": False
+        })
+
+        start = time.perf_counter()
+        result = self.client.load_model(model, keep_alive)
+        elapsed = time.perf_counter() - start
+
+        stats["last_warm"] = time.time()
+        if "error" in result:
+            stats["error"] = result["error"]
+            logger.warning("Falha ao aquecer %s: %s", model, result["error"])
+            return stats
+
+        stats.pop("error", None)
+        stats["warm_count"] += 1
+        stats["last_load_seconds"] = round(elapsed, 3)
+        stats["max_load_seconds"] = round(
+            max(stats["max_load_seconds"], elapsed), 3
+        )
+        # load_duration do Ollama vem em nanossegundos
+        load_ns = result.get("load_duration")
+        if load_ns is not None:
+            stats["ollama_load_seconds"] = round(load_ns / 1e9, 3)
+        was_resident = stats["resident"]
+        stats["resident"] = True
+        logger.debug("Modelo %s aquecido em %.2fs", model, elapsed)
+        if not was_resident and self.on_load is not None:
+            self.on_load(model)
+        return stats
+
+    def refresh_residency(self) -> List[Dict[str, Any]]:
+        """Atualizar a residência dos modelos a partir de /api/ps."""
+        running = self.client.list_running_models()
+        resident = {m.get("name"): m for m in running}
+
+        for model, stats in self.stats.items():
+            info = resident.get(model)
+            stats["resident"] = info is not None
+            if info is not None:
+                stats["size_bytes"] = info.get("size")
+                stats["size_vram_bytes"] = info.get("size_vram")
+                stats["expires_at"] = info.get("expires_at")
+        return running
+
+    def keep_warm(self):
+        """Um ciclo do keeper: verificar residência e aquecer fixados."""
+        try:
+            self.refresh_residency()
+        except Exception as e:
+            logger.warning("Erro ao consultar modelos residentes: %s", e)
+
+        for model, keep_alive in list(self.pinned.items()):
+            try:
+                self.warm(model, keep_alive)
+            except Exception as e:
+                logger.warning("Erro ao aquecer %s: %s", model, e)
+
+    async def _run(self):
+        while True:
+            await asyncio.to_thread(self.keep_warm)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Iniciar o keeper em background (pré-carrega de imediato)."""
+        if self._task is None and self.pinned:
+            logger.info(
+                "🔥 A pré-carregar modelos Ollama: %s", list(self.pinned)
+            )
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Parar o keeper."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_status(self) -> Dict[str, Any]:
+        """Estado do keeper e estatísticas por modelo."""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval": self.interval,
+            "pinned": dict(self.pinned),
+            "models": list(self.stats.values())
+        }
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Armazém local de modelos do Hugging Face
+Mantém um manifesto com revisões fixadas e checksums, para os modelos
+serem carregados de disco sem verificações de rede a cada arranque.
+
+Exemplo (pré-descarregar os modelos antes de arrancar offline):
+    python model_store.py prefetch --sd runwayml/stable-diffusion-v1-5 \\
+        --whisper openai/whisper-small
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Ficheiros que nunca são necessários para inferência com PyTorch,
+# incluindo as variantes fp16/non_ema (carregamos os pesos por omissão)
+IGNORE_PATTERNS = [
+    "*.ckpt", "*.msgpack", "*.h5", "*.onnx", "*.onnx_data",
+    "*.pb", "*.ot", "*.tflite", "*.mlmodel", "*.md",
+    "*.fp16.*", "*.non_ema.*", "*.ema_only.*",
+]
+# Pesos .bin só são descarregados se o repositório não tiver safetensors
+BIN_PATTERNS = ["*.bin", "*.pt", "*.pth"]
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def sha256_file(path: Path) -> str:
+    """Calcular o SHA-256 de um ficheiro por blocos"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _weight_files(snapshot: Path) -> Iterable[Path]:
+    for path in sorted(snapshot.rglob("*")):
+        if path.is_file():
+            yield path
+
+
+def _pipeline_patterns(
+    repo_id: str,
+    cache_dir: Path,
+    revision: Optional[str],
+    local_files_only: bool
+) -> Optional[List[str]]:
+    """
+    Só o model_index.json e as pastas dos componentes de um pipeline
+    diffusers, deixando de fora os checkpoints únicos na raiz
+    (v1-5-pruned*.safetensors). None se o repositório não for diffusers.
+    """
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.utils import (
+        EntryNotFoundError, LocalEntryNotFoundError
+    )
+
+    try:
+        index_path = hf_hub_download(
+            repo_id, "model_index.json",
+            revision=revision,
+            cache_dir=str(cache_dir),
+            local_files_only=local_files_only
+        )
+    except (EntryNotFoundError, LocalEntryNotFoundError):
+        return None
+    with open(index_path, encoding="utf-8") as f:
+        index = json.load(f)
+    components = [
+        name for name, value in index.items()
+        if not name.startswith("_") and isinstance(value, list) and value[0]
+    ]
+    return ["model_index.json"] + [f"{name}/*" for name in components]
+
+
+class ModelStore:
+    """
+    Manifesto de modelos descarregados e resolução offline.
+
+    Modos (MODEL_STORE_MODE):
+        offline: nunca aceder à rede; falha se o modelo não estiver em
+            disco, for de outra revisão ou não conferir com os checksums
+        auto: descarregar uma vez os modelos em falta e registá-los
+    """
+
+    def __init__(
+        self,
+        manifest_path: Path,
+        mode: str = "auto",
+        revisions: Optional[Dict[str, str]] = None
+    ):
+        """
+        Args:
+            manifest_path: Ficheiro JSON do manifesto
+            mode: "auto" ou "offline"
+            revisions: Modelo -> revisão fixada (branch, tag, commit)
+        """
+        self.manifest_path = Path(manifest_path)
+        self.mode = mode
+        self.revisions = revisions or {}
+        self._lock = threading.Lock()
+        self._manifest = self._read_manifest()
+
+    @property
+    def offline(self) -> bool:
+        return self.mode == "offline"
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {"models": {}}
+        except FileNotFoundError:
+            return {"models": {}}
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("Manifesto de modelos inválido (%s): %s",
+                           self.manifest_path, e)
+            return {"models": {}}
+
+    def _write_manifest(self):
+        # Escrita atómica para não corromper o manifesto num crash
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.manifest_path)
+
+    def entry(self, repo_id: str) -> Optional[Dict[str, Any]]:
+        """Entrada do manifesto para um modelo"""
+        return self._manifest.get("models", {}).get(repo_id)
+
+    def list_models(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self._manifest.get("models", {}))
+
+    def _check_files(self, repo_id: str, entry: Dict[str, Any]) -> List[str]:
+        """
+        Validação no arranque contra os checksums do manifesto.
+
+        Ficheiros com o mesmo tamanho e mtime do último hash só custam um
+        stat; os restantes (alterados ou ainda sem checksum) são lidos e
+        o carimbo é atualizado, por isso cada ficheiro é lido uma vez.
+        """
+        snapshot = Path(entry["path"])
+        problems = []
+        hashed = False
+        for name, info in entry.get("files", {}).items():
+            path = snapshot / name
+            try:
+                stat = path.stat()
+            except OSError:
+                problems.append(f"{repo_id}/{name}: em falta")
+                continue
+            if stat.st_size != info["size"]:
+                problems.append(f"{repo_id}/{name}: tamanho diferente")
+                continue
+            if (info.get("sha256") is not None
+                    and info.get("mtime_ns") == stat.st_mtime_ns):
+                continue
+            digest = sha256_file(path)
+            hashed = True
+            if info.get("sha256") not in (None, digest):
+                problems.append(f"{repo_id}/{name}: checksum diferente")
+                continue
+            info["sha256"] = digest
+            info["mtime_ns"] = stat.st_mtime_ns
+        if hashed and not problems:
+            with self._lock:
+                self._write_manifest()
+        return problems
+
+    def verify(self, repo_id: str) -> List[str]:
+        """Comparar os checksums em disco com o manifesto (lento)"""
+        entry = self.entry(repo_id)
+        if entry is None:
+            return [f"{repo_id}: não está no manifesto"]
+        snapshot = Path(entry["path"])
+        problems = []
+        for name, info in entry.get("files", {}).items():
+            path = snapshot / name
+            if not path.exists():
+                problems.append(f"{repo_id}/{name}: em falta")
+            elif info.get("sha256") is None:
+                problems.append(
+                    f"{repo_id}/{name}: sem checksum (correr prefetch)"
+                )
+            elif sha256_file(path) != info["sha256"]:
+                problems.append(f"{repo_id}/{name}: checksum diferente")
+        return problems
+
+    def prefetch(
+        self,
+        repo_id: str,
+        cache_dir: Path,
+        revision: Optional[str] = None,
+        local_files_only: bool = False,
+        force_download: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Descarregar (ou localizar em cache) um modelo e registá-lo com os
+        checksums de todos os ficheiros.
+
+        force_download volta a descarregar ficheiros já em cache (para
+        substituir ficheiros corrompidos).
+        """
+        from huggingface_hub import snapshot_download
+
+        allow = _pipeline_patterns(
+            repo_id, cache_dir, revision, local_files_only
+        )
+
+        def download(ignore: List[str]) -> Path:
+            return Path(snapshot_download(
+                repo_id,
+                revision=revision,
+                cache_dir=str(cache_dir),
+                allow_patterns=allow,
+                ignore_patterns=ignore,
+                local_files_only=local_files_only,
+                force_download=force_download
+            ))
+
+        snapshot = download(IGNORE_PATTERNS + BIN_PATTERNS)
+        if not any(snapshot.rglob("*.safetensors")):
+            logger.info("%s não tem safetensors; a usar pesos .bin", repo_id)
+            snapshot = download(IGNORE_PATTERNS)
+
+        files = {}
+        for path in _weight_files(snapshot):
+            name = path.relative_to(snapshot).as_posix()
+            stat = path.stat()
+            files[name] = {
+                "size": stat.st_size,
+                "sha256": sha256_file(path),
+                "mtime_ns": stat.st_mtime_ns
+            }
+
+        entry = {
+            # Na estrutura de cache do hub o diretório é o hash do commit
+            "revision": snapshot.name,
+            # Revisão pedida (branch ou tag resolvidos para "revision")
+            "requested_revision": revision,
+            "path": str(snapshot),
+            "safetensors": any(n.endswith(".safetensors") for n in files),
+            "files": files,
+            "fetched_at": time.time()
+        }
+        with self._lock:
+            self._manifest.setdefault("models", {})[repo_id] = entry
+            self._write_manifest()
+        logger.info("📦 %s registado (revisão %s, %d ficheiros)",
+                    repo_id, entry["revision"][:12], len(files))
+        return entry
+
+    def resolve(
+        self, repo_id: str, cache_dir: Path, revision: Optional[str] = None
+    ) -> Tuple[str, bool]:
+        """
+        Caminho local para carregar um modelo sem aceder à rede.
+
+        A entrada do manifesto só é usada se for da revisão pedida
+        (argumento ou MODEL_STORE_REVISIONS) e conferir com os checksums.
+
+        Returns:
+            (caminho do snapshot, tem safetensors)
+
+        Raises:
+            RuntimeError: Em modo offline, se os ficheiros não conferirem
+        """
+        revision = revision or self.revisions.get(repo_id)
+        entry = self.entry(repo_id)
+        corrupted = False
+        if entry is not None and revision not in (
+            None, entry["revision"], entry.get("requested_revision")
+        ):
+            logger.warning("⚠️ %s está na revisão %s, pedida %s",
+                           repo_id, entry["revision"][:12], revision)
+        elif entry is not None:
+            problems = self._check_files(repo_id, entry)
+            if not problems:
+                return entry["path"], entry["safetensors"]
+            for problem in problems:
+                logger.warning("⚠️ %s", problem)
+            corrupted = True
+
+        # Modelos locais (diretório) não passam pelo hub
+        if Path(repo_id).is_dir():
+            local = Path(repo_id)
+            return str(local), any(local.rglob("*.safetensors"))
+
+        if self.offline:
+            if corrupted:
+                raise RuntimeError(
+                    f"{repo_id} não confere com o manifesto e o modo "
+                    f"offline não permite descarregá-lo de novo"
+                )
+            # Pode já existir na cache do hub, mesmo sem manifesto
+            entry = self.prefetch(
+                repo_id, cache_dir, revision, local_files_only=True
+            )
+        else:
+            logger.info("⬇️ %s em falta no armazém local: a descarregar",
+                        repo_id)
+            entry = self.prefetch(
+                repo_id, cache_dir, revision, force_download=corrupted
+            )
+        return entry["path"], entry["safetensors"]
+
+
+def pretrained_kwargs(use_safetensors: bool) -> Dict[str, Any]:
+    """Argumentos comuns de from_pretrained para carregar de disco"""
+    # safetensors + low_cpu_mem_usage: tensores mapeados em memória (mmap)
+    # e escritos diretamente nos parâmetros, sem cópia intermédia
+    return {
+        "local_files_only": True,
+        "use_safetensors": use_safetensors,
+        "low_cpu_mem_usage": True,
+    }
+
+
+# Diretórios de cache (as mesmas variáveis do docker-compose.yml)
+HF_CACHE_DIR = Path(os.getenv("HF_CACHE_DIR", "cache/huggingface"))
+WHISPER_CACHE_DIR = Path(os.getenv("WHISPER_CACHE_DIR", "cache/whisper"))
+
+def parse_revisions(value: str) -> Dict[str, str]:
+    """MODEL_STORE_REVISIONS: "modelo=revisão,modelo=revisão" """
+    revisions = {}
+    for item in value.split(","):
+        repo_id, _, revision = item.strip().rpartition("=")
+        if repo_id and revision:
+            revisions[repo_id] = revision
+    return revisions
+
+
+# Instância global do armazém de modelos (manifesto no volume persistente)
+model_store = ModelStore(
+    Path(os.getenv(
+        "MODEL_STORE_MANIFEST", str(HF_CACHE_DIR / "model_store.json")
+    )),
+    mode=os.getenv("MODEL_STORE_MODE", "auto").lower(),
+    revisions=parse_revisions(os.getenv("MODEL_STORE_REVISIONS", ""))
+)
+
+
+def main(argv=None) -> int:
+    """Interface de linha de comandos do armazém de modelos"""
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(
+        description="Armazém local de modelos da LLM Pessoal"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    prefetch = sub.add_parser("prefetch", help="Descarregar e fixar modelos")
+    prefetch.add_argument("--sd", action="append", default=[],
+                          help="Modelo Stable Diffusion (repetível)")
+    prefetch.add_argument("--whisper", action="append", default=[],
+                          help="Modelo Whisper (repetível)")
+    prefetch.add_argument("--revision", help="Revisão (branch, tag, commit)")
+
+    verify = sub.add_parser("verify", help="Verificar checksums")
+    verify.add_argument("models", nargs="*")
+
+    sub.add_parser("list", help="Listar modelos no manifesto")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "prefetch":
+        if not args.sd and not args.whisper:
+            parser.error("Indique pelo menos um modelo (--sd/--whisper)")
+        for repo_id in args.sd:
+            model_store.prefetch(repo_id, HF_CACHE_DIR, args.revision)
+        for repo_id in args.whisper:
+            model_store.prefetch(repo_id, WHISPER_CACHE_DIR, args.revision)
+        return 0
+
+    if args.command == "verify":
+        problems = []
+        for repo_id in args.models or model_store.list_models():
+            problems.extend(model_store.verify(repo_id))
+        for problem in problems:
+            print(f"❌ {problem}")
+        if not problems:
+            print("✅ Todos os modelos conferem com o manifesto")
+        return 1 if problems else 0
+
+    for repo_id, entry in model_store.list_models().items():
+        size = sum(f["size"] for f in entry["files"].values())
+        print(f"{repo_id}  {entry['revision'][:12]}  "
+              f"{size / 1024 ** 3:.2f} GB  {entry['path']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor multi-processo com pesos dos modelos partilhados.
+Carrega os modelos no processo principal e faz fork dos workers HTTP, que
+herdam os pesos por copy-on-write em vez de os carregarem N vezes.
+
+Cada worker tem o seu estado em memória. O que tem de ser visto por
+todos é preparado no pai antes do fork: cancelamentos de imagens
+(SharedCancellations), reservas do ResourceManager (memória partilhada)
+e limites de fila do QualityController (divididos pelos workers). A
+fila dos workers SD remotos não é partilhável: com SD_WORKER_TOKEN
+usa-se um só worker. Os downloads do Ollama correm no worker que os
+recebe e publicam o estado em SharedPullStates, para o progresso poder
+ser acompanhado a partir de qualquer worker.
+"""
+
+import gc
+import hashlib
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Intervalo mínimo entre reinícios do mesmo slot para evitar ciclos de crash
+RESPAWN_DELAY = 1.0
+
+
+def can_fork_with_models(device: str) -> bool:
+    """
+    Verifica se os modelos podem ser partilhados por fork.
+
+    O CUDA não sobrevive a um fork depois de inicializado e o Windows não
+    tem fork; nesses casos o servidor corre num só processo.
+    """
+    if not hasattr(os, "fork"):
+        return False
+    return device != "cuda"
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _configure_worker_threads(workers: int):
+    """Dividir as threads do torch entre os workers."""
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    torch.set_num_threads(threads)
+
+
+class SharedCancellations:
+    """
+    Pedidos de cancelamento visíveis a todos os workers.
+
+    Um ficheiro por job num diretório criado pelo pai antes do fork; o
+    worker que corre a geração verifica-o a cada passo.
+    """
+
+    def __init__(self):
+        self.path = Path(tempfile.mkdtemp(prefix="llm-cancel-"))
+
+    def request(self, job_id: str):
+        (self.path / job_id).touch()
+
+    def requested(self, job_id: str) -> bool:
+        return (self.path / job_id).exists()
+
+    def clear(self, job_id: str):
+        (self.path / job_id).unlink(missing_ok=True)
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class SharedPullStates:
+    """
+    Último estado conhecido de cada download, visível a todos os workers.
+
+    Um ficheiro JSON por modelo num diretório criado pelo pai antes do
+    fork; só o worker que corre o download escreve nele.
+    """
+
+    def __init__(self):
+        self.path = Path(tempfile.mkdtemp(prefix="llm-pulls-"))
+
+    def _file(self, model: str) -> Path:
+        # Nomes de modelos têm ":" e "/", por isso usa-se um hash
+        digest = hashlib.sha1(model.encode("utf-8")).hexdigest()
+        return self.path / f"{digest}.json"
+
+    def write(self, model: str, state: Dict[str, Any]):
+        target = self._file(model)
+        # Nome temporário por processo: a troca com os leitores é atómica
+        tmp = target.with_name(f"{target.stem}.{os.getpid()}.tmp")
+        tmp.write_text(
+            json.dumps(dict(state, updated_at=time.time())), encoding="utf-8"
+        )
+        os.replace(tmp, target)
+
+    def read(self, model: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self._file(model).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def read_all(self) -> List[Dict[str, Any]]:
+        states = []
+        for path in self.path.glob("*.json"):
+            try:
+                states.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+        return states
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class PreforkServer:
+    """
+    Supervisor de workers uvicorn criados por fork.
+
+    O processo principal carrega os modelos, congela o heap para o GC
+    não tocar nas páginas partilhadas e cria os workers, que aceitam
+    ligações no mesmo socket. Workers que terminem são recriados.
+    """
+
+    def __init__(self, app, host: str, port: int, workers: int,
+                 log_level: str = "info"):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.log_level = log_level
+        self.children: Dict[int, int] = {}  # pid -> slot
+        self.should_exit = False
+        self.sock = None
+
+    def _run_worker(self, slot: int):
+        """Código executado no processo filho."""
+        import uvicorn
+
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        _configure_worker_threads(self.workers)
+
+        config = uvicorn.Config(
+            self.app,
+            log_level=self.log_level,
+            access_log=True,
+            log_config=None
+        )
+        server = uvicorn.Server(config)
+        logger.info("👷 Worker %s iniciado (pid %s)", slot, os.getpid())
+        server.run(sockets=[self.sock])
+
+    def _spawn(self, slot: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker(slot)
+            except Exception as e:
+                logger.error("Worker %s falhou: %s", slot, e)
+                code = 1
+            finally:
+                # os._exit não corre os atexit: escoar os logs em fila
+                logging.shutdown()
+                os._exit(code)
+        self.children[pid] = slot
+
+    def _handle_exit(self, signum, frame):
+        self.should_exit = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """Criar os workers e supervisioná-los até receber um sinal."""
+        self.sock = _bind_socket(self.host, self.port)
+
+        # Objetos já carregados deixam de ser percorridos pelo GC, para
+        # que os workers não escrevam (e copiem) as páginas dos modelos
+        gc.collect()
+        gc.freeze()
+
+        signal.signal(signal.SIGINT, self._handle_exit)
+        signal.signal(signal.SIGTERM, self._handle_exit)
+
+        for slot in range(self.workers):
+            self._spawn(slot)
+        logger.info(
+            "🚀 %s workers em %s:%s (pid principal %s)",
+            self.workers, self.host, self.port, os.getpid()
+        )
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            slot = self.children.pop(pid, None)
+            if slot is None or self.should_exit:
+                continue
+            logger.warning(
+                "Worker %s (pid %s) terminou com estado %s; a reiniciar",
+                slot, pid, status
+            )
+            time.sleep(RESPAWN_DELAY)
+            self._spawn(slot)
+
+        self.sock.close()
+        logger.info("👋 Todos os workers terminaram")
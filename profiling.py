@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Diagnóstico de pedidos lentos.
+Tempos por etapa de cada pedido (cabeçalho Server-Timing) e um amostrador
+estatístico de stacks, ligado a pedido, que produz perfis no formato
+"folded" (flamegraph.pl, speedscope, ...).
+"""
+
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Limites do amostrador
+MAX_PROFILE_SECONDS = 300.0
+MIN_INTERVAL = 0.001
+
+
+class ServerTiming:
+    """Durações acumuladas por etapa de um pedido."""
+
+    __slots__ = ("stages", "lock", "started_at")
+
+    def __init__(self):
+        # Chegada do pedido (time.perf_counter), base das esperas em fila
+        self.started_at = time.perf_counter()
+        # nome -> [segundos, ocorrências]
+        self.stages: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = [seconds, 1]
+            else:
+                stage[0] += seconds
+                stage[1] += 1
+
+    def header(self, total: Optional[float] = None) -> str:
+        """Valor do cabeçalho Server-Timing (durações em ms)"""
+        with self.lock:
+            stages = list(self.stages.items())
+        parts = []
+        for name, (seconds, count) in stages:
+            part = f"{name};dur={seconds * 1000:.1f}"
+            if count > 1:
+                part += f';desc="{int(count)}x"'
+            parts.append(part)
+        if total is not None:
+            parts.append(f"app;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current: contextvars.ContextVar[Optional[ServerTiming]] = (
+    contextvars.ContextVar("server_timing", default=None)
+)
+
+
+def start_request() -> ServerTiming:
+    """Começar a medir as etapas do pedido no contexto atual"""
+    timing = ServerTiming()
+    _current.set(timing)
+    return timing
+
+
+def record(name: str, seconds: float):
+    """Registar uma etapa no pedido em curso (sem efeito fora de pedidos)"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+def request_started() -> Optional[float]:
+    """Instante de chegada do pedido em curso (None fora de pedidos)"""
+    timing = _current.get()
+    return timing.started_at if timing is not None else None
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Medir um bloco como etapa do pedido em curso"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+class StackSampler:
+    """
+    Amostrador de stacks de todas as threads do processo.
+
+    Só existe uma thread de amostragem enquanto um perfil está a ser
+    recolhido; desligado, o custo é a leitura de `active` por pedido.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.remaining: Optional[int] = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._labels: Dict[object, str] = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (
+                f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                f":{code.co_firstlineno})"
+            )
+        return label
+
+    def request_finished(self):
+        """Contar um pedido concluído durante o perfil"""
+        with self._lock:
+            if self.remaining is not None:
+                self.remaining -= 1
+                if self.remaining <= 0:
+                    self._done.set()
+
+    def run(
+        self, seconds: float, requests: Optional[int] = None,
+        interval: float = 0.005
+    ) -> Dict[str, object]:
+        """
+        Amostrar durante `seconds` ou até `requests` pedidos concluírem
+        (o que acontecer primeiro). Bloqueia: chamar numa thread.
+
+        Returns:
+            Perfil folded ("thread;f1;f2 contagem" por linha) e resumo
+        """
+        with self._lock:
+            if self.active:
+                raise RuntimeError("Já existe um perfil em curso")
+            self.active = True
+            self.remaining = requests if requests else None
+            self._done.clear()
+
+        seconds = min(max(seconds, 0.0), MAX_PROFILE_SECONDS)
+        interval = max(interval, MIN_INTERVAL)
+        own = threading.get_ident()
+        counts: Counter = Counter()
+        names: Dict[int, str] = {}
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        logger.info(
+            "🔬 Perfil iniciado (%.0fs, %s pedidos, %.1f ms)",
+            seconds, requests or "-", interval * 1000
+        )
+        try:
+            while not self._done.is_set() and time.monotonic() < deadline:
+                frames = sys._current_frames()
+                if len(names) != len(frames):
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(self._label(frame.f_code))
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    counts[";".join(reversed(stack))] += 1
+                frames = frame = None
+                samples += 1
+                self._done.wait(interval)
+        finally:
+            with self._lock:
+                self.active = False
+                self.remaining = None
+
+        elapsed = time.monotonic() - started
+        logger.info("🔬 Perfil concluído: %d amostras em %.1fs",
+                    samples, elapsed)
+        return {
+            "samples": samples,
+            "seconds": round(elapsed, 3),
+            "interval_ms": interval * 1000,
+            "folded": "\n".join(
+                f"{stack} {count}" for stack, count in counts.most_common()
+            )
+        }
+
+
+# Instância global
+sampler = StackSampler()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Gestor de downloads de modelos Ollama em background.
+Acompanha o progresso do /api/pull e limita downloads em paralelo.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATES = ("queued", "pulling")
+
+# Estado partilhado entre workers: escrita no máximo a cada
+# PUBLISH_INTERVAL e leitura por polling noutros workers
+PUBLISH_INTERVAL = 0.5
+POLL_INTERVAL = 0.5
+# Download ativo sem atualizações há mais tempo que isto: o worker morreu
+STALE_AFTER = 300.0
+
+
+class PullJob:
+    """Estado de um download de modelo."""
+
+    def __init__(
+        self,
+        model: str,
+        on_change: Optional[Callable[["PullJob"], None]] = None
+    ):
+        self.model = model
+        self.on_change = on_change
+        self.status = "queued"
+        self.detail = "a aguardar vaga"
+        self.total: Optional[int] = None
+        self.completed: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def active(self) -> bool:
+        """Indica se o download ainda não terminou."""
+        return self.status in ACTIVE_STATES
+
+    def _notify(self):
+        # Acorda quem espera e prepara o evento para a próxima alteração
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def update(self, progress: Dict[str, Any]):
+        """Aplicar uma linha de progresso do Ollama (no event loop)."""
+        if "error" in progress:
+            self.finish(error=progress["error"])
+            return
+
+        self.status = "pulling"
+        self.detail = progress.get("status", self.detail)
+        if "total" in progress:
+            self.total = progress["total"]
+            self.completed = progress.get("completed", 0)
+        self._notify()
+
+    def finish(self, error: Optional[str] = None):
+        """Marcar o download como terminado."""
+        self.finished_at = time.time()
+        if error is not None:
+            self.status = "error"
+            self.error = error
+        else:
+            self.status = "success"
+            self.detail = "success"
+        self._notify()
+
+    async def wait_change(self):
+        """Esperar pela próxima alteração de estado."""
+        await self._changed.wait()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Representação serializável do estado."""
+        percent = None
+        if self.total:
+            percent = round(100.0 * (self.completed or 0) / self.total, 1)
+        return {
+            "model": self.model,
+            "status": self.status,
+            "detail": self.detail,
+            "total": self.total,
+            "completed": self.completed,
+            "percent": percent,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class PullManager:
+    """
+    Executa downloads de modelos como jobs em background.
+
+    Pedidos repetidos para o mesmo modelo partilham o mesmo job e o
+    número de downloads simultâneos é limitado para não roubar largura
+    de banda à inferência.
+    """
+
+    def __init__(
+        self,
+        client,
+        max_parallel: int = 1,
+        on_complete: Optional[Callable[[PullJob], None]] = None,
+        shared_states=None
+    ):
+        """
+        Args:
+            client: OllamaClient usado para os downloads
+            max_parallel: Número máximo de downloads em simultâneo
+            on_complete: Callback chamado quando um download termina
+            shared_states: SharedPullStates onde publicar o estado para
+                os outros workers (None num só processo)
+        """
+        self.client = client
+        self.max_parallel = max_parallel
+        self.on_complete = on_complete
+        self.shared_states = shared_states
+        self.jobs: Dict[str, PullJob] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._published: Dict[str, float] = {}
+
+    def submit(self, model: str) -> PullJob:
+        """Agendar o download de um modelo (ou devolver o job em curso)."""
+        job = self.jobs.get(model)
+        if job is not None and job.active:
+            return job
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_parallel)
+
+        on_change = self._publish if self.shared_states is not None else None
+        job = PullJob(model, on_change=on_change)
+        self.jobs[model] = job
+        self._publish(job)
+        job.task = asyncio.create_task(self._run(job))
+        logger.info("📥 Download agendado: %s", model)
+        return job
+
+    async def _run(self, job: PullJob):
+        async with self._semaphore:
+            job.started_at = time.time()
+            job.status = "pulling"
+            job.detail = "a iniciar"
+            job._notify()
+            loop = asyncio.get_running_loop()
+            try:
+                status = await asyncio.to_thread(self._pull, job, loop)
+                if job.active:
+                    # Sem "success" o stream foi cortado a meio
+                    if status == "success":
+                        job.finish()
+                    else:
+                        job.finish(
+                            error="o download terminou sem confirmação "
+                                  "do Ollama"
+                        )
+            except Exception as e:
+                job.finish(error=str(e))
+
+        if job.status == "success":
+            logger.info("✅ Modelo %s instalado", job.model)
+        else:
+            logger.error("❌ Falha ao instalar %s: %s", job.model, job.error)
+
+        if self.on_complete:
+            try:
+                self.on_complete(job)
+            except Exception as e:
+                logger.warning("Erro no callback de download: %s", e)
+
+    def _pull(
+        self, job: PullJob, loop: asyncio.AbstractEventLoop
+    ) -> Optional[str]:
+        """
+        Ler o stream de progresso (em thread) e publicar no event loop.
+
+        Returns:
+            O último status recebido ("success" num download completo)
+        """
+        status = None
+        for progress in self.client.pull_stream(job.model):
+            loop.call_soon_threadsafe(job.update, progress)
+            if "error" in progress:
+                return None
+            status = progress.get("status", status)
+        return status
+
+    def _publish(self, job: PullJob):
+        """Escrever o estado partilhado (limitado durante o progresso)."""
+        if self.shared_states is None:
+            return
+        now = time.monotonic()
+        last = self._published.get(job.model)
+        if (job.active and job.status != "queued" and last is not None
+                and now - last < PUBLISH_INTERVAL):
+            return
+        self._published[job.model] = now
+        try:
+            self.shared_states.write(job.model, job.to_dict())
+        except OSError as e:
+            logger.warning("Erro ao publicar o estado de %s: %s", job.model, e)
+
+    def shared_state(self, model: str) -> Optional[Dict[str, Any]]:
+        """Último estado publicado por qualquer worker (ou None)."""
+        if self.shared_states is None:
+            return None
+        return self.shared_states.read(model)
+
+    async def watch(
+        self, job: PullJob
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Gerar snapshots do estado até o download terminar."""
+        while True:
+            yield job.to_dict()
+            if not job.active:
+                return
+            await job.wait_change()
+
+    async def watch_shared(
+        self, model: str
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Acompanhar um download que corre noutro worker.
+
+        Lê o estado partilhado até o download terminar; um download ativo
+        sem atualizações durante STALE_AFTER é dado como falhado.
+        """
+        last = None
+        while True:
+            state = self.shared_state(model)
+            if state is None:
+                return
+            active = state.get("status") in ACTIVE_STATES
+            if active and time.time() - state["updated_at"] > STALE_AFTER:
+                state = dict(
+                    state, status="error",
+                    error="o worker do download deixou de responder"
+                )
+                active = False
+            if state != last:
+                yield state
+                last = state
+            if not active:
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """Estado de todos os downloads conhecidos (de todos os workers)."""
+        jobs = {model: job.to_dict() for model, job in self.jobs.items()}
+        if self.shared_states is not None:
+            for state in self.shared_states.read_all():
+                jobs.setdefault(state["model"], state)
+        return list(jobs.values())
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Degradação de qualidade adaptada à carga.
+Cada serviço (chat, image, whisper) tem um nível de qualidade que sobe
+quando a fila ou a latência passam dos limites e volta ao normal, um
+nível de cada vez, depois de um período sem pressão. Os endpoints usam o
+nível para cortar custos (menos passos SD, Whisper menor ou greedy,
+modelo Ollama mais leve) e indicam-no na resposta.
+"""
+
+import contextvars
+import logging
+import math
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TIERS = ("full", "reduced", "minimal")
+
+# Fração dos passos SD pedidos mantida em cada nível
+SD_STEP_SCALE = (1.0, 0.6, 0.35)
+
+WHISPER_SIZES = ("tiny", "base", "small", "medium", "large")
+_WHISPER_SIZE = re.compile(r"whisper-(tiny|base|small|medium|large)(-v\d)?")
+
+# Janela das latências usadas para o percentil 90
+LATENCY_WINDOW = 60.0
+MIN_LATENCY_SAMPLES = 5
+# Pressão até à qual o serviço conta como calmo (histerese)
+RECOVER_BELOW = 0.5
+# Intervalo mínimo entre duas degradações seguidas
+ESCALATE_COOLDOWN = 5.0
+
+
+class ServiceLoad:
+    """Pedidos em curso, latências recentes e nível de um serviço."""
+
+    def __init__(self, name: str, max_queue: float, slo_seconds: float):
+        self.name = name
+        self.max_queue = max_queue
+        self.slo_seconds = slo_seconds
+        self.in_flight = 0
+        self.latencies: Deque[Tuple[float, float]] = deque()
+        self.tier = 0
+        self.changed_at = 0.0
+        # Último momento com pressão acima de RECOVER_BELOW
+        self.hot_at = 0.0
+        self.last_pressure = 0.0
+        self.changes = 0
+
+    def p90(self, now: float) -> Optional[float]:
+        while self.latencies and self.latencies[0][0] < now - LATENCY_WINDOW:
+            self.latencies.popleft()
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        values = sorted(seconds for _, seconds in self.latencies)
+        return values[math.ceil(len(values) * 0.9) - 1]
+
+    def pressure(self, now: float) -> float:
+        """max(fila / limite, p90 / SLO): acima de 1 há sobrecarga"""
+        pressure = self.in_flight / self.max_queue if self.max_queue else 0.0
+        p90 = self.p90(now)
+        if p90 is not None and self.slo_seconds:
+            pressure = max(pressure, p90 / self.slo_seconds)
+        return pressure
+
+    def update(self, now: float, max_tier: int,
+               recover_after: float) -> int:
+        pressure = self.last_pressure = self.pressure(now)
+        if pressure > RECOVER_BELOW:
+            self.hot_at = now
+        if pressure > 1.0:
+            if (self.tier < max_tier
+                    and now - self.changed_at >= ESCALATE_COOLDOWN):
+                self._set(self.tier + 1, now)
+        elif self.tier > 0:
+            # Um nível por cada recover_after seguido sem pressão
+            calm = now - max(self.hot_at, self.changed_at)
+            steps = int(calm // recover_after)
+            if steps:
+                self._set(max(0, self.tier - steps), now)
+        return min(self.tier, max_tier)
+
+    def _set(self, tier: int, now: float):
+        logger.warning(
+            "🎚️ Qualidade de %s: %s -> %s (pressão %.2f, %d em curso)",
+            self.name, TIERS[self.tier], TIERS[tier], self.last_pressure,
+            self.in_flight
+        )
+        self.tier = tier
+        self.changed_at = now
+        self.changes += 1
+        # As latências anteriores refletem o custo do nível antigo
+        self.latencies.clear()
+
+    def get_status(self) -> Dict[str, Any]:
+        p90 = self.p90(time.monotonic())
+        return {
+            "tier": TIERS[self.tier],
+            "in_flight": self.in_flight,
+            "max_queue": self.max_queue,
+            "p90_seconds": round(p90, 3) if p90 is not None else None,
+            "slo_seconds": self.slo_seconds,
+            "pressure": round(self.last_pressure, 2),
+            "changes": self.changes
+        }
+
+
+class Ticket:
+    """Admissão de um pedido; release() regista a latência (uma vez)."""
+
+    __slots__ = ("controller", "service", "tier", "started", "released")
+
+    def __init__(self, controller: "QualityController", service: str,
+                 tier: int):
+        self.controller = controller
+        self.service = service
+        self.tier = tier
+        self.started = time.monotonic()
+        self.released = False
+
+    @property
+    def name(self) -> str:
+        return TIERS[self.tier]
+
+    def release(self, latency: Optional[float] = None, record: bool = True):
+        """
+        Fim do pedido. latency substitui o tempo total (ex. time to first
+        token no chat); record=False não conta a latência (cancelados).
+        """
+        if self.released:
+            return
+        self.released = True
+        if latency is None:
+            latency = time.monotonic() - self.started
+        self.controller.release(self.service, latency if record else None)
+
+
+_tags: contextvars.ContextVar[Optional[Dict[str, str]]] = (
+    contextvars.ContextVar("quality_tags", default=None)
+)
+
+
+def start_request() -> Dict[str, str]:
+    """Começar a recolher os níveis usados pelo pedido em curso"""
+    tags: Dict[str, str] = {}
+    _tags.set(tags)
+    return tags
+
+
+def header(tags: Dict[str, str]) -> Optional[str]:
+    """Valor de X-Quality-Tier: o nível mais baixo usado no pedido"""
+    if not tags:
+        return None
+    return max(tags.values(), key=TIERS.index)
+
+
+class QualityController:
+    """
+    Níveis de qualidade por serviço a partir da fila e da latência.
+
+    Chamado só no event loop: admit() conta o pedido e reavalia o nível,
+    release() tira-o da fila e guarda a latência.
+    """
+
+    def __init__(
+        self,
+        max_queue: Dict[str, float],
+        slo_seconds: Dict[str, float],
+        max_tier: int = len(TIERS) - 1,
+        recover_after: float = 30.0
+    ):
+        """
+        Args:
+            max_queue: Serviço -> pedidos em curso/espera aceites sem
+                degradar
+            slo_seconds: Serviço -> p90 de latência alvo
+            max_tier: Nível máximo de degradação (0 desativa)
+            recover_after: Segundos sem pressão para subir um nível
+        """
+        self.max_tier = max(0, min(max_tier, len(TIERS) - 1))
+        self.recover_after = recover_after
+        self.services: Dict[str, ServiceLoad] = {
+            name: ServiceLoad(
+                name, max_queue.get(name, 0.0), slo_seconds.get(name, 0.0)
+            )
+            for name in set(max_queue) | set(slo_seconds)
+        }
+
+    def _service(self, name: str) -> ServiceLoad:
+        load = self.services.get(name)
+        if load is None:
+            load = self.services[name] = ServiceLoad(name, 0.0, 0.0)
+        return load
+
+    def share(self, workers: int):
+        """
+        Dividir os limites de fila por `workers` processos: cada worker
+        só vê os pedidos que aceitou, cerca de 1/workers da carga.
+        """
+        for load in self.services.values():
+            load.max_queue /= workers
+
+    def admit(self, service: str) -> Ticket:
+        """Contar um pedido e devolver o nível a usar"""
+        load = self._service(service)
+        load.in_flight += 1
+        tier = load.update(
+            time.monotonic(), self.max_tier, self.recover_after
+        )
+        tags = _tags.get()
+        if tags is not None:
+            tags[service] = TIERS[tier]
+        return Ticket(self, service, tier)
+
+    def release(self, service: str, latency: Optional[float]):
+        load = self._service(service)
+        load.in_flight = max(0, load.in_flight - 1)
+        if latency is not None:
+            load.latencies.append((time.monotonic(), latency))
+
+    @contextmanager
+    def track(self, service: str) -> Iterator[Ticket]:
+        """admit/release à volta de um bloco (latência só se não falhar)"""
+        ticket = self.admit(service)
+        try:
+            yield ticket
+        except BaseException:
+            ticket.release(record=False)
+            raise
+        ticket.release()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "max_tier": TIERS[self.max_tier],
+            "recover_after": self.recover_after,
+            "services": {
+                name: load.get_status()
+                for name, load in sorted(self.services.items())
+            }
+        }
+
+
+# ----------------------------------------------------------------------
+# Custos por nível
+# ----------------------------------------------------------------------
+
+def scaled_steps(requested: int, tier: int, min_steps: int) -> int:
+    """Passos SD para o nível, entre min_steps e os passos pedidos"""
+    steps = round(requested * SD_STEP_SCALE[tier])
+    return min(requested, max(min_steps, steps))
+
+
+def smaller_whisper(
+    model_name: str, optimal: str, floor: str
+) -> Optional[str]:
+    """
+    Modelo Whisper um tamanho abaixo do atual, ou menor se a memória
+    livre o pedir (optimal, de ResourceManager.get_optimal_model), sem
+    descer abaixo de floor. None se não houver modelo menor aceitável.
+    """
+    match = _WHISPER_SIZE.search(model_name)
+    if match is None:
+        return None
+    current = WHISPER_SIZES.index(match.group(1))
+    target = current - 1
+    if optimal in WHISPER_SIZES:
+        target = min(target, WHISPER_SIZES.index(optimal))
+    if floor in WHISPER_SIZES:
+        target = max(target, WHISPER_SIZES.index(floor))
+    if target < 0 or target >= current:
+        return None
+    return (
+        model_name[:match.start()] + f"whisper-{WHISPER_SIZES[target]}"
+        + model_name[match.end():]
+    )
+
+
+def lighter_model(
+    model: str, known: Iterable[Dict[str, Any]], installed: Iterable[str]
+) -> Optional[str]:
+    """
+    O modelo conhecido e instalado logo abaixo de `model` (por params_b),
+    para a qualidade descer um degrau de cada vez
+    """
+    known = [entry for entry in known if entry.get("params_b")]
+    sizes = {entry["name"]: entry["params_b"] for entry in known}
+    if model not in sizes:
+        return None
+    installed = set(installed)
+    candidates = [
+        entry for entry in known
+        if entry["name"] in installed and entry["params_b"] < sizes[model]
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda entry: entry["params_b"])["name"]
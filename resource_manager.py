@@ -3,23 +3,73 @@
 Gestor de recursos para otimizar o uso de CPU/GPU entre serviços.
 """
 
+import multiprocessing
 import psutil
 import threading
 import time
-from typing import Optional
+from typing import Callable, List, Optional
 import logging
 
+import metrics
+
 logger = logging.getLogger(__name__)
 
+
+def _shared_rlock():
+    """RLock válido entre processos criados por fork (ou só entre threads)"""
+    try:
+        return multiprocessing.RLock()
+    except (OSError, ImportError):
+        # Sem semáforos POSIX (ex. /dev/shm indisponível)
+        return threading.RLock()
+
+
 class ResourceManager:
     """
     Gestor de recursos para otimizar o uso de CPU/GPU entre serviços.
     """
     
     def __init__(self):
-        self.whisper_active = False
-        self.stable_diffusion_active = False
-        self.lock = threading.Lock()
+        # Memória partilhada: as reservas valem para todos os workers
+        # criados por fork depois de este objeto existir
+        self._whisper = multiprocessing.RawValue("b", 0)
+        self._stable_diffusion = multiprocessing.RawValue("b", 0)
+        # RLock: reserve_whisper chama can_use_whisper com o lock adquirido
+        self.lock = _shared_rlock()
+        # Notificados quando um serviço reserva ou liberta memória
+        self.listeners: List[Callable[[str], None]] = []
+
+    @property
+    def whisper_active(self) -> bool:
+        return bool(self._whisper.value)
+
+    @whisper_active.setter
+    def whisper_active(self, value: bool):
+        self._whisper.value = int(value)
+
+    @property
+    def stable_diffusion_active(self) -> bool:
+        return bool(self._stable_diffusion.value)
+
+    @stable_diffusion_active.setter
+    def stable_diffusion_active(self, value: bool):
+        self._stable_diffusion.value = int(value)
+
+    def add_listener(self, callback: Callable[[str], None]):
+        """Registar uma função chamada com o nome do serviço em cada mudança."""
+        self.listeners.append(callback)
+
+    def notify(self, service: str):
+        """Avisar os listeners de que o uso de memória mudou."""
+        for callback in self.listeners:
+            try:
+                callback(service)
+            except Exception as e:
+                logger.warning("Listener de recursos falhou: %s", e)
+
+    def available_memory_gb(self) -> float:
+        """RAM disponível em GB."""
+        return psutil.virtual_memory().available / (1024**3)
         
     def can_use_whisper(self) -> bool:
         """Verifica se é seguro usar o Whisper agora."""
@@ -27,7 +77,7 @@ class ResourceManager:
             # Verificar uso de memória
             memory_percent = psutil.virtual_memory().percent
             if memory_percent > 85:
-                logger.warning(f"Memória muito alta: {memory_percent}%")
+                logger.warning("Memória muito alta: %s%%", memory_percent)
                 return False
             
             # Verificar se Stable Diffusion está ativo
@@ -43,7 +93,9 @@ class ResourceManager:
             if self.can_use_whisper():
                 self.whisper_active = True
                 logger.info("Recursos reservados para Whisper")
+                self.notify("whisper")
                 return True
+            metrics.RESOURCE_REJECTIONS.inc("whisper")
             return False
     
     def release_whisper(self):
@@ -51,6 +103,7 @@ class ResourceManager:
         with self.lock:
             self.whisper_active = False
             logger.info("Recursos do Whisper libertados")
+            self.notify("whisper")
     
     def reserve_stable_diffusion(self) -> bool:
         """Reserva recursos para Stable Diffusion."""
@@ -59,6 +112,7 @@ class ResourceManager:
                 self.stable_diffusion_active = True
                 logger.info("Recursos reservados para Stable Diffusion")
                 return True
+            metrics.RESOURCE_REJECTIONS.inc("stable_diffusion")
             return False
     
     def release_stable_diffusion(self):
@@ -118,7 +172,7 @@ class ResourceManager:
             
             time.sleep(2)
         
-        logger.warning(f"Timeout aguardando recursos para {service}")
+        logger.warning("Timeout aguardando recursos para %s", service)
         return False
 
 # Instância global
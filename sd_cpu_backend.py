@@ -0,0 +1,638 @@
+# -*- coding: utf-8 -*-
+"""
+Backends de aceleração em CPU para a UNet e o VAE do Stable Diffusion.
+
+    eager          fp32 PyTorch, sem alterações (referência)
+    channels_last  fp32 com tensores em formato NHWC
+    bf16           channels_last + autocast bfloat16 (se o CPU suportar)
+    compile        channels_last + torch.compile (+ bf16 se suportado)
+    onnx           UNet e decoder do VAE exportados para ONNX Runtime
+
+Os artefactos compilados (ONNX otimizado, cache do Inductor) ficam em
+disco e são reutilizados nos arranques seguintes. Antes de ser ativado,
+cada backend é comparado com o eager numa passagem curta e, se divergir,
+o pipeline volta ao eager. Com o onnx ativo, os pesos torch da UNet e do
+decoder são libertados (o ONNX Runtime tem a sua cópia).
+
+    python sd_cpu_backend.py benchmark --backends eager,bf16,compile,onnx
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("eager", "channels_last", "bf16", "compile", "onnx")
+
+ONNX_OPSET = 17
+
+# Diferença máxima relativa à saída eager aceite pela verificação
+FP32_TOLERANCE = 1e-3
+BF16_TOLERANCE = 5e-2
+
+# Latentes da verificação de paridade (32x32 = imagem de 256 px)
+PARITY_LATENT_SIZE = 32
+
+
+def bf16_supported() -> bool:
+    """O CPU tem instruções bfloat16 nativas (AVX512-BF16 ou AMX)?"""
+    import torch
+
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        pass
+    try:
+        flags = Path("/proc/cpuinfo").read_text().split()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def _restore_forward(module):
+    # forward substituído na instância: remover repõe o da classe
+    module.__dict__.pop("forward", None)
+
+
+def _unet_for_export(unet):
+    """UNet com assinatura posicional e saída em tensor, para o ONNX"""
+    import torch
+
+    class UNetExport(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.unet = unet
+
+        def forward(self, sample, timestep, encoder_hidden_states):
+            return self.unet(
+                sample, timestep, encoder_hidden_states, return_dict=False
+            )[0]
+
+    return UNetExport()
+
+
+class OnnxUNet:
+    """forward da UNet servido por uma sessão ONNX Runtime."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def __call__(self, sample, timestep, encoder_hidden_states, *args,
+                 return_dict: bool = True, **kwargs):
+        import torch
+
+        unsupported = [k for k, v in kwargs.items() if v is not None]
+        if args or unsupported:
+            raise ValueError(
+                f"Argumentos da UNet sem suporte em ONNX: {unsupported}"
+            )
+        timestep = torch.as_tensor(timestep, dtype=torch.float32)
+        output = self.session.run(None, {
+            "sample": sample.detach().float().contiguous().numpy(),
+            "timestep": timestep.reshape(-1)[:1].numpy(),
+            "encoder_hidden_states": (
+                encoder_hidden_states.detach().float().contiguous().numpy()
+            ),
+        })[0]
+        output = torch.from_numpy(output).to(sample.dtype)
+        if return_dict:
+            return SimpleNamespace(sample=output)
+        return (output,)
+
+
+class OnnxDecoder:
+    """forward do decoder do VAE servido por ONNX Runtime."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def __call__(self, sample, latent_embeds=None):
+        import torch
+
+        if latent_embeds is not None:
+            raise ValueError("latent_embeds sem suporte em ONNX")
+        output = self.session.run(None, {
+            "latent": sample.detach().float().contiguous().numpy()
+        })[0]
+        return torch.from_numpy(output).to(sample.dtype)
+
+
+class CPUBackend:
+    """
+    Backend de execução da UNet e do decoder do VAE em CPU.
+
+    apply() altera os módulos no sítio (formato de memória e forward), por
+    isso vale para todos os pipelines que partilham os componentes;
+    autocast() envolve cada geração.
+    """
+
+    def __init__(self, name: str = "eager",
+                 cache_dir: Optional[Path] = None,
+                 release_weights: bool = True):
+        """
+        Args:
+            name: Backend (ver BACKENDS)
+            cache_dir: Base dos artefactos compilados
+            release_weights: Com onnx, libertar os pesos torch que o ONNX
+                Runtime substitui (sem eles revert() deixa de ser possível)
+        """
+        if name not in BACKENDS:
+            raise ValueError(
+                f"Backend CPU desconhecido: {name} "
+                f"(opções: {', '.join(BACKENDS)})"
+            )
+        self.requested = name
+        self.name = name
+        self.cache_dir = Path(cache_dir or "cache") / "sd_cpu"
+        self.bf16 = False
+        self.parity: Optional[Dict[str, Any]] = None
+        self.fallback_reason: Optional[str] = None
+        self.setup_seconds = 0.0
+        self.release_weights = release_weights
+        self.released_gb = 0.0
+
+    # ------------------------------------------------------------------
+    # Ativação
+    # ------------------------------------------------------------------
+
+    def apply(self, pipeline, parity: bool = True) -> "CPUBackend":
+        """
+        Preparar os módulos do pipeline para este backend.
+
+        Com parity=True compara a UNet e o decoder com o eager e volta
+        ao eager se a diferença passar da tolerância.
+        """
+        if self.name == "eager":
+            return self
+        import torch
+
+        started = time.perf_counter()
+        reference = None
+        if parity:
+            inputs = self._parity_inputs(pipeline)
+            with torch.no_grad():
+                reference = self._forward(pipeline, inputs)
+
+        try:
+            self._apply(pipeline)
+        except Exception as e:
+            self._fall_back(pipeline, f"falha ao preparar: {e}")
+            return self
+
+        if parity:
+            with torch.no_grad(), self.autocast():
+                candidate = self._forward(pipeline, inputs)
+            self.parity = self._compare(reference, candidate)
+            if not self.parity["ok"]:
+                self._fall_back(
+                    pipeline, "diferença acima da tolerância "
+                    f"({self.parity['max_rel_diff']:.2e})"
+                )
+                return self
+
+        if self.name == "onnx" and self.release_weights:
+            self._release_torch_weights(pipeline)
+        self.setup_seconds = time.perf_counter() - started
+        logger.info(
+            "⚡ Backend CPU do SD: %s (bf16=%s, %.1fs de preparação)",
+            self.name, self.bf16, self.setup_seconds
+        )
+        return self
+
+    def _apply(self, pipeline):
+        import torch
+
+        if self.name == "onnx":
+            self._apply_onnx(pipeline)
+            return
+
+        for module in (pipeline.unet, pipeline.vae):
+            module.to(memory_format=torch.channels_last)
+
+        if self.name in ("bf16", "compile"):
+            self.bf16 = bf16_supported()
+            if not self.bf16:
+                logger.warning(
+                    "CPU sem bfloat16 nativo: %s continua em fp32", self.name
+                )
+
+        if self.name == "compile":
+            # Reutilizar os kernels gerados pelo Inductor entre arranques
+            os.environ.setdefault(
+                "TORCHINDUCTOR_CACHE_DIR", str(self.cache_dir / "inductor")
+            )
+            os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+            for module in (pipeline.unet, pipeline.vae.decoder):
+                module.forward = torch.compile(module.forward)
+
+    def revert(self, pipeline):
+        """
+        Repor os módulos em eager fp32.
+
+        Raises:
+            RuntimeError: Se os pesos torch já tiverem sido libertados
+        """
+        import torch
+
+        if self.released_gb:
+            raise RuntimeError(
+                "Pesos torch da UNet libertados pelo backend onnx: "
+                "é preciso recarregar o pipeline"
+            )
+
+        for module in (pipeline.unet, pipeline.vae.decoder):
+            _restore_forward(module)
+        for module in (pipeline.unet, pipeline.vae):
+            module.to(memory_format=torch.contiguous_format)
+        self.bf16 = False
+
+    def _fall_back(self, pipeline, reason: str):
+        logger.warning(
+            "⚠️ Backend CPU %s desativado (%s): a usar eager",
+            self.name, reason
+        )
+        self.revert(pipeline)
+        self.fallback_reason = reason
+        self.name = "eager"
+
+    @contextlib.contextmanager
+    def autocast(self) -> Iterator[None]:
+        """Contexto de cada geração (autocast bf16 quando ativo)"""
+        if not self.bf16:
+            yield
+            return
+        import torch
+
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            yield
+
+    # ------------------------------------------------------------------
+    # ONNX Runtime
+    # ------------------------------------------------------------------
+
+    def artifact_dir(self, pipeline) -> Path:
+        """Diretório dos artefactos deste modelo nesta máquina"""
+        import onnxruntime
+        import torch
+
+        source = getattr(pipeline, "name_or_path", None) or str(
+            pipeline.config.get("_name_or_path", "")
+        )
+        key = hashlib.sha256(json.dumps([
+            source, torch.__version__, onnxruntime.__version__,
+            ONNX_OPSET, platform.machine()
+        ]).encode()).hexdigest()[:16]
+        slug = Path(source).name or "model"
+        return self.cache_dir / "onnx" / f"{slug}-{key}"
+
+    def _apply_onnx(self, pipeline):
+        import torch
+
+        unet = pipeline.unet
+        vae = pipeline.vae
+        size = PARITY_LATENT_SIZE
+        directory = self.artifact_dir(pipeline)
+
+        unet_session = self._session(
+            directory / "unet",
+            lambda path: torch.onnx.export(
+                _unet_for_export(unet),
+                (
+                    torch.randn(2, unet.config.in_channels, size, size),
+                    torch.tensor([999.0]),
+                    torch.randn(2, 77, unet.config.cross_attention_dim),
+                ),
+                str(path),
+                input_names=["sample", "timestep", "encoder_hidden_states"],
+                output_names=["out_sample"],
+                dynamic_axes={
+                    "sample": {0: "batch", 2: "height", 3: "width"},
+                    "encoder_hidden_states": {0: "batch", 1: "tokens"},
+                    "out_sample": {0: "batch", 2: "height", 3: "width"},
+                },
+                opset_version=ONNX_OPSET,
+                do_constant_folding=True
+            )
+        )
+        decoder_session = self._session(
+            directory / "vae_decoder",
+            lambda path: torch.onnx.export(
+                vae.decoder,
+                (torch.randn(1, vae.config.latent_channels, size, size),),
+                str(path),
+                input_names=["latent"],
+                output_names=["image"],
+                dynamic_axes={
+                    "latent": {0: "batch", 2: "height", 3: "width"},
+                    "image": {0: "batch", 2: "height", 3: "width"},
+                },
+                opset_version=ONNX_OPSET,
+                do_constant_folding=True
+            )
+        )
+        unet.forward = OnnxUNet(unet_session)
+        vae.decoder.forward = OnnxDecoder(decoder_session)
+
+    def _release_torch_weights(self, pipeline):
+        """
+        Trocar os parâmetros da UNet e do decoder por tensores vazios.
+
+        O ONNX Runtime tem a sua cópia dos pesos; os do torch deixam de
+        ser usados e ocupariam a mesma RAM outra vez. Os módulos ficam no
+        pipeline (config, dtype e .to() continuam a funcionar).
+        """
+        import torch
+
+        released = 0
+        for module in (pipeline.unet, pipeline.vae.decoder):
+            for param in module.parameters():
+                released += param.numel() * param.element_size()
+                param.data = torch.empty(0, dtype=param.dtype)
+        self.released_gb = released / 1024 ** 3
+        logger.info(
+            "🧹 Pesos torch da UNet/decoder libertados (%.2f GB)",
+            self.released_gb
+        )
+
+    def _session(self, directory: Path, export):
+        """
+        Sessão ONNX Runtime a partir da cache, exportando na primeira vez.
+
+        O modelo exportado é otimizado pelo ONNX Runtime uma vez e a
+        versão otimizada é gravada ao lado; os arranques seguintes
+        carregam-na sem voltar a otimizar.
+        """
+        import onnxruntime as ort
+        import torch
+
+        model = directory / "model.onnx"
+        optimized = directory / "model.opt.onnx"
+        if not model.exists():
+            partial = directory.with_name(directory.name + ".partial")
+            shutil.rmtree(partial, ignore_errors=True)
+            partial.mkdir(parents=True)
+            logger.info("📦 A exportar %s para ONNX...", directory.name)
+            with torch.no_grad():
+                export(partial / "model.onnx")
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(partial, directory)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        if optimized.exists():
+            source = optimized
+            options.graph_optimization_level = (
+                ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            )
+        else:
+            source = model
+            options.graph_optimization_level = (
+                ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            )
+            options.optimized_model_filepath = str(optimized)
+            # Pesos acima de 2 GB não cabem num único ficheiro protobuf
+            options.add_session_config_entry(
+                "session.optimized_model_external_initializers_file_name",
+                "model.opt.onnx.data"
+            )
+        return ort.InferenceSession(
+            str(source), options, providers=["CPUExecutionProvider"]
+        )
+
+    # ------------------------------------------------------------------
+    # Paridade com o eager
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _parity_inputs(pipeline) -> Dict[str, Any]:
+        import torch
+
+        generator = torch.Generator().manual_seed(0)
+        unet, vae = pipeline.unet, pipeline.vae
+        size = PARITY_LATENT_SIZE
+        return {
+            "sample": torch.randn(
+                2, unet.config.in_channels, size, size, generator=generator
+            ),
+            "timestep": torch.tensor(500),
+            "encoder_hidden_states": torch.randn(
+                2, 77, unet.config.cross_attention_dim, generator=generator
+            ),
+            "latent": torch.randn(
+                1, vae.config.latent_channels, size, size, generator=generator
+            ),
+        }
+
+    @staticmethod
+    def _forward(pipeline, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        unet_out = pipeline.unet(
+            inputs["sample"], inputs["timestep"],
+            inputs["encoder_hidden_states"], return_dict=False
+        )[0]
+        decoder_out = pipeline.vae.decoder(inputs["latent"])
+        return {"unet": unet_out.float(), "vae_decoder": decoder_out.float()}
+
+    def _compare(self, reference, candidate) -> Dict[str, Any]:
+        tolerance = BF16_TOLERANCE if self.bf16 else FP32_TOLERANCE
+        diffs = {}
+        for name, expected in reference.items():
+            error = (candidate[name] - expected).abs().max().item()
+            scale = max(expected.abs().max().item(), 1e-6)
+            diffs[name] = error / scale
+        worst = max(diffs.values())
+        return {
+            "ok": worst <= tolerance,
+            "max_rel_diff": worst,
+            "tolerance": tolerance,
+            "modules": {k: float(f"{v:.3g}") for k, v in diffs.items()},
+        }
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "requested": self.requested,
+            "bf16": self.bf16,
+            "parity": self.parity,
+            "fallback_reason": self.fallback_reason,
+            "setup_seconds": round(self.setup_seconds, 2),
+            "released_gb": round(self.released_gb, 2),
+        }
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def _timed_generation(pipeline, backend: CPUBackend, prompt: str,
+                      steps: int, size: int, seed: int):
+    import torch
+
+    marks: List[float] = []
+
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        marks.append(time.perf_counter())
+        return callback_kwargs
+
+    with torch.no_grad(), backend.autocast():
+        started = time.perf_counter()
+        output = pipeline(
+            prompt=prompt,
+            num_inference_steps=steps,
+            width=size,
+            height=size,
+            generator=torch.Generator().manual_seed(seed),
+            callback_on_step_end=on_step_end,
+            output_type="latent"
+        )
+        latents = output.images
+        decode_started = time.perf_counter()
+        pipeline.vae.decode(
+            latents / pipeline.vae.config.scaling_factor, return_dict=False
+        )
+        decode_seconds = time.perf_counter() - decode_started
+
+    step_times = [b - a for a, b in zip([started] + marks, marks)]
+    return latents.float(), step_times, decode_seconds
+
+
+def benchmark(
+    pipeline,
+    backends: List[str],
+    steps: int = 10,
+    size: int = 512,
+    prompt: str = "a lighthouse on a cliff at sunset, detailed painting",
+    seed: int = 0,
+    cache_dir: Optional[Path] = None
+) -> List[Dict[str, Any]]:
+    """
+    Segundos por passo de cada backend e paridade com o eager.
+
+    Cada backend faz uma geração de aquecimento (compilação, exportação)
+    e outra medida com a mesma seed; os latentes finais são comparados
+    com os do eager.
+    """
+    if "eager" in backends:
+        backends = ["eager"] + [b for b in backends if b != "eager"]
+    else:
+        backends = ["eager"] + list(backends)
+
+    results = []
+    reference = None
+    eager_step = None
+    for name in backends:
+        # Os pesos torch são precisos para os backends seguintes
+        backend = CPUBackend(name, cache_dir, release_weights=False)
+        backend.apply(pipeline, parity=True)
+        active, bf16 = backend.name, backend.bf16
+        try:
+            _timed_generation(pipeline, backend, prompt, 2, size, seed)
+            latents, step_times, decode_seconds = _timed_generation(
+                pipeline, backend, prompt, steps, size, seed
+            )
+        finally:
+            backend.revert(pipeline)
+
+        # O primeiro passo inclui a codificação do prompt
+        per_step = statistics.median(step_times[1:] or step_times)
+        if reference is None:
+            reference = latents
+            eager_step = per_step
+        latent_diff = (latents - reference).abs().max().item() / max(
+            reference.abs().max().item(), 1e-6
+        )
+        results.append({
+            "backend": name,
+            "active": active,
+            "bf16": bf16,
+            "sec_per_step": round(per_step, 4),
+            "speedup": round(eager_step / per_step, 2),
+            "vae_decode_seconds": round(decode_seconds, 3),
+            "setup_seconds": round(backend.setup_seconds, 1),
+            "parity": backend.parity,
+            "latent_rel_diff": float(f"{latent_diff:.3g}"),
+        })
+        logger.info(
+            "⏱️ %s: %.3f s/passo (x%.2f)", name, per_step,
+            eager_step / per_step
+        )
+    return results
+
+
+def main(argv=None) -> int:
+    """Interface de linha de comandos dos backends CPU"""
+    from model_store import HF_CACHE_DIR
+    from sd_engine import load_pipeline
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(
+        description="Backends CPU do Stable Diffusion"
+    )
+    parser.add_argument(
+        "--model", default=os.getenv(
+            "STABLE_DIFFUSION_MODEL", "runwayml/stable-diffusion-v1-5"
+        )
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    bench = sub.add_parser("benchmark", help="Segundos por passo e paridade")
+    bench.add_argument("--backends", default=",".join(BACKENDS))
+    bench.add_argument("--steps", type=int, default=10)
+    bench.add_argument("--size", type=int, default=512)
+    bench.add_argument("--json", action="store_true",
+                       help="Resultados em JSON")
+
+    export = sub.add_parser(
+        "export", help="Preparar os artefactos de um backend (ex. na imagem)"
+    )
+    export.add_argument("backend", choices=BACKENDS)
+
+    args = parser.parse_args(argv)
+    pipeline = load_pipeline(args.model, "cpu", HF_CACHE_DIR)
+
+    if args.command == "export":
+        backend = CPUBackend(args.backend, HF_CACHE_DIR).apply(pipeline)
+        print(json.dumps(backend.get_status(), indent=2))
+        return 0 if backend.name == args.backend else 1
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = [b for b in backends if b not in BACKENDS]
+    if unknown:
+        parser.error(f"Backends desconhecidos: {', '.join(unknown)}")
+    results = benchmark(
+        pipeline, backends, args.steps, args.size, cache_dir=HF_CACHE_DIR
+    )
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{'backend':<14}{'s/passo':>10}{'speedup':>9}"
+          f"{'vae (s)':>9}{'paridade':>11}{'dif. latentes':>15}")
+    for row in results:
+        parity = row["parity"]
+        status = "-" if parity is None else (
+            "ok" if parity["ok"] else "FALHOU"
+        )
+        name = row["backend"]
+        if row["active"] != name:
+            name += "*"
+        print(f"{name:<14}{row['sec_per_step']:>10.3f}"
+              f"{row['speedup']:>9.2f}{row['vae_decode_seconds']:>9.2f}"
+              f"{status:>11}{row['latent_rel_diff']:>15.3g}")
+    if any(row["active"] != row["backend"] for row in results):
+        print("* desativado na verificação de paridade (correu em eager)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Motor Stable Diffusion com vários pipelines sobre os mesmos pesos.
+txt2img, img2img e inpaint partilham UNet, VAE e text encoder já
+carregados, para a memória ficar na de um único modelo.
+"""
+
+import contextlib
+import inspect
+import io
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+from cancellation import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+MODES = ("txt2img", "img2img", "inpaint")
+
+# Componentes com pesos que nunca devem ser duplicados
+WEIGHT_COMPONENTS = ("unet", "vae", "text_encoder")
+
+_PIPELINE_CLASSES = {
+    "img2img": "StableDiffusionImg2ImgPipeline",
+    "inpaint": "StableDiffusionInpaintPipeline",
+}
+
+
+def _fit_size(width: int, height: int, max_size: int):
+    """Reduzir para caber em max_size e arredondar a múltiplos de 8"""
+    scale = min(1.0, max_size / max(width, height))
+    width = max(64, int(width * scale) // 8 * 8)
+    height = max(64, int(height * scale) // 8 * 8)
+    return width, height
+
+
+def load_pipeline(model_id: str, device: str, cache_dir):
+    """
+    Carregar o pipeline txt2img do armazém local de modelos.
+
+    A colocação em memória (residência, offload, tiling, slicing) fica
+    para a PlacementPolicy, antes de cada geração.
+    """
+    import torch
+    from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion import (  # noqa: E501
+        StableDiffusionPipeline
+    )
+    from model_store import model_store, pretrained_kwargs
+
+    dtype = torch.float16 if device == "cuda" else torch.float32
+    # Carregar de disco, sem verificações no hub a cada arranque
+    model_path, use_safetensors = model_store.resolve(model_id, cache_dir)
+    return StableDiffusionPipeline.from_pretrained(
+        model_path,
+        torch_dtype=dtype,
+        safety_checker=None,
+        requires_safety_checker=False,
+        **pretrained_kwargs(use_safetensors)
+    )
+
+
+def load_init_image(data: bytes, max_size: int = 1024):
+    """Imagem enviada pelo cliente -> PIL RGB com lados múltiplos de 8"""
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    size = _fit_size(image.width, image.height, max_size)
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS)
+    return image
+
+
+def load_mask_image(data: bytes, size):
+    """Máscara (branco = área a repintar) com o tamanho da imagem"""
+    from PIL import Image
+
+    mask = Image.open(io.BytesIO(data)).convert("L")
+    if mask.size != tuple(size):
+        mask = mask.resize(size, Image.NEAREST)
+    return mask
+
+
+class SDEngine:
+    """
+    Pipelines txt2img/img2img/inpaint sobre os componentes de um só modelo.
+
+    Os pipelines derivados são criados no primeiro uso a partir dos
+    componentes do pipeline base (os mesmos objetos, sem cópia de pesos).
+    Offload, attention slicing e VAE tiling aplicados pela PlacementPolicy
+    vivem nos módulos e valem por isso para todos os pipelines, tal como
+    o backend CPU (sd_cpu_backend), cujo autocast envolve cada geração.
+    """
+
+    def __init__(self, base_pipeline, placement=None, backend=None):
+        self.base = base_pipeline
+        self.placement = placement
+        self.backend = backend
+        self._pipelines: Dict[str, Any] = {"txt2img": base_pipeline}
+        self._lock = threading.Lock()
+        # Uma geração de cada vez sobre os mesmos pesos
+        self.generation_lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self.generation_lock.locked()
+
+    def _build(self, mode: str):
+        import diffusers
+
+        cls = getattr(diffusers, _PIPELINE_CLASSES[mode])
+        accepted = inspect.signature(cls.__init__).parameters
+        components = {
+            name: component
+            for name, component in self.base.components.items()
+            if name in accepted
+        }
+        if "requires_safety_checker" in accepted:
+            components["requires_safety_checker"] = False
+
+        pipeline = cls(**components)
+
+        unet_channels = pipeline.unet.config.in_channels
+        logger.info(
+            "🧩 Pipeline %s criado sobre os componentes partilhados "
+            "(UNet com %d canais)", mode, unet_channels
+        )
+        return pipeline
+
+    def get(self, mode: str = "txt2img"):
+        """Pipeline para o modo pedido"""
+        if mode not in MODES:
+            raise ValueError(f"Modo desconhecido: {mode}")
+        pipeline = self._pipelines.get(mode)
+        if pipeline is None:
+            with self._lock:
+                pipeline = self._pipelines.get(mode)
+                if pipeline is None:
+                    pipeline = self._pipelines[mode] = self._build(mode)
+        return pipeline
+
+    def generate(
+        self,
+        request,
+        cancel_token: CancellationToken,
+        on_step: Optional[Callable] = None,
+        mode: str = "txt2img",
+        inputs: Optional[dict] = None
+    ):
+        """
+        Gerar uma imagem abortando no passo seguinte ao cancelamento.
+
+        request tem prompt, negative_prompt, width, height,
+        num_inference_steps e guidance_scale. on_step(step, latents) é
+        chamado no fim de cada passo (na thread da geração). Para
+        img2img/inpaint, inputs leva image, mask_image e strength.
+        """
+        step_started = time.perf_counter()
+
+        def on_step_end(pipeline, step, timestep, callback_kwargs):
+            nonlocal step_started
+            now = time.perf_counter()
+            metrics.SD_STEP_DURATION.observe(now - step_started)
+            step_started = now
+            cancel_token.raise_if_cancelled()
+            if on_step is not None:
+                on_step(step, callback_kwargs["latents"])
+            return callback_kwargs
+
+        import torch
+
+        autocast = (
+            self.backend.autocast() if self.backend is not None
+            else contextlib.nullcontext()
+        )
+        with self.generation_lock, autocast:
+            cancel_token.raise_if_cancelled()
+            started = time.perf_counter()
+            step_started = started
+            pipeline = self.get(mode)
+            if self.placement is not None:
+                self.placement.apply(request.width, request.height)
+
+            kwargs = dict(inputs or {})
+            if mode != "img2img":
+                kwargs.update(width=request.width, height=request.height)
+
+            def generate_latents():
+                # Gerar latentes e descodificar à parte para medir o VAE
+                return pipeline(  # type: ignore
+                    prompt=request.prompt,
+                    negative_prompt=request.negative_prompt,
+                    num_inference_steps=request.num_inference_steps,
+                    guidance_scale=request.guidance_scale,
+                    callback_on_step_end=on_step_end,
+                    output_type="latent",
+                    **kwargs
+                )
+
+            try:
+                output = generate_latents()
+            except torch.cuda.OutOfMemoryError:
+                # Descer uma camada de colocação e tentar uma vez mais
+                torch.cuda.empty_cache()
+                if self.placement is None or self.placement.demote() is None:
+                    raise
+                logger.warning(
+                    "⚠️ OOM no Stable Diffusion: a repetir com offload"
+                )
+                step_started = time.perf_counter()
+                output = generate_latents()
+            with metrics.SD_STAGE_DURATION.time("vae_decode"):
+                with torch.no_grad():
+                    latents = output.images / pipeline.vae.config.scaling_factor
+                    decoded = pipeline.vae.decode(
+                        latents, return_dict=False
+                    )[0]
+                images = pipeline.image_processor.postprocess(
+                    decoded, output_type="pil"
+                )
+            metrics.SD_STAGE_DURATION.observe(
+                time.perf_counter() - started, "total"
+            )
+        return images[0]
+
+    def shares_weights(self, mode: str) -> Optional[bool]:
+        """Confirma que um pipeline usa os mesmos módulos que o base"""
+        pipeline = self._pipelines.get(mode)
+        if pipeline is None:
+            return None
+        return all(
+            getattr(pipeline, name, None) is getattr(self.base, name, None)
+            for name in WEIGHT_COMPONENTS
+        )
+
+    def get_status(self) -> Dict[str, Any]:
+        """Pipelines criados e partilha de pesos"""
+        return {
+            "modes": list(MODES),
+            "loaded": {
+                mode: self.shares_weights(mode) for mode in self._pipelines
+            },
+            "cpu_backend": (
+                self.backend.get_status() if self.backend is not None
+                else None
+            )
+        }
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Política de colocação do pipeline Stable Diffusion em memória.
+Escolhe entre residência total, offload por modelo, offload sequencial,
+VAE tiling e attention slicing a partir da memória livre medida.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+from config import get_device_info
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+
+# Camadas por ordem de velocidade (a primeira é a mais rápida)
+TIERS = ("full", "model_offload", "sequential_offload")
+
+# Memória de ativações (GB, fp16) de uma imagem 512x512; escala com os pixels
+ACTIVATION_GB_512 = 1.2
+# Fração das ativações que resta com attention slicing
+SLICED = 0.5
+# Margem sobre a estimativa para fragmentação e picos do allocator
+HEADROOM = 1.2
+# Margem extra para voltar a uma camada mais rápida (evita oscilar)
+UPGRADE_MARGIN = 1.15
+# Reavaliar pelo menos com esta periodicidade, mesmo sem avisos
+REEVALUATE_INTERVAL = 30.0
+
+
+@dataclass(frozen=True)
+class Placement:
+    """Configuração de memória do pipeline."""
+
+    tier: str
+    vae_tiling: bool = False
+    attention_slicing: bool = False
+
+
+def _module_bytes(module) -> int:
+    if module is None:
+        return 0
+    return sum(p.numel() * p.element_size() for p in module.parameters())
+
+
+class PlacementPolicy:
+    """
+    Ajusta a colocação do pipeline antes de cada geração.
+
+    A memória é medida com get_device_info (VRAM) e o ResourceManager
+    (RAM). Reservas do Whisper e carregamentos do Ollama invalidam a
+    medição anterior através de invalidate().
+    """
+
+    def __init__(self, pipeline, device: str, resource_manager=None):
+        self.pipeline = pipeline
+        self.device = device
+        self.resource_manager = resource_manager
+        self.current: Optional[Placement] = None
+        self.last_memory: Dict[str, float] = {}
+        self.changes = 0
+        self._stale = True
+        self._evaluated_at = 0.0
+        self._evaluated_pixels = 0
+        self._lock = threading.Lock()
+
+        self.component_bytes = {
+            name: _module_bytes(getattr(pipeline, name, None))
+            for name in ("unet", "text_encoder", "vae")
+        }
+        self.weights_gb = sum(self.component_bytes.values()) / GB
+        self.largest_gb = max(self.component_bytes.values()) / GB
+
+    def invalidate(self, reason: str = ""):
+        """Outro serviço reservou ou libertou memória."""
+        self._stale = True
+        if reason:
+            logger.debug("Colocação SD invalidada: %s", reason)
+
+    def measure(self) -> Dict[str, float]:
+        """Memória livre atual (GB)"""
+        if self.resource_manager is not None:
+            free_ram = self.resource_manager.available_memory_gb()
+        else:
+            import psutil
+            free_ram = psutil.virtual_memory().available / GB
+
+        memory = {"free_ram_gb": free_ram}
+        if self.device == "cuda":
+            info = get_device_info()
+            memory["free_vram_gb"] = info.get("gpu_memory_free_gb", 0.0)
+            memory["total_vram_gb"] = info.get("gpu_memory_gb", 0)
+        return memory
+
+    def _resident_vram_gb(self) -> float:
+        """VRAM ocupada pelos pesos do próprio pipeline na camada atual"""
+        if self.current is None or self.current.tier != "full":
+            return 0.0
+        return self.weights_gb
+
+    def choose(self, width: int, height: int,
+               memory: Dict[str, float]) -> Placement:
+        """Escolher a camada mais rápida que cabe na memória disponível"""
+        scale = (width * height) / (512 * 512)
+        activations = ACTIVATION_GB_512 * scale * HEADROOM
+        large_image = scale > 1.0
+
+        if self.device != "cuda":
+            # Em CPU os pesos estão sempre residentes em RAM
+            tight = memory["free_ram_gb"] < activations * 2
+            return Placement(
+                "full",
+                vae_tiling=large_image and tight,
+                attention_slicing=tight
+            )
+
+        # Os pesos já residentes contam como disponíveis para esta decisão
+        available = memory["free_vram_gb"] + self._resident_vram_gb()
+        weights = {
+            "full": self.weights_gb,
+            "model_offload": self.largest_gb,
+        }
+
+        placement = Placement(
+            "sequential_offload", vae_tiling=True, attention_slicing=True
+        )
+        # Por ordem de velocidade: cada camada sem e com attention slicing
+        for tier in ("full", "model_offload"):
+            margin = 1.0
+            if self.current is not None and (
+                TIERS.index(tier) < TIERS.index(self.current.tier)
+            ):
+                margin = UPGRADE_MARGIN
+            if available >= (weights[tier] + activations) * margin:
+                placement = Placement(tier, vae_tiling=large_image)
+                break
+            if available >= (weights[tier] + activations * SLICED) * margin:
+                placement = Placement(
+                    tier, vae_tiling=large_image, attention_slicing=True
+                )
+                break
+
+        # Com offload os pesos vivem em RAM
+        free_ram = memory["free_ram_gb"]
+        if placement.tier != "full" and free_ram < self.weights_gb:
+            logger.warning(
+                "RAM livre (%.1f GB) abaixo dos pesos do SD (%.1f GB)",
+                free_ram, self.weights_gb
+            )
+        return placement
+
+    def _configure(self, placement: Placement):
+        pipeline = self.pipeline
+        previous = self.current
+
+        if previous is None or previous.tier != placement.tier:
+            if previous is not None and previous.tier != "full":
+                pipeline.remove_all_hooks()
+            if placement.tier == "full":
+                pipeline.to(self.device)
+            else:
+                pipeline.to("cpu")
+                if placement.tier == "model_offload":
+                    pipeline.enable_model_cpu_offload()
+                else:
+                    pipeline.enable_sequential_cpu_offload()
+                if self.device == "cuda":
+                    import torch
+                    torch.cuda.empty_cache()
+
+        if previous is None or previous.vae_tiling != placement.vae_tiling:
+            if placement.vae_tiling:
+                pipeline.enable_vae_tiling()
+            else:
+                pipeline.disable_vae_tiling()
+
+        if previous is None or (
+            previous.attention_slicing != placement.attention_slicing
+        ):
+            if placement.attention_slicing:
+                pipeline.enable_attention_slicing("auto")
+            else:
+                pipeline.disable_attention_slicing()
+
+    def apply(self, width: int = 512, height: int = 512) -> Placement:
+        """
+        Reavaliar e aplicar a colocação antes de uma geração.
+
+        Chamado com o lock do pipeline adquirido; só mede a memória quando
+        a medição foi invalidada, o tamanho da imagem mudou ou expirou.
+        """
+        with self._lock:
+            pixels = width * height
+            fresh = (
+                not self._stale
+                and pixels == self._evaluated_pixels
+                and time.monotonic() - self._evaluated_at < REEVALUATE_INTERVAL
+            )
+            if fresh and self.current is not None:
+                return self.current
+
+            self.last_memory = self.measure()
+            self._stale = False
+            self._evaluated_at = time.monotonic()
+            self._evaluated_pixels = pixels
+
+            placement = self.choose(width, height, self.last_memory)
+            if placement != self.current:
+                self._switch(placement)
+            return self.current
+
+    def demote(self) -> Optional[Placement]:
+        """Descer uma camada após falta de memória (OOM)"""
+        with self._lock:
+            current = self.current or Placement("full")
+            index = TIERS.index(current.tier)
+            if index + 1 >= len(TIERS) and current.attention_slicing:
+                return None
+            tier = TIERS[min(index + 1, len(TIERS) - 1)]
+            self._switch(Placement(tier, vae_tiling=True,
+                                   attention_slicing=True))
+            # Forçar nova medição no próximo pedido
+            self._stale = True
+            return self.current
+
+    def _switch(self, placement: Placement):
+        try:
+            self._configure(placement)
+        except Exception as e:
+            logger.warning("Falha ao aplicar colocação %s: %s", placement, e)
+            return
+        logger.info(
+            "🧩 Colocação SD: %s (tiling=%s, slicing=%s)",
+            placement.tier, placement.vae_tiling,
+            placement.attention_slicing
+        )
+        self.current = placement
+        self.changes += 1
+
+    def get_status(self) -> Dict[str, Any]:
+        """Estado da política para /api/status"""
+        return {
+            "placement": asdict(self.current) if self.current else None,
+            "weights_gb": round(self.weights_gb, 2),
+            "memory": {k: round(v, 2) for k, v in self.last_memory.items()},
+            "changes": self.changes,
+        }
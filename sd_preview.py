@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Pré-visualizações baratas dos latentes do Stable Diffusion.
+Aproximação linear latente→RGB (sem rede) ou um autoencoder pequeno
+(TAESD), em vez do VAE completo a cada pré-visualização.
+"""
+
+import base64
+import io
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Projeção linear dos 4 canais latentes do SD 1.x/2.x para RGB
+LATENT_RGB_FACTORS = (
+    (0.298, 0.207, 0.208),
+    (0.187, 0.286, 0.173),
+    (-0.158, 0.189, 0.264),
+    (-0.184, -0.271, -0.473),
+)
+
+# Lado máximo das pré-visualizações enviadas ao cliente
+PREVIEW_SIZE = 256
+
+
+class PreviewDecoder:
+    """
+    Converte latentes intermédios em imagens pequenas.
+
+    Com method="taesd" usa o AutoencoderTiny indicado (carregado do
+    armazém local de modelos no primeiro uso); se falhar, volta à
+    aproximação linear.
+    """
+
+    def __init__(
+        self,
+        method: str = "linear",
+        taesd_model: str = "madebyollin/taesd",
+        cache_dir=None
+    ):
+        self.method = method
+        self.taesd_model = taesd_model
+        self.cache_dir = cache_dir
+        self._taesd = None
+
+    def _load_taesd(self, device, dtype):
+        if self._taesd is None:
+            from diffusers import AutoencoderTiny
+            from model_store import model_store, pretrained_kwargs
+
+            path, use_safetensors = model_store.resolve(
+                self.taesd_model, self.cache_dir
+            )
+            self._taesd = AutoencoderTiny.from_pretrained(
+                path, torch_dtype=dtype, **pretrained_kwargs(use_safetensors)
+            )
+            self._taesd.to(device)
+            logger.info("🖼️ TAESD carregado para pré-visualizações")
+        return self._taesd
+
+    def _decode_linear(self, latents):
+        import torch
+
+        factors = torch.tensor(
+            LATENT_RGB_FACTORS, dtype=torch.float32, device=latents.device
+        )
+        # (4, h, w) x (4, 3) -> (h, w, 3), valores aproximadamente em [-1, 1]
+        rgb = torch.einsum("chw,cr->hwr", latents[0].float(), factors)
+        return ((rgb + 1.0) * 127.5).clamp(0, 255).to(torch.uint8)
+
+    def _decode_taesd(self, latents):
+        import torch
+
+        taesd = self._load_taesd(latents.device, latents.dtype)
+        with torch.no_grad():
+            decoded = taesd.decode(latents[:1]).sample[0]
+        rgb = decoded.permute(1, 2, 0).float()
+        return ((rgb + 1.0) * 127.5).clamp(0, 255).to(torch.uint8)
+
+    def decode(self, latents):
+        """Latentes (1, 4, h, w) -> imagem PIL reduzida"""
+        from PIL import Image
+
+        pixels = None
+        if self.method == "taesd":
+            try:
+                pixels = self._decode_taesd(latents)
+            except Exception as e:
+                logger.warning("TAESD indisponível, a usar aproximação "
+                               "linear: %s", e)
+                self.method = "linear"
+        if pixels is None:
+            pixels = self._decode_linear(latents)
+
+        image = Image.fromarray(pixels.cpu().numpy())
+        if max(image.size) < PREVIEW_SIZE:
+            # A aproximação linear tem 1/8 da resolução final
+            scale = PREVIEW_SIZE / max(image.size)
+            image = image.resize(
+                (int(image.width * scale), int(image.height * scale)),
+                Image.BILINEAR
+            )
+        else:
+            image.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE))
+        return image
+
+
+def encode_preview(image, quality: int = 70) -> str:
+    """Imagem PIL -> data URL JPEG para enviar por SSE"""
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+    data = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return f"data:image/jpeg;base64,{data}"
+
+
+def preview_data_url(decoder: PreviewDecoder, latents) -> Optional[str]:
+    """Pré-visualização pronta a enviar, ou None se falhar"""
+    try:
+        return encode_preview(decoder.decode(latents))
+    except Exception as e:
+        logger.debug("Falha na pré-visualização: %s", e)
+        return None
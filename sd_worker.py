@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Worker remoto de Stable Diffusion.
+Carrega só o pipeline de imagem e pede trabalho ao nó principal por
+long-polling; cada job vem com um lease renovado por heartbeat e a
+imagem gerada é enviada de volta em PNG.
+
+    python sd_worker.py --server http://app:8001 --token SEGREDO
+
+O nó principal tem de correr com WORKERS=1: a fila de jobs vive na
+memória desse processo.
+"""
+
+import argparse
+import io
+import logging
+import os
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import requests
+
+import logging_setup
+from cancellation import CancellationToken, GenerationCancelled
+from model_store import HF_CACHE_DIR
+from sd_cpu_backend import BACKENDS, CPUBackend
+from sd_engine import SDEngine, load_pipeline
+from sd_placement import PlacementPolicy
+
+logger = logging.getLogger("sd_worker")
+
+# Espera máxima entre tentativas quando o nó principal não responde
+MAX_BACKOFF = 30.0
+
+
+class Heartbeat(threading.Thread):
+    """Renova o lease e cancela a geração se o nó o der como perdido."""
+
+    def __init__(self, worker: "Worker", job: dict, token: CancellationToken):
+        super().__init__(daemon=True, name=f"heartbeat-{job['job_id']}")
+        self.worker = worker
+        self.job = job
+        self.token = token
+        self.interval = max(1.0, job["lease_seconds"] / 3)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                response = self.worker.post(
+                    f"/api/workers/jobs/{self.job['job_id']}/heartbeat",
+                    params={"lease_id": self.job["lease_id"]}
+                )
+            except requests.RequestException as e:
+                logger.warning("Heartbeat falhou: %s", e)
+                continue
+            if response.status_code in (404, 409):
+                logger.info(
+                    "🛑 Lease perdido: a abortar %s", self.job["job_id"]
+                )
+                self.token.cancel("lease perdido")
+                return
+
+
+class Worker:
+    """Ciclo lease → gerar → enviar resultado."""
+
+    def __init__(self, server: str, token: str, worker_id: str,
+                 engine: SDEngine, wait: float = 25.0):
+        self.server = server.rstrip("/")
+        self.worker_id = worker_id
+        self.engine = engine
+        self.wait = wait
+        self.session = requests.Session()
+        self.session.headers["X-Worker-Token"] = token
+
+    def post(self, path: str, timeout: float = 30.0, **kwargs):
+        return self.session.post(self.server + path, timeout=timeout, **kwargs)
+
+    def lease(self):
+        response = self.post(
+            "/api/workers/lease",
+            params={"worker_id": self.worker_id, "wait": self.wait},
+            timeout=self.wait + 10
+        )
+        if response.status_code == 204:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def process(self, job: dict):
+        job_id, lease_id = job["job_id"], job["lease_id"]
+        request = SimpleNamespace(**job["request"])
+        logger.info("🎨 Job %s: %s...", job_id, request.prompt[:50])
+
+        token = CancellationToken()
+        heartbeat = Heartbeat(self, job, token)
+        heartbeat.start()
+        try:
+            image = self.engine.generate(request, token)
+        except GenerationCancelled:
+            return
+        except Exception as e:
+            logger.error("Erro no job %s: %s", job_id, e)
+            self.post(
+                f"/api/workers/jobs/{job_id}/fail",
+                params={"lease_id": lease_id, "error": str(e)}
+            )
+            return
+        finally:
+            heartbeat.stopped.set()
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        response = self.post(
+            f"/api/workers/jobs/{job_id}/result",
+            data={"lease_id": lease_id},
+            files={"image": ("image.png", buffer.getvalue(), "image/png")},
+            timeout=120
+        )
+        if response.status_code == 409:
+            logger.warning("Resultado de %s recusado: lease perdido", job_id)
+        else:
+            response.raise_for_status()
+            logger.info("✅ Job %s concluído", job_id)
+
+    def run_forever(self):
+        logger.info("🛰️ Worker %s ligado a %s", self.worker_id, self.server)
+        backoff = 1.0
+        while True:
+            try:
+                job = self.lease()
+                backoff = 1.0
+                if job is not None:
+                    self.process(job)
+            except requests.RequestException as e:
+                logger.warning(
+                    "Nó principal indisponível (%s): nova tentativa em %.0fs",
+                    e, backoff
+                )
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+
+def resolve_device(device: str) -> str:
+    if device == "auto":
+        import torch
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Worker remoto de Stable Diffusion"
+    )
+    parser.add_argument(
+        "--server",
+        default=os.getenv(
+            "SD_WORKER_SERVER",
+            f"http://localhost:{os.getenv('PORT', '8001')}"
+        )
+    )
+    parser.add_argument("--token", default=os.getenv("SD_WORKER_TOKEN", ""))
+    parser.add_argument(
+        "--worker-id", default=os.getenv("SD_WORKER_ID", socket.gethostname())
+    )
+    parser.add_argument(
+        "--device", default=os.getenv("DEVICE", "auto"),
+        choices=["auto", "cuda", "cpu"]
+    )
+    parser.add_argument(
+        "--model", default=os.getenv(
+            "STABLE_DIFFUSION_MODEL", "runwayml/stable-diffusion-v1-5"
+        )
+    )
+    parser.add_argument(
+        "--cpu-backend", default=os.getenv("SD_CPU_BACKEND", "eager"),
+        choices=BACKENDS
+    )
+    parser.add_argument(
+        "--wait", type=float, default=25.0,
+        help="Segundos de long-poll por pedido de trabalho"
+    )
+    args = parser.parse_args()
+
+    logging_setup.setup_logging()
+    if not args.token:
+        parser.error("--token (ou SD_WORKER_TOKEN) é obrigatório")
+
+    device = resolve_device(args.device)
+    logger.info("🎨 Carregando %s em %s...", args.model, device)
+    pipeline = load_pipeline(args.model, device, HF_CACHE_DIR)
+    backend = None
+    if device == "cpu":
+        backend = CPUBackend(args.cpu_backend, HF_CACHE_DIR).apply(pipeline)
+    engine = SDEngine(pipeline, PlacementPolicy(pipeline, device), backend)
+
+    worker = Worker(args.server, args.token, args.worker_id, engine, args.wait)
+    try:
+        worker.run_forever()
+    except KeyboardInterrupt:
+        logger.info("👋 Worker terminado")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+Histórico de chat persistente.
+SQLite em modo WAL com escrita diferida: os pedidos só põem as mensagens
+numa fila e uma tarefa em background grava-as em lotes, numa transação
+por lote. As sessões ativas ficam numa cache em memória.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION = "default"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session
+    ON messages (session_id, id);
+"""
+
+
+class _CachedSession:
+    """Cauda das mensagens de uma sessão em memória."""
+
+    __slots__ = ("messages", "total")
+
+    def __init__(self, max_messages: int, total: Optional[int] = None):
+        self.messages: Deque[Dict[str, Any]] = deque(maxlen=max_messages)
+        # None: sessão ainda não lida da base de dados (total desconhecido)
+        self.total = total
+
+
+class SessionStore:
+    """
+    Sessões de chat em SQLite com escrita em background.
+
+    append() nunca toca no disco: atualiza a cache e põe a operação na
+    fila. history() serve a página da cache quando a tem completa; senão
+    espera pela fila e lê da base de dados.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        cache_size: int = 128,
+        cache_messages: int = 100,
+        batch_size: int = 200,
+        flush_interval: float = 0.5
+    ):
+        """
+        Args:
+            db_path: Ficheiro SQLite
+            cache_size: Sessões mantidas em memória
+            cache_messages: Mensagens mais recentes guardadas por sessão
+            batch_size: Operações máximas por transação
+            flush_interval: Espera máxima (s) para juntar um lote
+        """
+        self.db_path = Path(db_path)
+        self.cache_size = cache_size
+        self.cache_messages = cache_messages
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._cache: "OrderedDict[str, _CachedSession]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._read_conn: Optional[sqlite3.Connection] = None
+        self._read_lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            str(self.db_path), check_same_thread=False, timeout=30
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Em WAL, NORMAL só perde as últimas transações num corte de energia
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _open(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._write_conn = self._connect()
+        self._write_conn.executescript(SCHEMA)
+        self._read_conn = self._connect()
+
+    async def start(self):
+        """Abrir a base de dados e arrancar a tarefa de escrita"""
+        if self._writer is not None:
+            return
+        await asyncio.to_thread(self._open)
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+        logger.info("💾 Sessões em %s (WAL)", self.db_path)
+
+    async def stop(self):
+        """Gravar o que falta e fechar"""
+        if self._writer is None:
+            return
+        await self.flush()
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._writer = None
+        await asyncio.to_thread(self._close)
+
+    def _close(self):
+        for conn in (self._write_conn, self._read_conn):
+            if conn is not None:
+                conn.close()
+        self._write_conn = self._read_conn = None
+
+    # ------------------------------------------------------------------
+    # Escrita diferida
+    # ------------------------------------------------------------------
+
+    def _enqueue(self, operation: Tuple):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._queue.put_nowait(operation)
+
+    def _cached(self, session_id: str) -> Optional[_CachedSession]:
+        session = self._cache.get(session_id)
+        if session is not None:
+            self._cache.move_to_end(session_id)
+        return session
+
+    def _remember(self, session_id: str, session: _CachedSession):
+        self._cache[session_id] = session
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def append(self, session_id: str, role: str, content: str):
+        """Acrescentar uma mensagem (chamar no event loop; não bloqueia)"""
+        message = {
+            "role": role, "content": content, "created_at": time.time()
+        }
+        session = self._cached(session_id)
+        if session is None:
+            session = _CachedSession(self.cache_messages)
+            self._remember(session_id, session)
+        session.messages.append(message)
+        if session.total is not None:
+            session.total += 1
+        self._enqueue(("append", session_id, message))
+
+    def clear(self, session_id: str):
+        """Apagar o histórico de uma sessão (também por escrita diferida)"""
+        self._remember(session_id, _CachedSession(self.cache_messages, 0))
+        self._enqueue(("clear", session_id, None))
+
+    async def flush(self):
+        """Esperar que todas as operações em fila estejam gravadas"""
+        if self._queue is not None and self._writer is not None:
+            await self._queue.join()
+
+    async def _write_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(
+                        self._queue.get(), timeout
+                    ))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+                self.written += len(batch)
+                self.batches += 1
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(
+                    "Falha ao gravar %d operações de sessão: %s",
+                    len(batch), e
+                )
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: List[Tuple]):
+        conn = self._write_conn
+        with conn:
+            for kind, session_id, message in batch:
+                if kind == "append":
+                    conn.execute(
+                        "INSERT INTO messages "
+                        "(session_id, role, content, created_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (session_id, message["role"], message["content"],
+                         message["created_at"])
+                    )
+                    conn.execute(
+                        "INSERT INTO sessions "
+                        "(id, created_at, updated_at, message_count) "
+                        "VALUES (?, ?, ?, 1) "
+                        "ON CONFLICT(id) DO UPDATE SET "
+                        "updated_at = excluded.updated_at, "
+                        "message_count = message_count + 1",
+                        (session_id, message["created_at"],
+                         message["created_at"])
+                    )
+                elif kind == "clear":
+                    conn.execute(
+                        "DELETE FROM messages WHERE session_id = ?",
+                        (session_id,)
+                    )
+                    conn.execute(
+                        "DELETE FROM sessions WHERE id = ?", (session_id,)
+                    )
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    def _read_page(
+        self, session_id: str, limit: int, offset: int
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        with self._read_lock:
+            total = self._read_conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()[0]
+            rows = self._read_conn.execute(
+                "SELECT role, content, created_at FROM messages "
+                "WHERE session_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                (session_id, limit, offset)
+            ).fetchall()
+        messages = [
+            {"role": role, "content": content, "created_at": created_at}
+            for role, content, created_at in reversed(rows)
+        ]
+        return messages, total
+
+    async def history(
+        self, session_id: str, limit: int = 50, offset: int = 0
+    ) -> Dict[str, Any]:
+        """
+        Página do histórico, da mais recente para trás.
+
+        offset conta mensagens a partir da mais recente; as mensagens de
+        cada página vêm por ordem cronológica.
+        """
+        limit = max(1, limit)
+        offset = max(0, offset)
+        session = self._cached(session_id)
+        if (session is not None and session.total is not None
+                and offset + limit <= len(session.messages)):
+            cached = list(session.messages)
+            end = len(cached) - offset
+            messages = cached[max(0, end - limit):end]
+            total = session.total
+            source = "cache"
+        else:
+            await self.flush()
+            # A primeira página traz também a cauda que fica em cache
+            read_limit = (
+                max(limit, self.cache_messages) if offset == 0 else limit
+            )
+            messages, total = await asyncio.to_thread(
+                self._read_page, session_id, read_limit, offset
+            )
+            source = "disk"
+            if offset == 0:
+                fresh = _CachedSession(self.cache_messages, total)
+                fresh.messages.extend(messages)
+                self._remember(session_id, fresh)
+                messages = messages[-limit:]
+
+        return {
+            "session_id": session_id,
+            "messages": messages,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "has_more": offset + len(messages) < total,
+            "source": source
+        }
+
+    def _read_sessions(self, limit: int, offset: int) -> List[Dict[str, Any]]:
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                "SELECT id, created_at, updated_at, message_count "
+                "FROM sessions ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+        return [
+            {"session_id": row[0], "created_at": row[1],
+             "updated_at": row[2], "message_count": row[3]}
+            for row in rows
+        ]
+
+    async def list_sessions(
+        self, limit: int = 50, offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        """Sessões por ordem da última atividade"""
+        await self.flush()
+        return await asyncio.to_thread(
+            self._read_sessions, max(1, limit), max(0, offset)
+        )
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "db_path": str(self.db_path),
+            "running": self._writer is not None,
+            "cached_sessions": len(self._cache),
+            "pending_writes": self._queue.qsize() if self._queue else 0,
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed
+        }
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Camada de streaming SSE para respostas do Ollama.
+Agrega tokens em frames por orçamento de tempo/tamanho e envia heartbeats.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import (
+    Any, AsyncGenerator, Dict, Iterator, List, Optional, Sequence, Tuple
+)
+
+from cancellation import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+# Encoder JSON rápido quando disponível
+try:
+    import orjson
+
+    def dumps(obj: Any) -> str:
+        """Serializa para JSON usando orjson."""
+        return orjson.dumps(obj).decode("utf-8")
+
+    fast_json_available = True
+except ImportError:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    dumps = _encoder.encode
+    fast_json_available = False
+
+# Comentário SSE usado como heartbeat (ignorado pelo EventSource)
+HEARTBEAT_FRAME = ": ping\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+_SENTINEL = object()
+
+
+def sse_event(payload: Dict[str, Any]) -> str:
+    """Formata um payload como frame SSE."""
+    return f"data: {dumps(payload)}\n\n"
+
+
+class StopSequences:
+    """
+    Deteção de stop sequences sobre texto que chega aos bocados.
+
+    Uma sequência pode estar repartida por vários chunks: o fim do texto
+    que ainda pode ser o início de uma sequência fica retido até se saber
+    se é ou não, para nunca chegar ao cliente texto depois da paragem.
+    """
+
+    def __init__(self, stops: Sequence[str]):
+        self.stops = [stop for stop in stops if stop]
+        self.matched: Optional[str] = None
+        self._held = ""
+
+    def feed(self, text: str) -> Tuple[str, bool]:
+        """Devolve (texto a emitir, parou?)"""
+        buffer = self._held + text
+        found = None
+        for stop in self.stops:
+            index = buffer.find(stop)
+            if index != -1 and (found is None or index < found[0]):
+                found = (index, stop)
+        if found is not None:
+            self._held = ""
+            self.matched = found[1]
+            return buffer[:found[0]], True
+
+        keep = 0
+        for stop in self.stops:
+            for size in range(min(len(stop) - 1, len(buffer)), keep, -1):
+                if buffer.endswith(stop[:size]):
+                    keep = size
+                    break
+        self._held = buffer[len(buffer) - keep:] if keep else ""
+        return buffer[:len(buffer) - keep], False
+
+    def flush(self) -> str:
+        """Texto retido (no fim do stream já não pode ser uma paragem)"""
+        held, self._held = self._held, ""
+        return held
+
+
+class TokenStreamer:
+    """
+    Ponte entre o gerador síncrono do Ollama e um stream SSE agregado.
+
+    O gerador é consumido numa thread dedicada para não bloquear o event
+    loop. Os tokens são acumulados numa lista e emitidos num único frame
+    quando o intervalo ou o tamanho máximo do frame é atingido.
+    """
+
+    def __init__(
+        self,
+        source: Iterator[Dict[str, Any]],
+        flush_interval: float = 0.05,
+        flush_bytes: int = 512,
+        heartbeat_interval: float = 15.0,
+        cancel_token: Optional[CancellationToken] = None,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """
+        Args:
+            source: Gerador de chunks do Ollama (generate_stream)
+            flush_interval: Tempo máximo (s) que um token fica no buffer
+            flush_bytes: Tamanho (caracteres) que força o envio do frame
+            heartbeat_interval: Intervalo (s) sem dados até enviar heartbeat
+            cancel_token: Token que interrompe a leitura quando cancelado
+            stop: Stop sequences; a primeira encontrada fecha o stream do
+                Ollama e termina a resposta antes dela
+        """
+        self.source = source
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.heartbeat_interval = heartbeat_interval
+        self.error: Optional[str] = None
+        self.done = False
+        # Marcas temporais para métricas (time.perf_counter)
+        self.created_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.final_chunk: Optional[Dict[str, Any]] = None
+        self.stop = StopSequences(stop) if stop else None
+        self._parts: List[str] = []
+        self._stop = cancel_token or CancellationToken()
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def text(self) -> str:
+        """Texto completo recebido até ao momento."""
+        return "".join(self._parts)
+
+    @property
+    def done_reason(self) -> Optional[str]:
+        """stop, length, ... do Ollama ou stop_sequence quando parado aqui"""
+        if self.stop is not None and self.stop.matched is not None:
+            return "stop_sequence"
+        if self.final_chunk:
+            return self.final_chunk.get("done_reason")
+        return None
+
+    @property
+    def cancelled(self) -> bool:
+        """Indica se o stream foi interrompido antes de terminar."""
+        return self._stop.cancelled and not self.done
+
+    def close(self):
+        """Pede à thread de leitura para fechar o stream do Ollama."""
+        self._stop.cancel("stream fechado")
+
+    def _put(self, item: Any):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+
+    def _pump(self):
+        """Consome o gerador síncrono e envia os chunks para a fila."""
+        self.started_at = time.perf_counter()
+        try:
+            for chunk in self.source:
+                if self._stop.cancelled:
+                    break
+                if self.first_token_at is None and chunk.get("response"):
+                    self.first_token_at = time.perf_counter()
+                if self.stop is not None:
+                    chunk = self._check_stop(chunk)
+                self._put(chunk)
+                if chunk.get("done", False):
+                    self.final_chunk = chunk
+                    break
+                if "error" in chunk:
+                    break
+        except Exception as e:
+            self._put({"error": str(e)})
+        finally:
+            close = getattr(self.source, "close", None)
+            if close:
+                close()
+            self.finished_at = time.perf_counter()
+            self._put(_SENTINEL)
+
+    def _check_stop(self, chunk: Dict[str, Any]) -> Dict[str, Any]:
+        text, stopped = self.stop.feed(chunk.get("response", ""))
+        if stopped:
+            # Sair do ciclo fecha o stream e o Ollama deixa de gerar
+            logger.debug("✋ Stop sequence %r atingida", self.stop.matched)
+            return {"response": text, "done": True,
+                    "done_reason": "stop_sequence"}
+        if chunk.get("done", False) or "error" in chunk:
+            text += self.stop.flush()
+        if text == chunk.get("response", ""):
+            return chunk
+        return dict(chunk, response=text)
+
+    def _start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        threading.Thread(
+            target=self._pump, name="ollama-stream", daemon=True
+        ).start()
+
+    async def chunks(self) -> AsyncGenerator[Optional[Dict[str, Any]], None]:
+        """
+        Itera os chunks do Ollama no event loop.
+
+        Emite None quando não chega nada durante heartbeat_interval.
+        """
+        self._start()
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(
+                        self._queue.get(), self.heartbeat_interval
+                    )
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if item is _SENTINEL:
+                    return
+                yield item
+        finally:
+            self.close()
+
+    async def collect(self) -> str:
+        """Consome o stream inteiro e devolve o texto completo."""
+        async for chunk in self.chunks():
+            if chunk is None:
+                continue
+            if "error" in chunk:
+                self.error = chunk["error"]
+                break
+            if "response" in chunk:
+                self._parts.append(chunk["response"])
+            if chunk.get("done", False):
+                self.done = True
+                break
+        return self.text
+
+    async def events(self) -> AsyncGenerator[str, None]:
+        """Gera frames SSE agregados, heartbeats e o frame final."""
+        self._start()
+        pending: List[str] = []
+        pending_size = 0
+        deadline = None
+        last_frame = time.monotonic()
+
+        try:
+            while True:
+                now = time.monotonic()
+                if deadline is not None:
+                    timeout = max(deadline - now, 0.0)
+                else:
+                    timeout = max(
+                        last_frame + self.heartbeat_interval - now, 0.0
+                    )
+
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    item = None
+
+                if item is None:
+                    if pending:
+                        yield sse_event({"content": "".join(pending)})
+                        pending.clear()
+                        pending_size = 0
+                        deadline = None
+                    else:
+                        yield HEARTBEAT_FRAME
+                    last_frame = time.monotonic()
+                    continue
+
+                if item is _SENTINEL:
+                    break
+
+                if "error" in item:
+                    self.error = item["error"]
+                    break
+
+                content = item.get("response")
+                if content:
+                    self._parts.append(content)
+                    pending.append(content)
+                    pending_size += len(content)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+
+                if item.get("done", False):
+                    self.done = True
+                    break
+
+                if pending_size >= self.flush_bytes:
+                    yield sse_event({"content": "".join(pending)})
+                    pending.clear()
+                    pending_size = 0
+                    deadline = None
+                    last_frame = time.monotonic()
+
+            if pending:
+                yield sse_event({"content": "".join(pending)})
+
+            if self.error is not None:
+                yield sse_event({"error": self.error})
+            else:
+                final = {"done": True}
+                if self.done_reason:
+                    final["done_reason"] = self.done_reason
+                yield sse_event(final)
+        finally:
+            self.close()
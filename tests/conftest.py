@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""Configuração comum dos testes: módulos do projeto importáveis."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Testes do processamento em lote (JSONL e checkpoints)."""
+
+import asyncio
+import json
+
+from batch_runner import BatchRunner, parse_jsonl
+
+
+class FakeClient:
+    """OllamaClient mínimo: responde com o prompt em maiúsculas."""
+
+    def __init__(self, fail=()):
+        self.prompts = []
+        self.fail = set(fail)
+
+    def generate(self, model, prompt, keep_alive=None):
+        self.prompts.append(prompt)
+        if prompt in self.fail:
+            return {"error": "falhou"}
+        return {"response": prompt.upper(), "eval_count": len(prompt)}
+
+
+def run_batch(runner, lines):
+    async def consume():
+        return [result async for result in runner.run(parse_jsonl(lines))]
+    return sorted(asyncio.run(consume()), key=lambda r: r["index"])
+
+
+def make_runner(client, checkpoint=None, model="llama3.2:latest"):
+    return BatchRunner(
+        client, model, build_prompt=lambda message: message,
+        concurrency=2, checkpoint_path=checkpoint
+    )
+
+
+def test_parse_jsonl():
+    items = parse_jsonl([
+        '{"message": "olá", "id": "a"}',
+        "",
+        '{"prompt": "adeus", "model": "phi3:mini"}',
+        "[1, 2]",
+        '{"id": "sem mensagem"}',
+        "{inválido",
+    ])
+    assert items[0] == {
+        "index": 0, "id": "a", "message": "olá", "model": None
+    }
+    assert items[1] == {
+        "index": 1, "id": None, "message": "adeus", "model": "phi3:mini"
+    }
+    # Linhas vazias não contam para o índice
+    assert [item["index"] for item in items] == [0, 1, 2, 3, 4]
+    assert all("error" in item for item in items[2:])
+
+
+def test_results_keep_original_index():
+    client = FakeClient()
+    results = run_batch(
+        make_runner(client), ['{"message": "a"}', '{"message": "b"}']
+    )
+    assert [r["response"] for r in results] == ["A", "B"]
+    assert [r["model"] for r in results] == ["llama3.2:latest"] * 2
+
+
+def test_invalid_lines_are_reported_not_sent():
+    client = FakeClient()
+    results = run_batch(make_runner(client), ['{"message": "a"}', "[]"])
+    assert "error" in results[1]
+    assert client.prompts == ["a"]
+
+
+def test_checkpoint_resume_skips_completed(tmp_path):
+    checkpoint = tmp_path / "lote.jsonl"
+    lines = ['{"message": "a"}', '{"message": "b"}']
+    run_batch(make_runner(FakeClient(fail={"b"}), checkpoint), lines)
+
+    client = FakeClient()
+    results = run_batch(make_runner(client, checkpoint), lines)
+    # Só o item falhado é repetido
+    assert client.prompts == ["b"]
+    assert results[0]["resumed"] is True
+    assert results[1]["response"] == "B"
+    assert "resumed" not in results[1]
+
+
+def test_checkpoint_from_different_input_is_ignored(tmp_path):
+    checkpoint = tmp_path / "lote.jsonl"
+    run_batch(
+        make_runner(FakeClient(), checkpoint),
+        ['{"message": "a"}', '{"message": "b"}']
+    )
+
+    client = FakeClient()
+    results = run_batch(
+        make_runner(client, checkpoint),
+        ['{"message": "a"}', '{"message": "c"}']
+    )
+    assert client.prompts == ["c"]
+    assert results[0]["resumed"] is True
+    assert results[1]["response"] == "C"
+
+
+def test_checkpoint_depends_on_effective_model(tmp_path):
+    checkpoint = tmp_path / "lote.jsonl"
+    lines = ['{"message": "a"}']
+    run_batch(make_runner(FakeClient(), checkpoint), lines)
+
+    client = FakeClient()
+    run_batch(make_runner(client, checkpoint, model="phi3:mini"), lines)
+    assert client.prompts == ["a"]
+
+
+def test_partial_checkpoint_line_is_ignored(tmp_path):
+    checkpoint = tmp_path / "lote.jsonl"
+    lines = ['{"message": "a"}', '{"message": "b"}']
+    run_batch(make_runner(FakeClient(), checkpoint), lines)
+    with open(checkpoint, "a", encoding="utf-8") as f:
+        f.write('{"index": 1, "respo')
+
+    client = FakeClient()
+    results = run_batch(make_runner(client, checkpoint), lines)
+    assert client.prompts == []
+    assert all(r["resumed"] for r in results)
+    records = [
+        json.loads(line) for line in checkpoint.read_text().splitlines()[:2]
+    ]
+    assert all("input_hash" in record for record in records)
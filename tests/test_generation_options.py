@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Testes dos tetos das opções de geração por pedido."""
+
+import pytest
+
+from generation_options import (
+    DEFAULT_SAMPLING, GenerationCaps, ModelCaps, parse_duration
+)
+
+DEFAULTS = ModelCaps(max_tokens=1024, num_ctx=8192, keep_alive_seconds=3600)
+
+
+@pytest.mark.parametrize("value, seconds", [
+    (90, 90.0),
+    ("90", 90.0),
+    ("30s", 30.0),
+    ("5m", 300.0),
+    ("2h", 7200.0),
+    ("250ms", 0.25),
+    (" 1.5 m ", 90.0),
+])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == pytest.approx(seconds)
+
+
+@pytest.mark.parametrize("value", ["forever", "5d", "", "-1", True])
+def test_parse_duration_invalid(value):
+    assert parse_duration(value) is None
+
+
+def test_resolve_defaults():
+    options, keep_alive = GenerationCaps(DEFAULTS).resolve("llama3.2")
+    assert options == dict(DEFAULT_SAMPLING, num_predict=1024)
+    assert keep_alive is None
+
+
+def test_resolve_clamps_to_caps():
+    options, keep_alive = GenerationCaps(DEFAULTS).resolve(
+        "llama3.2", max_tokens=5000, num_ctx=100000, keep_alive="2h"
+    )
+    assert options["num_predict"] == 1024
+    assert options["num_ctx"] == 8192
+    assert keep_alive == 3600
+
+
+def test_resolve_keeps_values_below_caps():
+    options, keep_alive = GenerationCaps(DEFAULTS).resolve(
+        "llama3.2", max_tokens=64, num_ctx=2048, stop=["\n\n"],
+        keep_alive="30s", sampling={"temperature": 0.1, "top_k": None}
+    )
+    assert options["num_predict"] == 64
+    assert options["num_ctx"] == 2048
+    assert options["stop"] == ["\n\n"]
+    assert options["temperature"] == 0.1
+    assert options["top_k"] == DEFAULT_SAMPLING["top_k"]
+    assert keep_alive == 30
+
+
+def test_per_model_overrides():
+    caps = GenerationCaps(DEFAULTS, '{"phi3:mini": {"max_tokens": 128}}')
+    assert caps.resolve("phi3:mini", max_tokens=500)[0]["num_predict"] == 128
+    assert caps.for_model("phi3:mini").num_ctx == 8192
+    assert caps.for_model("llama3.2") is DEFAULTS
+
+
+def test_override_without_tag_matches_latest():
+    caps = GenerationCaps(DEFAULTS, '{"mistral:latest": {"num_ctx": 4096}}')
+    assert caps.for_model("mistral").num_ctx == 4096
+
+
+def test_invalid_overrides_are_ignored():
+    caps = GenerationCaps(DEFAULTS, "{not json")
+    assert caps.for_model("phi3:mini") is DEFAULTS
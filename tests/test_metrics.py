@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Testes dos histogramas e contadores Prometheus."""
+
+import contextvars
+
+import pytest
+
+import metrics
+import profiling
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Registo isolado, para não misturar com as métricas da aplicação"""
+    fresh = metrics.Registry()
+    monkeypatch.setattr(metrics, "registry", fresh)
+    return fresh
+
+
+def samples(registry):
+    """Linhas de amostras do /metrics como {nome{labels}: valor}"""
+    result = {}
+    for line in registry.render().splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            result[name] = float(value)
+    return result
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = metrics.Histogram(
+        "latency_seconds", "Latência", buckets=(0.1, 1.0, 0.5)
+    )
+    for value in (0.05, 0.1, 0.3, 0.7, 5.0):
+        histogram.observe(value)
+
+    values = samples(registry)
+    name = "llm_pessoal_latency_seconds"
+    # O limite superior de cada bucket é inclusivo (le)
+    assert values[f'{name}_bucket{{le="0.1"}}'] == 2
+    assert values[f'{name}_bucket{{le="0.5"}}'] == 3
+    assert values[f'{name}_bucket{{le="1.0"}}'] == 4
+    assert values[f'{name}_bucket{{le="+Inf"}}'] == 5
+    assert values[f"{name}_count"] == 5
+    assert values[f"{name}_sum"] == pytest.approx(6.15)
+
+
+def test_histogram_series_per_label(registry):
+    histogram = metrics.Histogram(
+        "stage_seconds", "Etapas", ("stage",), buckets=(1.0,)
+    )
+    histogram.observe(0.5, "decode")
+    histogram.observe(2.0, "generate")
+    histogram.observe(0.2, "decode")
+
+    values = samples(registry)
+    name = "llm_pessoal_stage_seconds"
+    assert values[f'{name}_count{{stage="decode"}}'] == 2
+    assert values[f'{name}_count{{stage="generate"}}'] == 1
+    assert values[f'{name}_bucket{{stage="generate",le="1.0"}}'] == 0
+
+
+def test_histogram_time_records_on_exception(registry):
+    histogram = metrics.Histogram("block_seconds", "Bloco")
+    with pytest.raises(RuntimeError):
+        with histogram.time():
+            raise RuntimeError("falhou")
+    assert samples(registry)["llm_pessoal_block_seconds_count"] == 1
+
+
+def test_series_limit_overflows_to_other(registry, monkeypatch):
+    monkeypatch.setattr(metrics, "MAX_SERIES", 2)
+    counter = metrics.Counter("requests", "Pedidos", ("route",))
+    for route in ("/a", "/b", "/c", "/d"):
+        counter.inc(route)
+
+    values = samples(registry)
+    assert values['llm_pessoal_requests_total{route="/a"}'] == 1
+    assert values['llm_pessoal_requests_total{route="other"}'] == 2
+    assert 'llm_pessoal_requests_total{route="/c"}' not in values
+
+
+def test_label_values_are_escaped(registry):
+    counter = metrics.Counter("errors", "Erros", ("stage",))
+    counter.inc('a"b\\c\nd')
+    assert 'stage="a\\"b\\\\c\\nd"' in registry.render()
+
+
+def test_server_timing_reports_to_current_request(registry):
+    histogram = metrics.Histogram(
+        "whisper_seconds", "Whisper", ("stage",), server_timing="whisper_{0}"
+    )
+
+
+    def request():
+        timing = profiling.start_request()
+        histogram.observe(0.25, "decode")
+        return timing
+
+    # Contexto próprio, como cada pedido no middleware
+    timing = contextvars.copy_context().run(request)
+    assert timing.header(1.0).startswith("whisper_decode;dur=250.0")
+
+
+def test_chat_queue_wait_counts_from_request_arrival(monkeypatch):
+    waits = []
+    monkeypatch.setattr(
+        metrics.CHAT_QUEUE_WAIT, "observe",
+        lambda value, *labels: waits.append(value)
+    )
+
+    # Sem pedido em curso a chegada é desconhecida: nada a registar
+    metrics.observe_chat("m", 10.0, 12.0, None, 13.0)
+    assert waits == []
+
+    metrics.observe_chat("m", 10.0, 12.0, None, 13.0, arrived_at=9.0)
+    assert waits == [3.0]
+
+
+def test_request_started_is_request_arrival():
+    assert profiling.request_started() is None
+
+    def request():
+        timing = profiling.start_request()
+        return timing, profiling.request_started()
+
+    timing, started = contextvars.copy_context().run(request)
+    assert started == timing.started_at
+
+
+def test_captured_observations_are_replayed(registry):
+    histogram = metrics.Histogram("stage_seconds", "Etapas", ("stage",))
+
+    # Como num processo do pool: nada fica no registo local
+    with metrics.capture() as observations:
+        histogram.observe(0.5, "features")
+    assert observations == [("llm_pessoal_stage_seconds", ("features",), 0.5)]
+    assert samples(registry) == {}
+
+    metrics.replay(observations)
+    values = samples(registry)
+    assert values['llm_pessoal_stage_seconds_count{stage="features"}'] == 1
+    assert values['llm_pessoal_stage_seconds_sum{stage="features"}'] == 0.5
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Testes da validação do manifesto de modelos no arranque."""
+
+import pytest
+
+import model_store
+from model_store import ModelStore, parse_revisions, sha256_file
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = tmp_path / "snapshots" / "abc123"
+    path.mkdir(parents=True)
+    (path / "model.safetensors").write_bytes(b"pesos")
+    return path
+
+
+def make_store(tmp_path, snapshot, mode="auto", **kwargs):
+    store = ModelStore(tmp_path / "manifest.json", mode=mode, **kwargs)
+    weights = snapshot / "model.safetensors"
+    store._manifest["models"]["org/model"] = {
+        "revision": snapshot.name,
+        "requested_revision": None,
+        "path": str(snapshot),
+        "safetensors": True,
+        "files": {"model.safetensors": {
+            "size": weights.stat().st_size,
+            "sha256": sha256_file(weights),
+            "mtime_ns": weights.stat().st_mtime_ns
+        }}
+    }
+    return store
+
+
+def test_unchanged_files_are_not_rehashed(tmp_path, snapshot, monkeypatch):
+    store = make_store(tmp_path, snapshot)
+    monkeypatch.setattr(model_store, "sha256_file", None)
+    assert store.resolve("org/model", tmp_path) == (str(snapshot), True)
+
+
+def test_corrupted_file_fails_offline(tmp_path, snapshot):
+    store = make_store(tmp_path, snapshot, mode="offline")
+    # Mesmo tamanho, conteúdo diferente: só o checksum o deteta
+    (snapshot / "model.safetensors").write_bytes(b"PESOS")
+    with pytest.raises(RuntimeError):
+        store.resolve("org/model", tmp_path)
+
+
+def test_other_revision_is_fetched(tmp_path, snapshot, monkeypatch):
+    store = make_store(
+        tmp_path, snapshot, mode="offline", revisions={"org/model": "v2"}
+    )
+    calls = []
+
+    def prefetch(repo_id, cache_dir, revision=None, **kwargs):
+        calls.append((revision, kwargs))
+        return {"path": "v2", "safetensors": True}
+
+    monkeypatch.setattr(store, "prefetch", prefetch)
+    assert store.resolve("org/model", tmp_path) == ("v2", True)
+    assert calls == [("v2", {"local_files_only": True})]
+    # Pedir a revisão registada não volta ao hub
+    assert store.resolve("org/model", tmp_path, "abc123")[0] == str(snapshot)
+
+
+def test_parse_revisions():
+    assert parse_revisions(" a/b=main, c=v1.0,invalido") == {
+        "a/b": "main", "c": "v1.0"
+    }
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Testes do PullManager e do estado partilhado entre workers."""
+
+import asyncio
+
+import pytest
+
+import pull_manager
+from multiworker import SharedPullStates
+from pull_manager import PullManager
+
+
+class FakeClient:
+    """Cliente Ollama com um stream de progresso fixo"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.pulls = 0
+
+    def pull_stream(self, model):
+        self.pulls += 1
+        yield from self.lines
+
+
+@pytest.fixture
+def shared():
+    states = SharedPullStates()
+    yield states
+    states.close()
+
+
+def run_pull(manager, model):
+    async def pull():
+        job = manager.submit(model)
+        await job.task
+        return job
+    return asyncio.run(pull())
+
+
+def test_pull_without_success_is_an_error():
+    manager = PullManager(FakeClient([{"status": "pulling manifest"}]))
+    job = run_pull(manager, "llama3:8b")
+    assert job.status == "error"
+
+
+def test_other_workers_see_the_published_state(shared):
+    owner = PullManager(
+        FakeClient([{"status": "pulling"}, {"status": "success"}]),
+        shared_states=shared
+    )
+    run_pull(owner, "llama3:8b")
+
+    # Outro worker: não tem o job nem inicia um download para o ver
+    client = FakeClient([])
+    other = PullManager(client, shared_states=shared)
+    assert other.shared_state("llama3:8b")["status"] == "success"
+    assert [job["model"] for job in other.list_jobs()] == ["llama3:8b"]
+
+    async def watch():
+        return [state async for state in other.watch_shared("llama3:8b")]
+
+    states = asyncio.run(watch())
+    assert [state["status"] for state in states] == ["success"]
+    assert client.pulls == 0
+    assert other.shared_state("mistral") is None
+
+
+def test_stale_shared_pull_is_reported_as_failed(shared, monkeypatch):
+    shared.write("llama3:8b", {"model": "llama3:8b", "status": "pulling"})
+    monkeypatch.setattr(pull_manager, "STALE_AFTER", -1.0)
+    manager = PullManager(FakeClient([]), shared_states=shared)
+
+    async def watch():
+        return [state async for state in manager.watch_shared("llama3:8b")]
+
+    states = asyncio.run(watch())
+    assert [state["status"] for state in states] == ["error"]
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Testes dos níveis de qualidade e dos custos por nível."""
+
+import pytest
+
+import quality_controller
+from quality_controller import (
+    QualityController, header, lighter_model, scaled_steps, smaller_whisper,
+    start_request
+)
+
+
+class Clock:
+    """time.monotonic controlado pelo teste"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(quality_controller.time, "monotonic", clock)
+    return clock
+
+
+def make_controller(**kwargs):
+    options = {"max_tier": 2, "recover_after": 30.0}
+    options.update(kwargs)
+    return QualityController({"chat": 2}, {"chat": 10.0}, **options)
+
+
+def next_tier(controller):
+    """Nível de um pedido que termina logo (sem contar latência)"""
+    ticket = controller.admit("chat")
+    ticket.release(record=False)
+    return ticket.name
+
+
+def test_queue_pressure_escalates_one_tier_per_cooldown(clock):
+    controller = make_controller()
+    tickets = [controller.admit("chat") for _ in range(2)]
+    assert [t.name for t in tickets] == ["full", "full"]
+
+    # Terceiro pedido em curso: fila acima do limite
+    assert controller.admit("chat").name == "reduced"
+    # Dentro do intervalo mínimo não degrada outra vez
+    assert controller.admit("chat").name == "reduced"
+    clock.now += quality_controller.ESCALATE_COOLDOWN
+    assert controller.admit("chat").name == "minimal"
+    clock.now += quality_controller.ESCALATE_COOLDOWN
+    assert controller.admit("chat").name == "minimal"
+
+
+def test_max_tier_bounds_degradation(clock):
+    controller = make_controller(max_tier=1)
+    held = []
+    for _ in range(4):
+        held.append(controller.admit("chat"))
+        clock.now += quality_controller.ESCALATE_COOLDOWN
+    assert controller.admit("chat").name == "reduced"
+
+
+def test_max_tier_zero_disables(clock):
+    controller = make_controller(max_tier=0)
+    assert all(controller.admit("chat").tier == 0 for _ in range(10))
+
+
+def test_latency_slo_escalates(clock):
+    controller = make_controller()
+    for _ in range(quality_controller.MIN_LATENCY_SAMPLES):
+        controller.admit("chat").release(latency=25.0)
+    assert controller.admit("chat").name == "reduced"
+
+
+def test_cancelled_requests_do_not_count_latency(clock):
+    controller = make_controller()
+    for _ in range(quality_controller.MIN_LATENCY_SAMPLES):
+        controller.admit("chat").release(latency=25.0, record=False)
+    assert controller.admit("chat").name == "full"
+
+
+def test_recovers_one_tier_per_calm_period(clock):
+    controller = make_controller()
+    held = [controller.admit("chat") for _ in range(3)]
+    clock.now += quality_controller.ESCALATE_COOLDOWN
+    next_tier(controller)
+    assert controller.services["chat"].tier == 2
+    for ticket in held:
+        ticket.release(record=False)
+
+    # Um pedido isolado (metade da fila) não conta como pressão
+    clock.now += 29.0
+    assert next_tier(controller) == "minimal"
+    clock.now += 30.0
+    assert next_tier(controller) == "reduced"
+    clock.now += 30.0
+    assert next_tier(controller) == "full"
+
+
+def test_release_is_idempotent(clock):
+    controller = make_controller()
+    ticket = controller.admit("chat")
+    ticket.release()
+    ticket.release()
+    assert controller.services["chat"].in_flight == 0
+
+
+def test_track_skips_latency_on_error(clock):
+    controller = make_controller()
+    with pytest.raises(RuntimeError):
+        with controller.track("chat"):
+            raise RuntimeError("falhou")
+    load = controller.services["chat"]
+    assert (load.in_flight, len(load.latencies)) == (0, 0)
+    with controller.track("chat"):
+        pass
+    assert len(load.latencies) == 1
+
+
+def test_share_divides_queue_limits():
+    controller = make_controller()
+    controller.share(2)
+    assert controller.services["chat"].max_queue == 1
+
+
+def test_header_reports_lowest_tier():
+    assert header({}) is None
+    assert header({"chat": "full", "whisper": "minimal"}) == "minimal"
+
+
+def test_admit_tags_current_request(clock):
+    controller = make_controller()
+    tags = start_request()
+    controller.admit("image").release(record=False)
+    assert tags == {"image": "full"}
+
+
+@pytest.mark.parametrize("requested, tier, expected", [
+    (30, 0, 30),
+    (30, 1, 18),
+    (30, 2, 10),
+    (10, 2, 8),
+    (5, 2, 5),
+])
+def test_scaled_steps(requested, tier, expected):
+    assert scaled_steps(requested, tier, min_steps=8) == expected
+
+
+@pytest.mark.parametrize("model, optimal, floor, expected", [
+    ("openai/whisper-small", "medium", "base", "openai/whisper-base"),
+    ("openai/whisper-medium", "tiny", "base", "openai/whisper-base"),
+    ("openai/whisper-large-v3", "medium", "tiny", "openai/whisper-medium"),
+    ("openai/whisper-base", "tiny", "base", None),
+    ("openai/whisper-tiny", "tiny", "tiny", None),
+    ("distil-whisper", "tiny", "tiny", None),
+])
+def test_smaller_whisper(model, optimal, floor, expected):
+    assert smaller_whisper(model, optimal, floor) == expected
+
+
+KNOWN = [
+    {"name": "llama3.1:latest", "params_b": 8.0},
+    {"name": "mistral:latest", "params_b": 7.2},
+    {"name": "phi3:mini", "params_b": 3.8},
+    {"name": "qwen:0.5b", "params_b": 0.5},
+    {"name": "sem-tamanho"},
+]
+
+
+def test_lighter_model_steps_down_one_size():
+    installed = ["llama3.1:latest", "phi3:mini", "qwen:0.5b"]
+    assert lighter_model("llama3.1:latest", KNOWN, installed) == "phi3:mini"
+    assert lighter_model("phi3:mini", KNOWN, installed) == "qwen:0.5b"
+    assert lighter_model("qwen:0.5b", KNOWN, installed) is None
+
+
+def test_lighter_model_needs_known_installed_model():
+    assert lighter_model("desconhecido", KNOWN, ["phi3:mini"]) is None
+    assert lighter_model("sem-tamanho", KNOWN, ["phi3:mini"]) is None
+    assert lighter_model("llama3.1:latest", KNOWN, []) is None
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Testes da camada de streaming (stop sequences e agregação de frames)."""
+
+import asyncio
+import json
+import time
+
+from streaming import HEARTBEAT_FRAME, StopSequences, TokenStreamer
+
+
+def feed_all(stops, chunks):
+    """Alimentar os chunks e devolver (texto emitido, parou?)"""
+    detector = StopSequences(stops)
+    emitted = []
+    for chunk in chunks:
+        text, stopped = detector.feed(chunk)
+        emitted.append(text)
+        if stopped:
+            return "".join(emitted), True, detector
+    emitted.append(detector.flush())
+    return "".join(emitted), False, detector
+
+
+def test_match_inside_one_chunk():
+    text, stopped, detector = feed_all(["STOP"], ["abc STOP depois"])
+    assert (text, stopped) == ("abc ", True)
+    assert detector.matched == "STOP"
+
+
+def test_match_split_across_chunks():
+    text, stopped, _ = feed_all(
+        ["\nUtilizador:"], ["Olá", " mundo\nUti", "liza", "dor: mais"]
+    )
+    assert (text, stopped) == ("Olá mundo", True)
+
+
+def test_partial_prefix_is_held_back():
+    detector = StopSequences(["</fim>"])
+    assert detector.feed("texto </f") == ("texto ", False)
+    # Afinal não era a stop sequence: o texto retido é libertado
+    assert detector.feed("oo>") == ("</foo>", False)
+
+
+def test_earliest_match_wins():
+    text, stopped, detector = feed_all(["BBB", "A"], ["xxBBB yyA"])
+    assert (text, stopped) == ("xx", True)
+    assert detector.matched == "BBB"
+
+
+def test_earliest_match_across_held_text():
+    text, _, detector = feed_all(["ab", "bc"], ["xa", "bc"])
+    assert text == "x"
+    assert detector.matched == "ab"
+
+
+def test_flush_returns_held_text_at_end_of_stream():
+    text, stopped, detector = feed_all(["STOP"], ["fim ST"])
+    assert (text, stopped) == ("fim ST", False)
+    assert detector.matched is None
+    assert detector.flush() == ""
+
+
+def test_empty_stops_are_ignored():
+    text, stopped, _ = feed_all(["", "X"], ["abc"])
+    assert (text, stopped) == ("abc", False)
+
+
+def ollama_chunks(tokens, delay=0.0):
+    """Gerador no formato do generate_stream do Ollama"""
+    for token in tokens:
+        if delay:
+            time.sleep(delay)
+        yield {"response": token, "done": False}
+    yield {"response": "", "done": True, "done_reason": "stop"}
+
+
+def run_events(streamer):
+    async def consume():
+        return [frame async for frame in streamer.events()]
+    return asyncio.run(consume())
+
+
+def frame_payloads(frames):
+    return [
+        json.loads(frame[len("data: "):])
+        for frame in frames if frame.startswith("data: ")
+    ]
+
+
+def test_tokens_coalesce_into_one_frame():
+    streamer = TokenStreamer(
+        ollama_chunks(["Olá", " ", "mundo", "!"]),
+        flush_interval=5.0, flush_bytes=1024
+    )
+    payloads = frame_payloads(run_events(streamer))
+    assert payloads == [
+        {"content": "Olá mundo!"},
+        {"done": True, "done_reason": "stop"},
+    ]
+    assert streamer.text == "Olá mundo!"
+    assert streamer.done
+
+
+def test_flush_bytes_splits_frames():
+    streamer = TokenStreamer(
+        ollama_chunks(["abc", "def", "ghi", "j"]),
+        flush_interval=5.0, flush_bytes=6
+    )
+    contents = [
+        payload["content"]
+        for payload in frame_payloads(run_events(streamer))
+        if "content" in payload
+    ]
+    assert contents == ["abcdef", "ghij"]
+
+
+def test_flush_interval_bounds_token_delay():
+    streamer = TokenStreamer(
+        ollama_chunks(["a", "b"], delay=0.2),
+        flush_interval=0.01, flush_bytes=1024
+    )
+    contents = [
+        payload["content"]
+        for payload in frame_payloads(run_events(streamer))
+        if "content" in payload
+    ]
+    assert contents == ["a", "b"]
+
+
+def test_heartbeat_when_idle():
+    streamer = TokenStreamer(
+        ollama_chunks(["a"], delay=0.3),
+        flush_interval=0.01, heartbeat_interval=0.05
+    )
+    frames = run_events(streamer)
+    assert frames[0] == HEARTBEAT_FRAME
+    assert frame_payloads(frames)[-1]["done"] is True
+
+
+def test_error_chunk_ends_stream_with_error_frame():
+    def source():
+        yield {"response": "parcial", "done": False}
+        yield {"error": "modelo não encontrado"}
+
+    streamer = TokenStreamer(source(), flush_interval=5.0)
+    payloads = frame_payloads(run_events(streamer))
+    assert payloads == [
+        {"content": "parcial"},
+        {"error": "modelo não encontrado"},
+    ]
+    assert streamer.error == "modelo não encontrado"
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Testes da cache de transcrições por conteúdo do áudio."""
+
+from transcription_cache import TranscriptionCache, hash_audio
+
+RESULT = {"text": "olá mundo", "language": "pt", "duration": 1.5}
+
+
+def key_for(audio=b"audio", model="whisper-small", language="pt",
+            options=None):
+    return TranscriptionCache.make_key(
+        hash_audio(audio), model, language, options or {"num_beams": 5}
+    )
+
+
+def test_hash_audio_bytes_and_file_match(tmp_path):
+    path = tmp_path / "a.wav"
+    path.write_bytes(b"\x00\x01" * 1000)
+    assert hash_audio(path) == hash_audio(b"\x00\x01" * 1000)
+    assert hash_audio(str(path)) == hash_audio(path)
+
+
+def test_key_depends_on_every_input():
+    base = key_for()
+    assert key_for() == base
+    assert key_for(audio=b"outro") != base
+    assert key_for(model="whisper-base") != base
+    assert key_for(language="en") != base
+    assert key_for(options={"num_beams": 1}) != base
+
+
+def test_key_ignores_option_order():
+    assert key_for(options={"a": 1, "b": 2}) == key_for(
+        options={"b": 2, "a": 1}
+    )
+
+
+def test_hit_returns_marked_copy():
+    cache = TranscriptionCache(max_entries=4)
+    key = key_for()
+    assert cache.get(key) is None
+    cache.put(key, RESULT)
+    hit = cache.get(key)
+    assert hit == dict(RESULT, cached=True)
+    hit["text"] = "alterado"
+    assert cache.get(key)["text"] == "olá mundo"
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_errors_and_cached_flag_are_not_stored():
+    cache = TranscriptionCache(max_entries=4)
+    cache.put("erro", {"error": "falhou"})
+    assert cache.get("erro") is None
+    cache.put("k", dict(RESULT, cached=True))
+    assert cache._entries["k"] == RESULT
+
+
+def test_lru_eviction():
+    cache = TranscriptionCache(max_entries=2)
+    cache.put("a", RESULT)
+    cache.put("b", RESULT)
+    cache.get("a")  # "b" passa a ser o menos usado
+    cache.put("c", RESULT)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_disabled_cache():
+    cache = TranscriptionCache(max_entries=0)
+    cache.put("a", RESULT)
+    assert cache.get("a") is None
+    assert not cache.get_status()["enabled"]
+
+
+def test_disk_layer_survives_restart(tmp_path):
+    key = key_for()
+    TranscriptionCache(max_entries=4, disk_dir=tmp_path).put(key, RESULT)
+    assert (tmp_path / key[:2] / f"{key}.json").exists()
+
+    restarted = TranscriptionCache(max_entries=4, disk_dir=tmp_path)
+    assert restarted.get(key) == dict(RESULT, cached=True)
+    assert restarted.disk_hits == 1
+    # Promovido para a memória: o segundo acerto não vai ao disco
+    restarted.get(key)
+    assert restarted.disk_hits == 1
+
+
+def test_corrupt_disk_entry_is_a_miss(tmp_path):
+    key = key_for()
+    path = tmp_path / key[:2] / f"{key}.json"
+    path.parent.mkdir()
+    path.write_text("{truncado", encoding="utf-8")
+    cache = TranscriptionCache(max_entries=4, disk_dir=tmp_path)
+    assert cache.get(key) is None
+    assert cache.misses == 1
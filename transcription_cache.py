@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Cache de transcrições por conteúdo do áudio.
+A chave junta o hash do áudio, o modelo, o idioma e as opções de
+descodificação; o mesmo upload repetido não volta a passar pelo Whisper.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_audio(audio_data: Union[bytes, str, Path]) -> str:
+    """SHA-256 dos bytes do áudio (ficheiro lido por blocos)"""
+    digest = hashlib.sha256()
+    if isinstance(audio_data, bytes):
+        digest.update(audio_data)
+    else:
+        with open(audio_data, "rb") as source:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TranscriptionCache:
+    """
+    LRU em memória com uma camada opcional em disco.
+
+    Em disco cada entrada é um JSON em <dir>/<2 primeiros>/<chave>.json;
+    um acerto em disco é promovido para a memória.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        disk_dir: Optional[Path] = None
+    ):
+        """
+        Args:
+            max_entries: Entradas em memória (0 desativa a cache)
+            disk_dir: Diretório da camada em disco (None desativa)
+        """
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(
+        audio_hash: str, model: str, language: str,
+        options: Dict[str, Any]
+    ) -> str:
+        """Chave estável para (áudio, modelo, idioma, opções)"""
+        payload = json.dumps(
+            [audio_hash, model, language, options], sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _remember(self, key: str, result: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Resultado em cache (cópia marcada com cached=True) ou None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+
+        if result is None and self.disk_dir:
+            try:
+                result = json.loads(
+                    self._disk_path(key).read_text(encoding="utf-8")
+                )
+            except (OSError, ValueError):
+                result = None
+            if result is not None:
+                self.disk_hits += 1
+                self._remember(key, result)
+
+        if result is None:
+            self.misses += 1
+            metrics.CACHE_MISSES.inc("transcription")
+            return None
+        self.hits += 1
+        metrics.CACHE_HITS.inc("transcription")
+        return dict(result, cached=True)
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """Guardar um resultado bem-sucedido"""
+        if not self.enabled or "error" in result:
+            return
+        result = {k: v for k, v in result.items() if k != "cached"}
+        self._remember(key, result)
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                path.parent.mkdir(exist_ok=True)
+                tmp = path.with_suffix(".tmp")
+                tmp.write_text(
+                    json.dumps(result, ensure_ascii=False), encoding="utf-8"
+                )
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.warning("Falha ao gravar transcrição em disco: %s", e)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_status(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "disk": str(self.disk_dir) if self.disk_dir else None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None
+        }
@@ -52,6 +52,7 @@ WHISPER_MODELS = {
 }
 
 SUPPORTED_LANGUAGES = {
+    "auto": "Deteção automática",
     "pt": "Português",
     "en": "English", 
     "es": "Español",
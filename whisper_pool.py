@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Execução do Whisper num pool de processos.
+Cada processo carrega a sua cópia completa do modelo (a memória cresce
+com WHISPER_WORKERS) e recebe o PCM por memória partilhada, para a
+transcrição não competir pelo GIL com o event loop da API.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import metrics
+from audio_upload import decode_audio_into, ffmpeg_available, pcm_capacity
+from cancellation import CancellationToken, GenerationCancelled
+from transcription_cache import TranscriptionCache, hash_audio
+
+logger = logging.getLogger(__name__)
+
+# Bloco de memória partilhada: [flag de cancelamento][padding][PCM float32]
+CANCEL_FLAG = 0
+PCM_OFFSET = 8
+
+# Intervalo de verificação do cancelamento no processo principal
+CANCEL_POLL_INTERVAL = 0.1
+
+# Estado do processo trabalhador
+_service = None
+
+
+class SharedFlagToken(CancellationToken):
+    """Token de cancelamento lido de um byte em memória partilhada."""
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._buffer = buffer
+
+    @property
+    def cancelled(self) -> bool:
+        return self._buffer[CANCEL_FLAG] != 0
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled("cancelado")
+
+
+def _init_worker(model_name: str, device: str, threads: int):
+    """Inicializador de cada processo: threads do torch e modelo"""
+    global _service
+    import torch
+
+    torch.set_num_threads(threads)
+    from whisper_service import WhisperService
+
+    _service = WhisperService(model_name=model_name, device=device)
+    _service.load_model()
+
+
+def _worker_ping() -> int:
+    return os.getpid()
+
+
+def _worker_transcribe(
+    shm_name: str, samples: int, language: str, decoding=None
+) -> dict:
+    """
+    Transcrever o PCM de um bloco de memória partilhada.
+
+    As durações das etapas não ficam no registo deste processo (não é
+    exportado): voltam em result["metrics"] para o processo principal.
+    """
+    import numpy as np
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        audio = np.ndarray(
+            (samples,), dtype=np.float32, buffer=shm.buf, offset=PCM_OFFSET
+        )
+        token = SharedFlagToken(shm.buf)
+        with metrics.capture() as observations:
+            try:
+                result = _service.transcribe_array(
+                    audio, language, token, decoding=decoding
+                )
+            except GenerationCancelled:
+                result = {"cancelled": True}
+        del audio
+        result["metrics"] = observations
+        return result
+    finally:
+        shm.close()
+
+
+class WhisperProcessPool:
+    """
+    Pool de processos Whisper com transferência do áudio sem cópias.
+
+    O processo principal descodifica o áudio (ffmpeg) diretamente para a
+    memória partilhada; o trabalhador lê-o como array numpy sem copiar.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        device: str = "cpu",
+        workers: int = 2,
+        threads_per_worker: Optional[int] = None,
+        max_duration: float = 300.0,
+        fallback_decoder=None,
+        cache: Optional[TranscriptionCache] = None,
+        decoding_options: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Args:
+            model_name: Modelo Whisper carregado em cada processo
+            device: Dispositivo dos trabalhadores
+            workers: Número de processos
+            threads_per_worker: Threads do torch por processo
+            max_duration: Duração máxima do áudio (s)
+            fallback_decoder: Função caminho -> array quando não há ffmpeg
+            cache: Cache de transcrições partilhada com o modo thread
+            decoding_options: Opções do generate (para a chave da cache)
+        """
+        self.model_name = model_name
+        self.device = device
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker or max(
+            1, (os.cpu_count() or 1) // self.workers
+        )
+        self.max_duration = max_duration
+        self.fallback_decoder = fallback_decoder
+        self.cache = cache
+        self.decoding_options = decoding_options or {}
+        self.active = 0
+        self.completed = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # spawn: o torch não é seguro após fork com threads já criadas
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.model_name, self.device, self.threads_per_worker)
+        )
+
+    async def start(self):
+        """Criar os processos e carregar o modelo em todos"""
+        if self._executor is None:
+            self._executor = self._create_executor()
+        loop = asyncio.get_running_loop()
+        logger.info(
+            "🎙️ A iniciar %d processos Whisper (%d threads cada)",
+            self.workers, self.threads_per_worker
+        )
+        pids = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, _worker_ping)
+            for _ in range(self.workers)
+        ))
+        logger.info("✅ Processos Whisper prontos: %s", sorted(set(pids)))
+
+    async def set_model(self, model_name: str):
+        """Trocar de modelo recriando os processos"""
+        old = self._executor
+        self.model_name = model_name
+        self._executor = self._create_executor()
+        if old is not None:
+            await asyncio.to_thread(old.shutdown, True)
+        await self.start()
+
+    def _prepare(self, audio_path: Path):
+        """Descodificar o áudio para um bloco de memória partilhada"""
+        capacity = pcm_capacity(self.max_duration)
+        shm = shared_memory.SharedMemory(
+            create=True, size=PCM_OFFSET + capacity
+        )
+        try:
+            shm.buf[CANCEL_FLAG] = 0
+            target = shm.buf[PCM_OFFSET:]
+            try:
+                if ffmpeg_available():
+                    samples = decode_audio_into(
+                        audio_path, target, self.max_duration
+                    )
+                else:
+                    audio = self.fallback_decoder(audio_path)
+                    data = audio.astype("float32").tobytes()[:capacity]
+                    target[:len(data)] = data
+                    samples = len(data) // 4
+            finally:
+                target.release()
+            return shm, samples
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+
+    async def transcribe(
+        self,
+        audio_path: Path,
+        language: str = "pt",
+        cancel_token: Optional[CancellationToken] = None,
+        decoding: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Transcrever num processo do pool.
+
+        Raises:
+            GenerationCancelled: Se o token for cancelado
+        """
+        if self._executor is None:
+            self._executor = self._create_executor()
+        cancel_token = cancel_token or CancellationToken()
+        cache_key = None
+        if self.cache is not None and self.cache.enabled:
+            audio_hash = await asyncio.to_thread(hash_audio, audio_path)
+            cache_key = self.cache.make_key(
+                audio_hash, self.model_name, language,
+                dict(self.decoding_options, **(decoding or {}))
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        started = time.perf_counter()
+
+        with metrics.WHISPER_STAGE_DURATION.time("decode"):
+            shm, samples = await asyncio.to_thread(self._prepare, audio_path)
+
+        loop = asyncio.get_running_loop()
+        self.active += 1
+        future = loop.run_in_executor(
+            self._executor, _worker_transcribe, shm.name, samples, language,
+            decoding
+        )
+        try:
+            # Propagar o cancelamento ao processo pela flag partilhada
+            while True:
+                done, _ = await asyncio.wait(
+                    {future}, timeout=CANCEL_POLL_INTERVAL
+                )
+                if done:
+                    break
+                if cancel_token.cancelled:
+                    shm.buf[CANCEL_FLAG] = 1
+            result = future.result()
+        finally:
+            self.active -= 1
+            if not future.done():
+                shm.buf[CANCEL_FLAG] = 1
+            shm.close()
+            shm.unlink()
+
+        # O "total" do processo não inclui a descodificação nem a espera
+        # no pool: o principal regista o seu
+        metrics.replay([
+            observation for observation in result.pop("metrics", ())
+            if observation[1] != ("total",)
+        ])
+        if result.get("cancelled"):
+            raise GenerationCancelled(cancel_token.reason or "cancelado")
+        self.completed += 1
+        metrics.WHISPER_STAGE_DURATION.observe(
+            time.perf_counter() - started, "total"
+        )
+        if cache_key is not None:
+            self.cache.put(cache_key, result)
+        result["execution"] = "process"
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "execution": "process",
+            "model": self.model_name,
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            "active": self.active,
+            "completed": self.completed,
+            "running": self._executor is not None,
+            "transcription_cache": (
+                self.cache.get_status() if self.cache is not None else None
+            )
+        }
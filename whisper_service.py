@@ -5,21 +5,72 @@ Serviço Whisper para Reconhecimento de Voz
 Integra modelos Whisper para transcrição de áudio
 """
 
-import torch
-import torchaudio
-import librosa
-import numpy as np
-from transformers import WhisperProcessor, WhisperForConditionalGeneration
-from typing import Optional, Union
+import importlib.util
+import sys
+from typing import TYPE_CHECKING, Optional, Union
 import logging
 import os
 from pathlib import Path
 import tempfile
-from pydub import AudioSegment
 import io
+import time
+
+import metrics
+from audio_upload import decode_audio, ffmpeg_available
+from model_store import WHISPER_CACHE_DIR, model_store, pretrained_kwargs
+from cancellation import CancellationToken, GenerationCancelled
+from transcription_cache import TranscriptionCache, hash_audio
+from whisper_config import DEFAULT_CONFIG
+
+# torch, transformers, numpy e pydub são importados no primeiro uso para
+# não atrasar o arranque do servidor; aqui só se verifica que existem
+for _dependency in ("torch", "transformers", "numpy", "pydub"):
+    if importlib.util.find_spec(_dependency) is None:
+        raise ImportError(f"Dependência do Whisper em falta: {_dependency}")
+
+if TYPE_CHECKING:
+    import numpy as np
 
 logger = logging.getLogger(__name__)
 
+_stopping_criteria_class = None
+
+# Opções de descodificação do generate (também fazem parte da chave da
+# cache de transcrições)
+DECODING_OPTIONS = {
+    "max_length": 448,
+    "num_beams": DEFAULT_CONFIG["beam_size"],
+    "temperature": DEFAULT_CONFIG["temperature"],
+}
+
+
+def cancellation_stopping_criteria(cancel_token: CancellationToken):
+    """
+    Cria um StoppingCriteriaList que interrompe o beam search assim que o
+    token é cancelado.
+    """
+    global _stopping_criteria_class
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    if _stopping_criteria_class is None:
+        class CancellationStoppingCriteria(StoppingCriteria):
+            def __init__(self, token: CancellationToken):
+                self.cancel_token = token
+
+            def __call__(self, input_ids, scores, **kwargs):
+                return torch.full(
+                    (input_ids.shape[0],),
+                    self.cancel_token.cancelled,
+                    dtype=torch.bool,
+                    device=input_ids.device
+                )
+
+        _stopping_criteria_class = CancellationStoppingCriteria
+
+    return StoppingCriteriaList([_stopping_criteria_class(cancel_token)])
+
+
 class WhisperService:
     """
     Serviço para reconhecimento de fala usando Whisper.
@@ -35,20 +86,49 @@ class WhisperService:
             device: Dispositivo para processamento ('auto', 'cuda', 'cpu')
         """
         self.model_name = model_name
-        self.device = self._get_device(device)
+        self.device_setting = device
+        self._device = None
         self.processor = None
         self.model = None
         self.is_loaded = False
+        self._language_tokens = None
+        # Duração máxima aceite (s); o áudio acima disto é cortado
+        self.max_duration = float(
+            os.getenv("WHISPER_MAX_DURATION", DEFAULT_CONFIG["max_duration"])
+        )
         
         # Cache para modelos
-        self.cache_dir = Path("cache/whisper")
+        self.cache_dir = WHISPER_CACHE_DIR
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         
-        logger.info(f"WhisperService inicializado com modelo {model_name} no dispositivo {self.device}")
+        # Cache de transcrições (LRU em memória + opcionalmente em disco)
+        disk_cache = os.getenv(
+            "WHISPER_TRANSCRIPTION_CACHE_DISK", "false"
+        ).lower() == "true"
+        self.transcription_cache = TranscriptionCache(
+            max_entries=int(
+                os.getenv("WHISPER_TRANSCRIPTION_CACHE_SIZE", "256")
+            ),
+            disk_dir=self.cache_dir / "transcriptions" if disk_cache else None
+        )
+        
+        logger.info(
+            "WhisperService inicializado com modelo %s (dispositivo: %s)",
+            model_name, device
+        )
+    
+    @property
+    def device(self) -> str:
+        """Dispositivo efetivo, resolvido no primeiro acesso."""
+        if self._device is None:
+            self._device = self._get_device(self.device_setting)
+        return self._device
     
     def _get_device(self, device: str) -> str:
         """Determina o dispositivo a utilizar."""
         if device == "auto":
+            import torch
+
             if torch.cuda.is_available():
                 return "cuda"
             else:
@@ -63,17 +143,23 @@ class WhisperService:
             True se o modelo foi carregado com sucesso
         """
         try:
-            logger.info(f"A carregar modelo Whisper: {self.model_name}")
+            logger.info("A carregar modelo Whisper: %s", self.model_name)
+            from transformers import (
+                WhisperForConditionalGeneration,
+                WhisperProcessor,
+            )
             
-            # Carregar processor e modelo
+            # Carregar processor e modelo do armazém local (sem rede)
+            model_path, use_safetensors = model_store.resolve(
+                self.model_name, self.cache_dir
+            )
             self.processor = WhisperProcessor.from_pretrained(
-                self.model_name,
-                cache_dir=str(self.cache_dir)
+                model_path, local_files_only=True
             )
             
             self.model = WhisperForConditionalGeneration.from_pretrained(
-                self.model_name,
-                cache_dir=str(self.cache_dir)
+                model_path,
+                **pretrained_kwargs(use_safetensors)
             )
             
             # Mover modelo para o dispositivo apropriado
@@ -84,16 +170,20 @@ class WhisperService:
             if self.device == "cuda":
                 self.model = self.model.half()  # Usar precisão half para economizar VRAM
             
+            self._language_tokens = None
             self.is_loaded = True
-            logger.info(f"Modelo Whisper carregado com sucesso no dispositivo {self.device}")
+            logger.info(
+                "Modelo Whisper carregado com sucesso no dispositivo %s",
+                self.device
+            )
             return True
             
         except Exception as e:
-            logger.error(f"Erro ao carregar modelo Whisper: {e}")
+            logger.error("Erro ao carregar modelo Whisper: %s", e)
             self.is_loaded = False
             return False
     
-    def preprocess_audio(self, audio_data: Union[bytes, str, Path]) -> np.ndarray:
+    def preprocess_audio(self, audio_data: Union[bytes, str, Path]) -> "np.ndarray":
         """
         Pré-processa áudio para o formato esperado pelo Whisper.
         
@@ -103,6 +193,19 @@ class WhisperService:
         Returns:
             Array numpy com áudio processado
         """
+        import numpy as np
+
+        # Ficheiros em disco: ffmpeg direto para float32, uma só cópia
+        if not isinstance(audio_data, bytes) and ffmpeg_available():
+            audio_array = decode_audio(Path(audio_data), self.max_duration)
+            logger.info(
+                "Áudio descodificado: %d amostras, %.2fs",
+                len(audio_array), len(audio_array) / 16000
+            )
+            return audio_array
+
+        from pydub import AudioSegment
+
         try:
             # Se for bytes, salvar temporariamente
             if isinstance(audio_data, bytes):
@@ -120,6 +223,9 @@ class WhisperService:
                 # Carregar diretamente do caminho
                 audio_segment = AudioSegment.from_file(str(audio_data))
             
+            # Cortar acima da duração máxima (pydub usa milissegundos)
+            audio_segment = audio_segment[:int(self.max_duration * 1000)]
+
             # Converter para mono e 16kHz (formato esperado pelo Whisper)
             audio_segment = audio_segment.set_channels(1).set_frame_rate(16000)
             
@@ -132,57 +238,194 @@ class WhisperService:
             elif audio_segment.sample_width == 4:  # 32-bit
                 audio_array = audio_array / 2147483648.0
             
-            logger.info(f"Áudio pré-processado: {len(audio_array)} amostras, {len(audio_array)/16000:.2f}s")
+            logger.info(
+                "Áudio pré-processado: %d amostras, %.2fs",
+                len(audio_array), len(audio_array) / 16000
+            )
             return audio_array
             
         except Exception as e:
-            logger.error(f"Erro no pré-processamento de áudio: {e}")
+            logger.error("Erro no pré-processamento de áudio: %s", e)
             raise
     
-    def transcribe(self, audio_data: Union[bytes, str, Path], language: str = "pt") -> dict:
+    def _get_language_tokens(self):
+        """(códigos, ids dos tokens <|xx|>) dos idiomas do modelo"""
+        if self._language_tokens is None:
+            from transformers.models.whisper.tokenization_whisper import (
+                LANGUAGES,
+            )
+
+            tokenizer = self.processor.tokenizer
+            codes, ids = [], []
+            for code in LANGUAGES:
+                token_id = tokenizer.convert_tokens_to_ids(f"<|{code}|>")
+                if token_id is not None and token_id != tokenizer.unk_token_id:
+                    codes.append(code)
+                    ids.append(token_id)
+            self._language_tokens = (codes, ids)
+        return self._language_tokens
+    
+    def detect_language(self, encoder_outputs):
+        """
+        Idioma a partir do primeiro passo do decoder.
+        
+        Reutiliza a saída do encoder já calculada: o custo é um único passo
+        do decoder sobre <|startoftranscript|>.
+        
+        Returns:
+            (código do idioma, probabilidade)
+        """
+        import torch
+
+        codes, ids = self._get_language_tokens()
+        start_id = self.processor.tokenizer.convert_tokens_to_ids(
+            "<|startoftranscript|>"
+        )
+        decoder_input_ids = torch.tensor(
+            [[start_id]], device=encoder_outputs.last_hidden_state.device
+        )
+        logits = self.model(
+            encoder_outputs=encoder_outputs,
+            decoder_input_ids=decoder_input_ids
+        ).logits[0, -1]
+        probs = torch.softmax(logits[ids].float(), dim=-1)
+        best = int(probs.argmax())
+        return codes[best], float(probs[best])
+    
+    def cache_key(
+        self, audio_data: Union[bytes, str, Path], language: str,
+        decoding: Optional[dict] = None
+    ) -> str:
+        """Chave da cache de transcrições para este áudio e modelo"""
+        return self.transcription_cache.make_key(
+            hash_audio(audio_data), self.model_name, language,
+            dict(DECODING_OPTIONS, **(decoding or {}))
+        )
+    
+    def transcribe(
+        self,
+        audio_data: Union[bytes, str, Path],
+        language: str = "pt",
+        cancel_token: Optional[CancellationToken] = None,
+        decoding: Optional[dict] = None
+    ) -> dict:
         """
         Transcreve áudio para texto.
         
         Args:
             audio_data: Dados de áudio
-            language: Código do idioma (pt, en, es, etc.)
+            language: Código do idioma (pt, en, es, etc.) ou "auto"
+            cancel_token: Token que aborta a transcrição quando cancelado
+            decoding: Opções que substituem DECODING_OPTIONS (ex. num_beams)
             
         Returns:
             Dicionário com resultado da transcrição
+            
+        Raises:
+            GenerationCancelled: Se o token for cancelado durante o trabalho
         """
+        cancel_token = cancel_token or CancellationToken()
+        cache_key = None
+        if self.transcription_cache.enabled:
+            cache_key = self.cache_key(audio_data, language, decoding)
+            cached = self.transcription_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
         if not self.is_loaded:
             if not self.load_model():
                 return {"error": "Falha ao carregar modelo Whisper"}
         
+        started = time.perf_counter()
         try:
             # Pré-processar áudio
-            audio_array = self.preprocess_audio(audio_data)
+            with metrics.WHISPER_STAGE_DURATION.time("decode"):
+                audio_array = self.preprocess_audio(audio_data)
+        except Exception as e:
+            logger.error("Erro na transcrição: %s", e)
+            return {"error": str(e)}
+        
+        result = self.transcribe_array(
+            audio_array, language, cancel_token, started, decoding
+        )
+        if cache_key is not None:
+            self.transcription_cache.put(cache_key, result)
+        return result
+    
+    def transcribe_array(
+        self,
+        audio_array: "np.ndarray",
+        language: str = "pt",
+        cancel_token: Optional[CancellationToken] = None,
+        started: Optional[float] = None,
+        decoding: Optional[dict] = None
+    ) -> dict:
+        """
+        Transcreve áudio já descodificado (PCM mono float32 a 16 kHz).
+        
+        Usado por transcribe() e pelos processos do WhisperProcessPool,
+        que recebem o PCM por memória partilhada.
+        """
+        import torch
+
+        cancel_token = cancel_token or CancellationToken()
+        if not self.is_loaded:
+            if not self.load_model():
+                return {"error": "Falha ao carregar modelo Whisper"}
+        
+        started = started or time.perf_counter()
+        try:
+            cancel_token.raise_if_cancelled()
             
             # Processar com Whisper
-            inputs = self.processor(
-                audio_array,
-                sampling_rate=16000,
-                return_tensors="pt"
-            )
+            with metrics.WHISPER_STAGE_DURATION.time("features"):
+                inputs = self.processor(
+                    audio_array,
+                    sampling_rate=16000,
+                    return_tensors="pt"
+                )
             
             # Mover inputs para o dispositivo
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            input_features = inputs["input_features"].to(
+                self.device, dtype=self.model.dtype
+            )
+            cancel_token.raise_if_cancelled()
             
             # Gerar transcrição
+            generate_started = time.perf_counter()
+            detected = language == "auto"
+            confidence = None
             with torch.no_grad():
-                # Forçar idioma se especificado
+                # O encoder corre uma só vez: a deteção de idioma e o
+                # generate usam a mesma saída
+                encoder_outputs = self.model.get_encoder()(input_features)
+                if detected:
+                    with metrics.WHISPER_STAGE_DURATION.time("language"):
+                        language, confidence = self.detect_language(
+                            encoder_outputs
+                        )
+                    logger.info(
+                        "Idioma detetado: %s (%.2f)", language, confidence
+                    )
+                    cancel_token.raise_if_cancelled()
+                
                 forced_decoder_ids = self.processor.get_decoder_prompt_ids(
                     language=language,
                     task="transcribe"
                 )
                 
                 predicted_ids = self.model.generate(
-                    inputs["input_features"],
+                    encoder_outputs=encoder_outputs,
                     forced_decoder_ids=forced_decoder_ids,
-                    max_length=448,
-                    num_beams=5,
-                    temperature=0.0
+                    **dict(DECODING_OPTIONS, **(decoding or {})),
+                    stopping_criteria=cancellation_stopping_criteria(
+                        cancel_token
+                    )
                 )
+            metrics.WHISPER_STAGE_DURATION.observe(
+                time.perf_counter() - generate_started, "generate"
+            )
+            cancel_token.raise_if_cancelled()
             
             # Decodificar resultado
             transcription = self.processor.batch_decode(
@@ -193,35 +436,49 @@ class WhisperService:
             # Limpar texto
             transcription = transcription.strip()
             
-            logger.info(f"Transcrição concluída: {len(transcription)} caracteres")
+            logger.info(
+                "Transcrição concluída: %d caracteres", len(transcription)
+            )
+            metrics.WHISPER_STAGE_DURATION.observe(
+                time.perf_counter() - started, "total"
+            )
             
             return {
                 "text": transcription,
                 "language": language,
+                "language_detected": detected,
+                "language_confidence": confidence,
                 "model": self.model_name,
                 "device": self.device,
-                "duration": len(audio_array) / 16000
+                "duration": len(audio_array) / 16000,
+                "cached": False
             }
             
+        except GenerationCancelled:
+            raise
         except Exception as e:
-            logger.error(f"Erro na transcrição: {e}")
+            logger.error("Erro na transcrição: %s", e)
             return {"error": str(e)}
     
     def get_status(self) -> dict:
         """Retorna o status do serviço."""
+        # Não forçar o import do torch só para reportar o estado
+        torch = sys.modules.get("torch")
         return {
             "loaded": self.is_loaded,
             "model": self.model_name,
-            "device": self.device,
-            "cuda_available": torch.cuda.is_available(),
-            "memory_usage": self._get_memory_usage()
+            "device": self._device or self.device_setting,
+            "cuda_available": torch.cuda.is_available() if torch else None,
+            "memory_usage": self._get_memory_usage(),
+            "transcription_cache": self.transcription_cache.get_status()
         }
     
     def _get_memory_usage(self) -> dict:
         """Retorna informações sobre uso de memória."""
         memory_info = {}
+        torch = sys.modules.get("torch")
         
-        if torch.cuda.is_available() and self.device == "cuda":
+        if torch and torch.cuda.is_available() and self._device == "cuda":
             memory_info["gpu_allocated"] = torch.cuda.memory_allocated() / 1024**3  # GB
             memory_info["gpu_reserved"] = torch.cuda.memory_reserved() / 1024**3    # GB
             memory_info["gpu_total"] = torch.cuda.get_device_properties(0).total_memory / 1024**3  # GB